@@ -1,12 +1,17 @@
 from django.contrib import admin
 from django.contrib.contenttypes.admin import GenericTabularInline
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
 from store.models import Product
-from store.admin import ProductAdmin
-from tags.models import TaggedItem
+from store.admin import PrefixSearchMixin, ProductAdmin
+from tags.admin import TagAdmin
+from tags.models import Tag, TaggedItem
 
-from .models import User
+from .models import ProfileRecord, User
 
 
 @admin.register(User)
@@ -40,3 +45,84 @@ class CustomProductAdmin(ProductAdmin):
 
 admin.site.unregister(Product)
 admin.site.register(Product, CustomProductAdmin)
+
+
+class CustomTagAdmin(PrefixSearchMixin, TagAdmin):
+    pass
+
+
+admin.site.unregister(Tag)
+admin.site.register(Tag, CustomTagAdmin)
+
+
+@admin.register(ProfileRecord)
+class ProfileRecordAdmin(admin.ModelAdmin):
+    list_display = [
+        "created_at",
+        "method",
+        "route",
+        "path",
+        "status_code",
+        "duration",
+        "trigger",
+        "issued_by",
+        "samples",
+    ]
+    list_filter = ["trigger", "route", "created_at"]
+    search_fields = ["path"]
+    readonly_fields = [
+        "created_at",
+        "route",
+        "method",
+        "path",
+        "status_code",
+        "duration",
+        "trigger",
+        "issued_by",
+        "samples",
+        "download",
+        "stacks",
+        "top_allocations",
+    ]
+    exclude = ["collapsed_stacks", "allocations"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:pk>/collapsed/",
+                self.admin_site.admin_view(self.collapsed_view),
+                name="core_profilerecord_collapsed",
+            ),
+            *super().get_urls(),
+        ]
+
+    def collapsed_view(self, request, pk):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        record = get_object_or_404(ProfileRecord, pk=pk)
+        response = HttpResponse(record.collapsed_stacks, content_type="text/plain")
+        response["Content-Disposition"] = f'attachment; filename="profile-{pk}.txt"'
+        return response
+
+    @admin.display(description="Collapsed stacks")
+    def download(self, record):
+        url = reverse("admin:core_profilerecord_collapsed", args=[record.pk])
+        return format_html(
+            '<a href="{}">Download for flamegraph.pl / speedscope</a>', url
+        )
+
+    @admin.display(description="Hottest stacks")
+    def stacks(self, record):
+        return format_html(
+            "<pre>{}</pre>", "\n".join(record.collapsed_stacks.splitlines()[:50])
+        )
+
+    @admin.display(description="Top allocations")
+    def top_allocations(self, record):
+        return format_html("<pre>{}</pre>", record.allocations)
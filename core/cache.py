@@ -0,0 +1,337 @@
+"""
+A two tier cache backend: a small in-process LRU in front of a shared cache.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "core.cache.TwoTierCache",
+            "LOCATION": "default",  # names the worker's LRU
+            "TIMEOUT": 300,
+            "OPTIONS": {
+                "SHARED": "shared",  # the alias of the shared cache
+                "LOCAL_TIMEOUT": 30,
+                "MAX_ENTRIES": 1000,
+                "MAX_BYTES": 8 * 1024 * 1024,
+                "MAX_ITEM_BYTES": 64 * 1024,
+                "LOCAL_PREFIXES": ["store:"],
+                "GENERATION_INTERVAL": 1,
+            },
+        },
+        "shared": {...},
+    }
+
+Reads try the worker's LRU first and fill it from the shared cache. Entries
+are kept pickled, so their size is known and callers can't mutate what the
+next reader gets, for at most LOCAL_TIMEOUT seconds. Only keys starting with
+one of LOCAL_PREFIXES (all of them if unset) go in the LRU, so often written
+keys (replica pins, like versions) don't churn it.
+
+Keys are grouped in namespaces, their first two ":" separated parts
+("store:query:<hash>" is in "store:query"). Every set(), delete() or incr() of
+an LRU key stores a new generation token for its namespace in the shared cache
+(add() doesn't, the key had no value to go stale). A thread in every worker
+looks at the tokens of the namespaces it holds every GENERATION_INTERVAL
+seconds and drops the entries of those another worker changed, which bounds
+how long it can serve a value that was overwritten or deleted elsewhere
+without touching the rest of the LRU, or the shared cache on the request path.
+
+Hits and misses per tier are counted per worker, see all_stats() and /metrics.
+"""
+
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+logger = logging.getLogger(__name__)
+
+# {LOCATION: LocalTier}, Django makes a cache instance per thread and they all
+# share the worker's LRU
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+def namespace(key):
+    return ":".join(key.split(":", 2)[:2])
+
+
+def generation_key(namespace):
+    return f"core.cache:generation:{namespace}"
+
+
+class LocalTier:
+    """
+    The LRU of a worker: {key: (expires_at, pickled value, namespace)},
+    bounded in entries and bytes, and the generation of every namespace it
+    holds as of the last check.
+    """
+
+    def __init__(self, name, max_entries, max_bytes, max_item_bytes):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.generations = {}  # {namespace: token}
+        self._watcher_pid = None
+        self.stats = {
+            "local_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "flushes": 0,
+        }
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, pickled, timeout, namespace=""):
+        if len(pickled) > self.max_item_bytes:
+            self.delete(key)
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + timeout, pickled, namespace)
+            self._bytes += len(pickled)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def _discard(self, key):
+        # With the lock held
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self, namespace=None):
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                for key in [
+                    key for key, entry in self._entries.items() if entry[2] == namespace
+                ]:
+                    self._discard(key)
+            self.stats["flushes"] += 1
+
+    # Cross-worker invalidation
+
+    def learn_generation(self, namespace, shared):
+        # Before the first value of a namespace is read from the shared cache,
+        # so a write made after it can't go unnoticed
+        if namespace not in self.generations:
+            token = shared.get(generation_key(namespace))
+            with self._lock:
+                self.generations.setdefault(namespace, token)
+
+    def bump_generation(self, namespace, shared):
+        key = generation_key(namespace)
+        # Anything written elsewhere since the last check is stale here too
+        if shared.get(key) != self.generations.get(namespace):
+            self.clear(namespace)
+        token = uuid4().hex
+        with self._lock:
+            self.generations[namespace] = token
+        shared.set(key, token, None)
+
+    def check_generations(self, shared):
+        """
+        Drops the entries of the namespaces another worker wrote to since the
+        last check.
+        """
+        with self._lock:
+            namespaces = list(self.generations)
+        if not namespaces:
+            return
+        tokens = shared.get_many([generation_key(name) for name in namespaces])
+        for name in namespaces:
+            token = tokens.get(generation_key(name))
+            if token != self.generations.get(name):
+                self.clear(name)
+                with self._lock:
+                    self.generations[name] = token
+
+    def watch(self, shared_alias, interval):
+        # One thread per worker process, forked workers start their own
+        if self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(
+            target=self._watch,
+            args=(shared_alias, interval),
+            name=f"cache-{self.name}",
+            daemon=True,
+        ).start()
+
+    def _watch(self, shared_alias, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.check_generations(caches[shared_alias])
+            except Exception:
+                # Can't tell what changed meanwhile
+                logger.exception("Checking the generations of %s failed", self.name)
+                with self._lock:
+                    self.generations.clear()
+                self.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                **self.stats,
+            }
+        reads = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["local_hit_ratio"] = stats["local_hits"] / reads if reads else 0
+        stats["hit_ratio"] = (reads - stats["misses"]) / reads if reads else 0
+        return stats
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED", "shared")
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 30)
+        self.local_prefixes = tuple(options.get("LOCAL_PREFIXES") or ())
+        self.generation_interval = options.get("GENERATION_INTERVAL", 1)
+        with _tiers_lock:
+            if location not in _tiers:
+                _tiers[location] = LocalTier(
+                    location,
+                    max_entries=options.get("MAX_ENTRIES", 1000),
+                    max_bytes=options.get("MAX_BYTES", 8 * 1024 * 1024),
+                    max_item_bytes=options.get("MAX_ITEM_BYTES", 64 * 1024),
+                )
+            self.local = _tiers[location]
+
+    @property
+    def shared(self):
+        # Looked up per thread, like any other cache
+        return caches[self.shared_alias]
+
+    def is_local(self, key):
+        return not self.local_prefixes or key.startswith(self.local_prefixes)
+
+    def local_key(self, key, version=None):
+        # Keys go to the shared cache as given, it applies its own KEY_PREFIX
+        # and VERSION, the local tier uses this cache's
+        return self.make_and_validate_key(key, version=version)
+
+    def local_set(self, key, value, version=None, timeout=None):
+        local_timeout = self.local_timeout
+        if timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+        self.local.set(
+            self.local_key(key, version),
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            local_timeout,
+            namespace(key),
+        )
+
+    # The cache API
+
+    def get(self, key, default=None, version=None):
+        local = self.is_local(key)
+        if local:
+            self.local.watch(self.shared_alias, self.generation_interval)
+            pickled = self.local.get(self.local_key(key, version))
+            if pickled is not None:
+                self.local.count("local_hits")
+                return pickle.loads(pickled)
+            self.local.learn_generation(namespace(key), self.shared)
+        # A sentinel, so that cached Nones count as hits
+        missing = object()
+        value = self.shared.get(key, missing, version=version)
+        if value is missing:
+            self.local.count("misses")
+            return default
+        self.local.count("shared_hits")
+        if local:
+            self.local_set(key, value, version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        self.shared.set(key, value, timeout, version=version)
+        if self.is_local(key):
+            self.local.bump_generation(namespace(key), self.shared)
+            self.local_set(key, value, version, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        added = self.shared.add(key, value, timeout, version=version)
+        # The key wasn't there, so no other worker has a current copy to
+        # drop. Only one left over from before it expired, for at most
+        # LOCAL_TIMEOUT
+        if added and self.is_local(key):
+            self.local_set(key, value, version, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        deleted = self.shared.delete(key, version=version)
+        if self.is_local(key):
+            self.local.delete(self.local_key(key, version))
+            self.local.bump_generation(namespace(key), self.shared)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        if self.is_local(key):
+            self.local.delete(self.local_key(key, version))
+            self.local.bump_generation(namespace(key), self.shared)
+        return value
+
+    def has_key(self, key, version=None):
+        if self.is_local(key):
+            if self.local.get(self.local_key(key, version)) is not None:
+                return True
+        return self.shared.has_key(key, version=version)
+
+    def clear(self):
+        # Drops the generation tokens too, every worker flushes what it holds
+        self.shared.clear()
+        self.local.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+def all_stats():
+    with _tiers_lock:
+        tiers = list(_tiers.values())
+    return [tier.get_stats() for tier in tiers]
@@ -0,0 +1,13 @@
+from django.db.backends.mysql import base
+
+from core.db.pool import PooledDatabaseWrapperMixin
+
+
+# ENGINE = "core.db.backends.mysql": the MySQL backend with a connection pool
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def ping_connection(self, connection):
+        try:
+            connection.ping()
+            return True
+        except Exception:
+            return False
@@ -0,0 +1,35 @@
+from django.db.backends.sqlite3 import base
+
+from core.db.pool import PooledDatabaseWrapperMixin
+
+
+class SQLiteDatabaseWrapper(base.DatabaseWrapper):
+    """
+    Runs the pragmas in the database settings under "PRAGMAS" on every new
+    connection, e.g. {"journal_mode": "WAL", "synchronous": "NORMAL"}, and
+    starts transactions with BEGIN <"TRANSACTION_MODE"> when it's set.
+    """
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict.get("PRAGMAS", {}).items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so a writer waits for
+        # busy_timeout instead of failing with "database is locked" when its
+        # read lock can't be upgraded
+        mode = self.settings_dict.get("TRANSACTION_MODE")
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {mode}")
+
+
+# ENGINE = "core.db.backends.sqlite3": the SQLite backend with a connection pool
+class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    def _close(self):
+        # An in-memory database goes away with its connection, it's never pooled
+        if self.is_in_memory_db():
+            return base.DatabaseWrapper._close(self)
+        return super()._close()
@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+# A small connection pool shared by all the threads of a worker. The pooled
+# database backends in core.db.backends check a raw connection out of it instead
+# of opening a new one, and give it back when Django closes the connection at
+# the end of a request.
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        alias,
+        name=None,
+        min_size=0,
+        max_size=10,
+        timeout=5,
+        recycle=3600,
+        pre_ping=True,
+    ):
+        self.alias = alias
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._condition = threading.Condition()
+        self._idle = deque()  # [(connection, created_at), ...]
+        self._created_at = {}  # {id(connection): created_at} for checked out ones
+        self._size = 0
+        self._filled = False
+        self._closed = False
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "discarded": 0,
+        }
+
+    def fill(self, connect):
+        # Opens min_size connections up front, on first use
+        with self._condition:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        for _ in range(missing):
+            try:
+                connection = connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                raise
+            with self._condition:
+                self.stats["connects"] += 1
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+
+    def checkout(self, connect, ping):
+        self.fill(connect)
+        started = time.monotonic()
+        connection = None
+        with self._condition:
+            waited = False
+            while True:
+                if self._idle:
+                    connection, created_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No connection to '{self.alias}' available after {self.timeout}s"
+                    )
+                waited = True
+                self._condition.wait(remaining)
+            if waited:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += time.monotonic() - started
+
+        # Counted under the lock along with the rest, connecting and pinging
+        # happen outside of it
+        counts = ["checkouts"]
+        if connection is not None:
+            if (
+                self.recycle is not None
+                and time.monotonic() - created_at > self.recycle
+            ):
+                self._close(connection)
+                counts.append("recycled")
+                connection = None
+            elif self.pre_ping and not ping(connection):
+                self._close(connection)
+                counts.append("ping_failures")
+                connection = None
+
+        if connection is None:
+            try:
+                connection = connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+            created_at = time.monotonic()
+            counts.append("connects")
+
+        with self._condition:
+            self._created_at[id(connection)] = created_at
+            for name in counts:
+                self.stats[name] += 1
+        return connection
+
+    def checkin(self, connection, discard=False):
+        with self._condition:
+            created_at = self._created_at.pop(id(connection), time.monotonic())
+            # Checked out before the pool was closed
+            discard = discard or self._closed
+        if discard:
+            self._close(connection)
+        with self._condition:
+            if discard:
+                self._size -= 1
+                self.stats["discarded"] += 1
+            else:
+                self._idle.append((connection, created_at))
+            self._condition.notify()
+
+    def close(self):
+        # Closes the idle connections, the ones in use are closed on checkin
+        with self._condition:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._size -= len(idle)
+            self._idle.clear()
+        for connection in idle:
+            self._close(connection)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                "alias": self.alias,
+                "pid": os.getpid(),
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                **self.stats,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, name, options):
+    # One pool per alias, replaced when the alias points at another database,
+    # as the test runner does when it sets up the test databases, so the
+    # connections to the old one aren't handed out
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.name != name:
+            if pool is not None:
+                pool.close()
+            pool = _pools[alias] = ConnectionPool(alias, name, **options)
+        return pool
+
+
+def all_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.get_stats() for pool in pools]
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Mixed into a backend's DatabaseWrapper. Pool options go in the database
+    settings under "POOL": MIN_SIZE, MAX_SIZE, TIMEOUT, RECYCLE, PRE_PING.
+    """
+
+    use_pool = True
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get("POOL", {})
+        return get_pool(
+            self.alias,
+            self.settings_dict["NAME"],
+            {
+                "min_size": options.get("MIN_SIZE", 0),
+                "max_size": options.get("MAX_SIZE", 10),
+                "timeout": options.get("TIMEOUT", 5),
+                "recycle": options.get("RECYCLE", 3600),
+                "pre_ping": options.get("PRE_PING", True),
+            },
+        )
+
+    def get_new_connection(self, conn_params):
+        connect = super().get_new_connection
+        if not self.use_pool:
+            return connect(conn_params)
+        # Given back to the pool it came from, even if the alias was pointed at
+        # another database since
+        self.checked_out_from = self.pool
+        return self.checked_out_from.checkout(
+            lambda: connect(conn_params), self.ping_connection
+        )
+
+    def ping_connection(self, connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if not self.use_pool:
+            return super()._close()
+        # A connection that errored or is closed halfway through a transaction
+        # isn't safe to hand to the next request
+        discard = self.in_atomic_block or (
+            self.errors_occurred and not self.is_usable()
+        )
+        if not discard and not self.autocommit:
+            try:
+                self.connection.rollback()
+            except Exception:
+                discard = True
+        self.checked_out_from.checkin(self.connection, discard=discard)
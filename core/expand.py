@@ -0,0 +1,89 @@
+"""
+Related objects embedded on request, with `?expand=`.
+
+    /store/products/?expand=collection,promotions
+    /store/orders/?expand=customer,items.product
+
+A serializer with ExpandableSerializerMixin lists what it can embed in
+expandable_fields, {name: (serializer class, kwargs)}. An expanded field is
+read only and replaces the field of the same name (a primary key), or is
+added. Only reads expand, writes take and return the usual fields. Dotted
+names go down nested serializers that have the mixin too: "items.product"
+expands the product of each item of the "items" field, and a nested
+serializer expands nothing unless a dotted name reaches it.
+
+The viewset, with ExpandMixin, lists the expansions it accepts in
+expand_prefetches, {name: prefetch_related lookup}, so that each relation is
+loaded with one query for the whole page rather than one per row. Viewsets
+with their own get_queryset() pass it through expand_queryset(), and give
+get_expand() to their serializers as context["expand"].
+"""
+
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+class ExpandMixin:
+    expand_prefetches = {}
+
+    def get_expand(self):
+        if not hasattr(self, "_expand"):
+            request = getattr(self, "request", None)
+            value = ""
+            if request is not None and request.method in ("GET", "HEAD"):
+                value = request.query_params.get("expand", "")
+            names = {name.strip() for name in value.split(",") if name.strip()}
+            unknown = names - set(self.expand_prefetches)
+            if unknown:
+                raise ValidationError(
+                    {
+                        "expand": f"Unknown: {', '.join(sorted(unknown))}, must be "
+                        f"among: {', '.join(self.expand_prefetches)}"
+                    }
+                )
+            self._expand = names
+        return self._expand
+
+    def expand_queryset(self, queryset):
+        lookups = [self.expand_prefetches[name] for name in sorted(self.get_expand())]
+        return queryset.prefetch_related(*lookups) if lookups else queryset
+
+    def get_queryset(self):
+        return self.expand_queryset(super().get_queryset())
+
+
+class ExpandableSerializerMixin:
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Set by the parent for the nested serializers it expands into, the
+        # others expand nothing. Only the root reads the request's
+        expand = getattr(self, "_expand", None)
+        if expand is None:
+            expand = self.context.get("expand", ()) if self.is_root() else ()
+
+        nested = {}
+        for path in expand:
+            name, _, rest = path.partition(".")
+            nested.setdefault(name, set())
+            if rest:
+                nested[name].add(rest)
+
+        for name, paths in nested.items():
+            if name in self.expandable_fields:
+                serializer_class, kwargs = self.expandable_fields[name]
+                fields[name] = serializer_class(read_only=True, **kwargs)
+            field = fields.get(name)
+            if isinstance(field, serializers.ListSerializer):
+                field = field.child
+            if isinstance(field, ExpandableSerializerMixin):
+                field._expand = paths
+        return fields
+
+    def is_root(self):
+        parent = getattr(self, "parent", None)
+        # many=True
+        if isinstance(parent, serializers.ListSerializer):
+            parent = getattr(parent, "parent", None)
+        return parent is None
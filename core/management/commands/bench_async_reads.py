@@ -0,0 +1,109 @@
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(latencies, percent):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+
+def connect(url):
+    parts = urlsplit(url)
+    connection_class = (
+        http.client.HTTPSConnection
+        if parts.scheme == "https"
+        else http.client.HTTPConnection
+    )
+    return connection_class(parts.netloc, timeout=30), parts.path.rstrip("/")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares concurrent-request throughput of a catalog endpoint served by "
+        "a running WSGI server with the same endpoint and its async variant "
+        "(/store/async/...) served by a running ASGI server, at the same number "
+        "of clients. Start both servers with the same settings first, e.g. "
+        "`gunicorn storefront.wsgi -b 127.0.0.1:8000 -w 4 --threads 8` and "
+        "`uvicorn storefront.asgi:application --port 8001 --workers 4`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/store/products/")
+        parser.add_argument("--wsgi-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--asgi-url", default="http://127.0.0.1:8001")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--clients", type=int, default=20)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path.startswith("/store/"):
+            raise CommandError("Only /store/ paths have async variants")
+        async_path = "/store/async/" + path[len("/store/") :]
+
+        self.stdout.write(
+            f"{options['requests']} requests, {options['clients']} clients"
+        )
+        for name, url, target in [
+            ("WSGI sync ", options["wsgi_url"], path),
+            ("ASGI sync ", options["asgi_url"], path),
+            ("ASGI async", options["asgi_url"], async_path),
+        ]:
+            elapsed, latencies, errors = self.run(
+                url, target, options["requests"], options["clients"]
+            )
+            if not latencies:
+                raise CommandError(f"{name} {url}{target}: every request failed")
+            self.stdout.write(
+                f"{name} {target}: {len(latencies) / elapsed:8.1f} req/s  "
+                f"p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+                f"p95 {percentile(latencies, 95) * 1000:7.2f} ms  "
+                f"errors {errors}"
+            )
+
+    def run(self, url, path, requests, clients):
+        # One keep-alive connection per client, like the load test's shoppers
+        lock = threading.Lock()
+        remaining = [requests]
+        latencies = []
+        errors = [0]
+
+        def client():
+            connection, prefix = connect(url)
+            try:
+                while True:
+                    with lock:
+                        if not remaining[0]:
+                            return
+                        remaining[0] -= 1
+                    start = time.perf_counter()
+                    try:
+                        connection.request(
+                            "GET", prefix + path, headers={"Accept": "application/json"}
+                        )
+                        response = connection.getresponse()
+                        response.read()
+                        ok = response.status == 200
+                    except (OSError, http.client.HTTPException):
+                        connection.close()
+                        ok = False
+                    seconds = time.perf_counter() - start
+                    with lock:
+                        if ok:
+                            latencies.append(seconds)
+                        else:
+                            errors[0] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, errors[0]
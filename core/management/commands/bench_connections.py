@@ -0,0 +1,66 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.db.pool import PooledDatabaseWrapperMixin
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares opening a new database connection per request with checking "
+        "one out of the pool. Every simulated request connects, runs a short "
+        "query and closes the connection, like a request with CONN_MAX_AGE = 0."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=10)
+
+    def handle(self, *args, **options):
+        alias = options["database"]
+        wrapper_class = type(connections[alias])
+        if not issubclass(wrapper_class, PooledDatabaseWrapperMixin):
+            raise CommandError(
+                f"'{alias}' doesn't use a pooled backend (core.db.backends.*)"
+            )
+
+        for use_pool in (False, True):
+            wrapper_class.use_pool = use_pool
+            try:
+                elapsed, latencies = self.run(
+                    alias, options["requests"], options["workers"]
+                )
+            finally:
+                del wrapper_class.use_pool
+            name = "pooled    " if use_pool else "per-request"
+            self.stdout.write(
+                f"{name}: {len(latencies) / elapsed:8.1f} req/s  "
+                f"mean {statistics.mean(latencies) * 1000:6.2f} ms  "
+                f"max {max(latencies) * 1000:6.2f} ms"
+            )
+
+        stats = connections[alias].pool.get_stats()
+        self.stdout.write(
+            f"pool: {stats['connects']} connects for {stats['checkouts']} checkouts, "
+            f"{stats['waits']} waits ({stats['wait_time'] * 1000:.1f} ms), "
+            f"{stats['timeouts']} timeouts"
+        )
+
+    def run(self, alias, requests, workers):
+        def request(_):
+            start = time.perf_counter()
+            connection = connections[alias]
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            connection.close()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            latencies = list(executor.map(request, range(requests)))
+        return time.perf_counter() - start, latencies
@@ -0,0 +1,110 @@
+import importlib
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+# The single MIDDLEWARE list every request went through before PATH_MIDDLEWARE,
+# with the middleware added to the API since, the baseline of the comparison
+FLAT_MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ProfilingMiddleware",
+    "core.middleware.QueryLogMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "store.middleware.SnapshotMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware.ReplicaRoutingMiddleware",
+    "core.middleware.SingleFlightMiddleware",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the per-request cost of the middleware stacks of the current "
+        "settings and of a production settings module against the flat stack "
+        "every request ran before PATH_MIDDLEWARE, on the same requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            action="append",
+            help="Defaults to /store/collections/ and /admin/login/",
+        )
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--against", default="storefront.settings_prod")
+
+    def handle(self, *args, **options):
+        try:
+            production = importlib.import_module(options["against"])
+        except KeyError as exc:
+            raise CommandError(f"{options['against']} needs {exc} in the environment")
+
+        stacks = [
+            ("flat", {"MIDDLEWARE": self.flatten(settings.MIDDLEWARE)}),
+            (
+                "current",
+                {
+                    "MIDDLEWARE": settings.MIDDLEWARE,
+                    "PATH_MIDDLEWARE": getattr(settings, "PATH_MIDDLEWARE", {}),
+                },
+            ),
+            (
+                options["against"].rsplit(".", 1)[-1],
+                {
+                    "MIDDLEWARE": production.MIDDLEWARE,
+                    "PATH_MIDDLEWARE": getattr(production, "PATH_MIDDLEWARE", {}),
+                    "DEBUG": production.DEBUG,
+                },
+            ),
+        ]
+
+        for path in options["path"] or ["/store/collections/", "/admin/login/"]:
+            self.stdout.write(f"{path} ({options['requests']} requests)")
+            baseline = None
+            for name, overrides in stacks:
+                with override_settings(ALLOWED_HOSTS=["localhost"], **overrides):
+                    latencies = self.run(path, options["requests"])
+                mean = statistics.mean(latencies)
+                if baseline is None:
+                    baseline = mean
+                self.stdout.write(
+                    f"  {name:>15}: mean {mean * 1000:6.3f} ms  "
+                    f"p50 {statistics.median(latencies) * 1000:6.3f} ms  "
+                    f"difference {(mean - baseline) * 1000:+6.3f} ms"
+                )
+
+    def flatten(self, middleware):
+        # The router replaced by the flat list, the rest (the debug toolbar)
+        # is kept so the stacks only differ by the routing
+        flat = []
+        for middleware_path in middleware:
+            if middleware_path == "core.middleware.PathMiddlewareRouter":
+                flat.extend(FLAT_MIDDLEWARE)
+            else:
+                flat.append(middleware_path)
+        return list(dict.fromkeys(flat))
+
+    def run(self, path, requests):
+        client = Client()
+        # Warm up, the first request loads the middleware and the urlconf
+        for _ in range(10):
+            client.get(path, HTTP_HOST="localhost", HTTP_ACCEPT="application/json")
+
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.get(
+                path, HTTP_HOST="localhost", HTTP_ACCEPT="application/json"
+            )
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise CommandError(f"{path} answered {response.status_code}")
+        return latencies
@@ -0,0 +1,164 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from core.middleware import WriteQueue
+from store.models import Cart, CartItem, Product
+
+
+def percentile(latencies, percent):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent cart writes and product reads against copies of the "
+        "SQLite database, once with plain SQLite and once with the "
+        "storefront.settings_sqlite setup (pragmas, read-only reader "
+        "connections, BEGIN IMMEDIATE and a write queue)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--operations", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=16)
+        parser.add_argument(
+            "--write-ratio",
+            type=float,
+            default=0.2,
+            help="Share of the operations that write a cart.",
+        )
+
+    def handle(self, *args, **options):
+        source = settings.DATABASES[options["database"]]
+        if "sqlite3" not in source["ENGINE"]:
+            raise CommandError(f"'{options['database']}' isn't an SQLite database")
+
+        with tempfile.TemporaryDirectory() as directory:
+            plain = os.path.join(directory, "plain.sqlite3")
+            tuned = os.path.join(directory, "tuned.sqlite3")
+            self.copy(source["NAME"], plain)
+            self.copy(source["NAME"], tuned)
+
+            from storefront import settings_sqlite
+
+            writer = settings_sqlite.DATABASES["default"]
+            reader = settings_sqlite.DATABASES["reader"]
+            setups = [
+                (
+                    "plain",
+                    {"ENGINE": "django.db.backends.sqlite3", "NAME": plain},
+                    None,
+                    None,
+                ),
+                (
+                    "tuned",
+                    {**writer, "NAME": tuned},
+                    {**reader, "NAME": tuned},
+                    WriteQueue(),
+                ),
+            ]
+
+            self.stdout.write(
+                f"{options['operations']} operations, {options['workers']} workers, "
+                f"{options['write_ratio']:.0%} writes"
+            )
+            for name, writer, reader, queue in setups:
+                self.add_database(f"bench_{name}", writer)
+                if reader is not None:
+                    self.add_database(f"bench_{name}_reader", reader)
+                try:
+                    result = self.run(
+                        f"bench_{name}",
+                        f"bench_{name}_reader" if reader else f"bench_{name}",
+                        queue,
+                        options,
+                    )
+                finally:
+                    connections.close_all()
+                self.report(name, *result)
+
+    def copy(self, source, destination):
+        # Through the backup API, so a database in WAL mode copies consistently
+        with sqlite3.connect(source) as original, sqlite3.connect(destination) as copy:
+            original.backup(copy)
+            copy.execute("PRAGMA journal_mode = DELETE")
+        original.close()
+        copy.close()
+
+    def add_database(self, alias, settings_dict):
+        connections.settings[alias] = connections.configure_settings(
+            {DEFAULT_DB_ALIAS: settings_dict}
+        )[DEFAULT_DB_ALIAS]
+
+    def run(self, writer, reader, queue, options):
+        product_ids = list(Product.objects.using(writer).values_list("id", flat=True))
+        if not product_ids:
+            raise CommandError("There are no products to put in carts")
+
+        def write():
+            if queue is not None and not queue.acquire(timeout=10):
+                raise OperationalError("write queue timeout")
+            try:
+                with transaction.atomic(using=writer):
+                    cart = Cart.objects.using(writer).create()
+                    CartItem.objects.using(writer).create(
+                        cart_id=cart.id,
+                        product_id=random.choice(product_ids),
+                        quantity=1,
+                    )
+            finally:
+                if queue is not None:
+                    queue.release()
+
+        def read():
+            list(Product.objects.using(reader).order_by("id")[:20])
+
+        def operation(_):
+            function = write if random.random() < options["write_ratio"] else read
+            start = time.perf_counter()
+            try:
+                function()
+            except OperationalError:
+                return function, None
+            finally:
+                # Every operation stands for a request, which closes its connections
+                connections[writer].close()
+                connections[reader].close()
+            return function, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options["workers"]) as executor:
+            results = list(executor.map(operation, range(options["operations"])))
+        elapsed = time.perf_counter() - start
+
+        latencies = {"write": [], "read": []}
+        errors = 0
+        for function, latency in results:
+            if latency is None:
+                errors += 1
+            else:
+                latencies[function.__name__].append(latency)
+        return elapsed, latencies, errors
+
+    def report(self, name, elapsed, latencies, errors):
+        done = sum(len(values) for values in latencies.values())
+        self.stdout.write(
+            f"{name}: {done / elapsed:8.1f} ops/s, {errors} failed (locked or timed out)"
+        )
+        for kind, values in latencies.items():
+            if values:
+                self.stdout.write(
+                    f"  {kind:5}  p50 {statistics.median(values) * 1000:7.2f} ms  "
+                    f"p95 {percentile(values, 95) * 1000:7.2f} ms  "
+                    f"max {max(values) * 1000:7.2f} ms"
+                )
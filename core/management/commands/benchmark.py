@@ -0,0 +1,457 @@
+import gc
+import json
+import time
+import tracemalloc
+from contextlib import ExitStack
+from decimal import Decimal
+from uuid import UUID
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    teardown_databases,
+)
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.renderers import FastJSONRenderer
+from store.models import Cart, CartItem, Collection, Order, OrderItem, Product
+from store.serializers import CartSerizalizer, OrderSerializer, ProductSerializer
+
+
+def best_of(repeat, function):
+    # Like timeit, without the garbage collector kicking in halfway
+    best = None
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            duration = time.perf_counter() - start
+            best = duration if best is None else min(best, duration)
+    finally:
+        gc.enable()
+    return best
+
+
+def calibrate():
+    # A fixed piece of pure Python work, timings are stored relative to it so
+    # a baseline made on one machine is usable on another
+    return best_of(20, lambda: sum(i * i for i in range(200_000)))
+
+
+def prefetched(instance, name, objects):
+    # What prefetch_related leaves behind, so the serializers don't query
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache = {name: queryset}
+    return instance
+
+
+def make_products(count):
+    return [
+        Product(
+            id=i,
+            title=f"Product {i}",
+            slug=f"product-{i}",
+            description="A product made up for the benchmarks",
+            unit_price=Decimal("12.50") + i % 100,
+            inventory=i % 500,
+            collection_id=i % 10 + 1,
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def make_carts(count, items=3):
+    products = make_products(100)
+    return [
+        prefetched(
+            Cart(id=UUID(int=i)),
+            "items",
+            [
+                CartItem(
+                    id=i * items + j,
+                    cart_id=UUID(int=i),
+                    product=products[(i + j) % 100],
+                    quantity=j + 1,
+                )
+                for j in range(items)
+            ],
+        )
+        for i in range(count)
+    ]
+
+
+def make_orders(count, items=3):
+    products = make_products(100)
+    placed_at = timezone.now()
+    return [
+        prefetched(
+            Order(id=i, customer_id=i % 50 + 1, placed_at=placed_at),
+            "items",
+            [
+                OrderItem(
+                    id=i * items + j,
+                    order_id=i,
+                    product=products[(i + j) % 100],
+                    unit_price=products[(i + j) % 100].unit_price,
+                    quantity=j + 1,
+                )
+                for j in range(items)
+            ],
+        )
+        for i in range(count)
+    ]
+
+
+SERIALIZERS = [
+    (ProductSerializer, make_products),
+    (CartSerizalizer, make_carts),
+    (OrderSerializer, make_orders),
+]
+
+# The first one is the reference, the others must render the same bytes
+RENDERERS = [JSONRenderer, FastJSONRenderer]
+
+
+def default_baseline():
+    return getattr(
+        settings, "BENCHMARK_BASELINE", settings.BASE_DIR / "benchmarks.json"
+    )
+
+
+def peak_kib(function):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks serializer and JSON renderer throughput, the queries every "
+        "store endpoint "
+        "runs and their peak memory, and compares them with a stored baseline. "
+        "Fails when something got slower or heavier than the tolerance allows, "
+        "or runs more queries than before."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--baseline", default=default_baseline())
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Save the results as the new baseline instead of comparing.",
+        )
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Numbers of objects to serialize",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--time-tolerance",
+            type=float,
+            default=1.5,
+            help="Fail when a serializer takes this many times its baseline.",
+        )
+        parser.add_argument(
+            "--memory-tolerance",
+            type=float,
+            default=1.25,
+            help="Fail when peak memory is this many times its baseline.",
+        )
+        parser.add_argument("--skip-serializers", action="store_true")
+        parser.add_argument("--skip-endpoints", action="store_true")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        results = {
+            "calibration": calibrate(),
+            "serializers": {},
+            "renderers": {},
+            "endpoints": {},
+        }
+        if not options["skip_serializers"]:
+            self.stdout.write(self.style.MIGRATE_HEADING("Serializers"))
+            self.bench_serializers(sizes, options["repeat"], results)
+        if not options["skip_endpoints"]:
+            self.stdout.write(self.style.MIGRATE_HEADING("Endpoints"))
+            results["endpoints"] = self.bench_endpoints()
+
+        if options["update_baseline"]:
+            with open(options["baseline"], "w") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+                file.write("\n")
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+
+        try:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            raise CommandError(
+                f"No baseline at {options['baseline']}, make one with --update-baseline"
+            )
+        regressions = self.compare(baseline, results, options)
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} regressions:\n" + "\n".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("\nNo regressions"))
+
+    def bench_serializers(self, sizes, repeat, results):
+        for serializer_class, make_objects in SERIALIZERS:
+            for size in sizes:
+                objects = make_objects(size)
+                best = best_of(
+                    repeat, lambda: serializer_class(objects, many=True).data
+                )
+                result = {"us_per_object": round(best / size * 1e6, 3)}
+                # Memory grows with the size, the smallest is enough
+                if size == min(sizes):
+                    result["peak_kib"] = peak_kib(
+                        lambda: serializer_class(objects, many=True).data
+                    )
+                name = f"{serializer_class.__name__}:{size}"
+                results["serializers"][name] = result
+                self.stdout.write(
+                    f"  {name:28} {result['us_per_object']:9.2f} us/object  "
+                    f"{size / best:10.0f} objects/s"
+                )
+                self.bench_renderers(
+                    name, serializer_class(objects, many=True).data, repeat, results
+                )
+
+    def bench_renderers(self, name, data, repeat, results):
+        expected = None
+        stock = None
+        for renderer_class in RENDERERS:
+            renderer = renderer_class()
+            content = renderer.render(data)
+            if expected is None:
+                expected = content
+            elif content != expected:
+                raise CommandError(
+                    f"{renderer_class.__name__} output differs from "
+                    f"{RENDERERS[0].__name__} for {name}"
+                )
+            best = best_of(repeat, lambda: renderer.render(data))
+            results["renderers"][f"{renderer_class.__name__}:{name}"] = {
+                "us_per_object": round(best / len(data) * 1e6, 3)
+            }
+            stock = stock or best
+            self.stdout.write(
+                f"    {renderer_class.__name__:26} {best / len(data) * 1e6:9.2f} "
+                f"us/object  {stock / best:5.1f}x"
+            )
+
+    def bench_endpoints(self):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+            ):
+                return self.run_endpoints()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_endpoints(self):
+        fixtures = self.make_fixtures()
+        results = {}
+        for name, method, path, user, data in self.endpoints(fixtures):
+            result = self.bench_endpoint(method, path, user, data)
+            results[name] = result
+            self.stdout.write(
+                f"  {name:28} {result['status']}  "
+                f"{result['queries']:3} queries  {result['peak_kib']:9.1f} KiB"
+            )
+        return results
+
+    def make_fixtures(self):
+        # Carts and orders are made through the API so they end up on the
+        # right shards
+        User = get_user_model()
+        admin = User.objects.create_user(
+            "bench-admin", "bench-admin@example.com", "bench", is_staff=True
+        )
+        customer = User.objects.create_user(
+            "bench-customer", "bench-customer@example.com", "bench"
+        )
+        collections = Collection.objects.bulk_create(
+            [Collection(title=f"Collection {i}") for i in range(5)]
+        )
+        products = make_products(30)
+        for i, product in enumerate(products):
+            product.collection = collections[i % 5]
+        Product.objects.bulk_create(products)
+
+        client = APIClient()
+        client.force_authenticate(customer)
+        for product in products[:5]:
+            client.post(
+                f"/store/products/{product.id}/reviews/",
+                {"name": "Bench", "description": "Fine"},
+            )
+        carts = []
+        for _ in range(4):
+            cart_id = client.post("/store/carts/").data["id"]
+            for product in products[:5]:
+                client.post(
+                    f"/store/carts/{cart_id}/items/",
+                    {"product_id": product.id, "quantity": 2},
+                )
+            carts.append(cart_id)
+        orders = [
+            client.post("/store/orders/", {"cart_id": cart_id}).data["id"]
+            for cart_id in carts[:3]
+        ]
+        return {
+            "admin": admin,
+            "customer": customer,
+            "product": products[0].id,
+            "collection": collections[0].id,
+            "cart": carts[3],
+            "order": orders[0],
+        }
+
+    def endpoints(self, fixtures):
+        product, cart, order = fixtures["product"], fixtures["cart"], fixtures["order"]
+        admin, customer = fixtures["admin"], fixtures["customer"]
+        return [
+            ("products-list", "get", "/store/products/", None, None),
+            ("products-detail", "get", f"/store/products/{product}/", None, None),
+            ("collection-list", "get", "/store/collections/", None, None),
+            (
+                "collection-detail",
+                "get",
+                f"/store/collections/{fixtures['collection']}/",
+                None,
+                None,
+            ),
+            (
+                "product-reviews-list",
+                "get",
+                f"/store/products/{product}/reviews/",
+                None,
+                None,
+            ),
+            ("autocomplete", "get", "/store/autocomplete/?q=prod", None, None),
+            ("cart-create", "post", "/store/carts/", None, {}),
+            ("cart-detail", "get", f"/store/carts/{cart}/", None, None),
+            ("cart-items-list", "get", f"/store/carts/{cart}/items/", None, None),
+            (
+                "cart-items-create",
+                "post",
+                f"/store/carts/{cart}/items/",
+                None,
+                {"product_id": product, "quantity": 1},
+            ),
+            ("customer-list", "get", "/store/customers/", admin, None),
+            ("customer-me", "get", "/store/customers/me/", customer, None),
+            ("orders-list", "get", "/store/orders/", customer, None),
+            ("orders-list-staff", "get", "/store/orders/", admin, None),
+            ("orders-detail", "get", f"/store/orders/{order}/", customer, None),
+            ("orders-create", "post", "/store/orders/", customer, {"cart_id": cart}),
+        ]
+
+    def bench_endpoint(self, method, path, user, data):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+
+        def request():
+            # Every request starts from the same data
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(transaction.atomic(using=alias))
+                response = getattr(client, method)(path, data, format="json")
+                for alias in connections:
+                    transaction.set_rollback(True, using=alias)
+            return response
+
+        # The first request fills caches (content types, autocomplete indexes...)
+        request()
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            # Without the savepoints of the rollback above
+            if "SAVEPOINT" not in sql:
+                queries.append(sql)
+            return execute(sql, params, many, context)
+
+        # An execute wrapper and not CaptureQueriesContext, the debug toolbar
+        # swaps the debug cursors for its own
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count))
+            response = request()
+        return {
+            "status": response.status_code,
+            "queries": len(queries),
+            "peak_kib": peak_kib(request),
+        }
+
+    def compare(self, baseline, results, options):
+        regressions = []
+        scale = results["calibration"] / baseline["calibration"]
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"\nCompared with the baseline (this machine is {1 / scale:.2f}x "
+                "as fast)"
+            )
+        )
+
+        def check(name, metric, value, expected, tolerance):
+            if expected is None:
+                return
+            ratio = value / expected if expected else float(value > 0) + 1
+            line = (
+                f"  {name:28} {metric:14} {expected:10} -> {value:<10} ({ratio:.2f}x)"
+            )
+            if ratio > tolerance:
+                regressions.append(line.strip())
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        for section in ["serializers", "renderers", "endpoints"]:
+            for name, result in results[section].items():
+                expected = baseline.get(section, {}).get(name)
+                if expected is None:
+                    self.stdout.write(f"  {name:28} not in the baseline")
+                    continue
+                if "us_per_object" in result:
+                    check(
+                        name,
+                        "us_per_object",
+                        result["us_per_object"],
+                        round(expected["us_per_object"] * scale, 3),
+                        options["time_tolerance"],
+                    )
+                if "queries" in result:
+                    # Any extra query is a regression
+                    check(name, "queries", result["queries"], expected["queries"], 1)
+                if "status" in result and result["status"] != expected["status"]:
+                    regressions.append(
+                        f"{name} status {expected['status']} -> {result['status']}"
+                    )
+                if "peak_kib" in result:
+                    check(
+                        name,
+                        "peak_kib",
+                        result["peak_kib"],
+                        expected.get("peak_kib"),
+                        options["memory_tolerance"],
+                    )
+        return regressions
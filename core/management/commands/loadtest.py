@@ -0,0 +1,355 @@
+import http.client
+import json
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import Product
+
+DEFAULT_MIX = "browse=40,search=15,view_cart=15,add_item=15,checkout=5,history=10"
+
+
+def percentile(latencies, percent):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+
+def summarize(latencies, errors):
+    if not latencies:
+        return {"count": 0, "errors": errors}
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # {name: [seconds]}
+        self.errors = {}
+
+    def add(self, name, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(name, [])
+            self.errors.setdefault(name, 0)
+            if ok:
+                self.latencies[name].append(seconds)
+            else:
+                self.errors[name] += 1
+
+    def summary(self):
+        return {
+            name: summarize(self.latencies[name], self.errors[name])
+            for name in sorted(self.latencies)
+        }
+
+
+class Client:
+    """
+    One simulated shopper: its own keep-alive connection, JWT and cart.
+    """
+
+    def __init__(self, base_url, credentials, product_ids, rng, results):
+        parts = urlsplit(base_url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(parts.netloc, timeout=30)
+        self.prefix = parts.path.rstrip("/")
+        self.credentials = credentials
+        self.product_ids = product_ids
+        self.rng = rng
+        self.results = results
+        self.token = None
+        self.cart_id = None
+
+    def request(self, name, method, path, body=None):
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+        if self.token:
+            headers["Authorization"] = f"JWT {self.token}"
+
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, self.prefix + path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            content, status = b"", 0
+        elapsed = time.perf_counter() - start
+        data = None
+        if 200 <= status < 400:
+            try:
+                data = json.loads(content) if content else {}
+            except ValueError:
+                # An HTML error page from a proxy, a cut off body
+                pass
+        self.results.add(name, elapsed, data is not None)
+        return data
+
+    def login(self):
+        username, password = self.credentials
+        data = self.request(
+            "auth-jwt-create",
+            "POST",
+            "/auth/jwt/create/",
+            {"username": username, "password": password},
+        )
+        self.token = data and data["access"]
+
+    def product_id(self):
+        return self.rng.choice(self.product_ids)
+
+    def ensure_cart(self):
+        if self.cart_id is None:
+            data = self.request("carts-create", "POST", "/store/carts/", {})
+            self.cart_id = data and data["id"]
+        return self.cart_id
+
+    # Scenarios
+
+    def browse(self):
+        self.request(
+            "products-list", "GET", f"/store/products/?page={self.rng.randint(1, 5)}"
+        )
+        self.request("products-detail", "GET", f"/store/products/{self.product_id()}/")
+
+    def search(self):
+        word = self.rng.choice(["coffee", "tea", "honey", "rice", "soap", "jam"])
+        self.request("autocomplete", "GET", f"/store/autocomplete/?q={word[:3]}")
+        self.request("products-search", "GET", f"/store/products/?search={word}")
+
+    def view_cart(self):
+        if self.ensure_cart():
+            self.request("carts-detail", "GET", f"/store/carts/{self.cart_id}/")
+
+    def add_item(self):
+        if self.ensure_cart():
+            self.request(
+                "cart-items-create",
+                "POST",
+                f"/store/carts/{self.cart_id}/items/",
+                {"product_id": self.product_id(), "quantity": self.rng.randint(1, 3)},
+            )
+
+    def checkout(self):
+        self.add_item()
+        if self.cart_id and self.token:
+            self.request(
+                "orders-create", "POST", "/store/orders/", {"cart_id": self.cart_id}
+            )
+            # The order empties the cart, start a new one next time
+            self.cart_id = None
+
+    def history(self):
+        if self.token:
+            self.request("orders-list", "GET", "/store/orders/")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests a running server with simulated shoppers: each client logs "
+        "in through /auth/jwt/create/ and runs scenarios picked from a weighted "
+        "mix. Prints and optionally saves a JSON report with throughput and "
+        "p50/p95/p99 latency per endpoint and scenario, and compares it with "
+        "an earlier report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--clients", type=int, default=20)
+        parser.add_argument("--duration", type=float, default=30, help="Seconds")
+        parser.add_argument(
+            "--mix",
+            default=DEFAULT_MIX,
+            help=f"Scenario weights, default {DEFAULT_MIX}",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--password",
+            default=getattr(settings, "SEED_PASSWORD", "storefront"),
+            help="Password of the users created by seed_store.",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument("--compare", help="An earlier JSON report to diff with")
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options["mix"])
+        usernames = list(
+            get_user_model()
+            .objects.filter(username__startswith="seed")
+            .order_by("id")
+            .values_list("username", flat=True)[: options["clients"]]
+        )
+        if not usernames:
+            raise CommandError("No seeded users, run `manage.py seed_store` first")
+        product_ids = list(Product.objects.values_list("id", flat=True)[:10_000])
+        if not product_ids:
+            raise CommandError("No products, run `manage.py seed_store` first")
+
+        results = Results()
+        scenario_results = Results()
+        deadline = time.monotonic() + options["duration"]
+
+        def run(number):
+            rng = random.Random(f"{options['seed']}:{number}")
+            client = Client(
+                options["url"],
+                (usernames[number % len(usernames)], options["password"]),
+                product_ids,
+                rng,
+                results,
+            )
+            attempt("login", client.login)
+            names, weights = zip(*mix.items())
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights)[0]
+                attempt(name, getattr(client, name))
+
+        def attempt(name, scenario):
+            # A response without the expected fields fails the scenario, not
+            # the whole client thread
+            start = time.perf_counter()
+            try:
+                scenario()
+            except Exception:
+                ok = False
+            else:
+                ok = True
+            scenario_results.add(name, time.perf_counter() - start, ok)
+
+        self.stdout.write(
+            f"{options['clients']} clients for {options['duration']:.0f}s "
+            f"against {options['url']}"
+        )
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=run, args=(number,))
+            for number in range(options["clients"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        requests = results.summary()
+        report_scenarios = scenario_results.summary()
+        total = sum(entry["count"] for entry in requests.values())
+        report = {
+            "meta": {
+                "commit": self.git_commit(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "url": options["url"],
+                "clients": options["clients"],
+                "duration": round(elapsed, 2),
+                "mix": mix,
+                "seed": options["seed"],
+            },
+            "totals": {
+                "requests": total,
+                "errors": sum(entry["errors"] for entry in requests.values()),
+                "failed_scenarios": sum(
+                    entry["errors"] for entry in report_scenarios.values()
+                ),
+                "requests_per_second": round(total / elapsed, 2),
+            },
+            "requests": requests,
+            "scenarios": report_scenarios,
+        }
+
+        self.write_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                self.write_comparison(json.load(file), report)
+
+    def parse_mix(self, value):
+        try:
+            mix = {
+                name.strip(): float(weight)
+                for name, weight in (part.split("=") for part in value.split(","))
+            }
+        except ValueError:
+            raise CommandError(f"Invalid --mix '{value}', expected name=weight,...")
+        unknown = [name for name in mix if not callable(getattr(Client, name, None))]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+        return mix
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+        except OSError:
+            return None
+
+    def write_report(self, report):
+        totals = report["totals"]
+        self.stdout.write(
+            f"{totals['requests']} requests, {totals['errors']} errors, "
+            f"{totals['requests_per_second']} req/s, "
+            f"{totals.get('failed_scenarios', 0)} failed scenarios"
+        )
+        for section in ["requests", "scenarios"]:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{section.title()}"))
+            for name, entry in report[section].items():
+                if not entry["count"]:
+                    self.stdout.write(f"  {name:20} {entry['errors']} errors")
+                    continue
+                self.stdout.write(
+                    f"  {name:20} {entry['count']:7}  "
+                    f"p50 {entry['p50_ms']:8.1f}  p95 {entry['p95_ms']:8.1f}  "
+                    f"p99 {entry['p99_ms']:8.1f} ms  {entry['errors']} errors"
+                )
+
+    def write_comparison(self, before, after):
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"\nCompared with {before['meta'].get('commit')} "
+                f"({before['meta'].get('date')})"
+            )
+        )
+        rate_before = before["totals"]["requests_per_second"]
+        rate_after = after["totals"]["requests_per_second"]
+        change = (
+            f" ({(rate_after - rate_before) / rate_before:+.1%})" if rate_before else ""
+        )
+        self.stdout.write(f"  throughput {rate_before} -> {rate_after} req/s{change}")
+        for name, entry in after["requests"].items():
+            old = before["requests"].get(name)
+            if not old or not old.get("count") or not entry.get("count"):
+                continue
+            changes = "  ".join(
+                f"{key[:-3]} {old[key]:.1f} -> {entry[key]:.1f} "
+                f"({(entry[key] - old[key]) / old[key]:+.0%})"
+                for key in ["p50_ms", "p95_ms", "p99_ms"]
+                if old[key]
+            )
+            self.stdout.write(f"  {name:20} {changes}")
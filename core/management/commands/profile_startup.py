@@ -0,0 +1,113 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does before it can answer its first request, after the imports
+# of the entry point itself
+ENTRY_POINTS = {
+    "manage": None,  # python manage.py <command>
+    "wsgi": (
+        "import storefront.wsgi\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+    "asgi": (
+        "import storefront.asgi\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+}
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)")
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts a fresh Python process under `-X importtime` the way a worker "
+        "starts (through manage.py, wsgi.py or asgi.py) and reports where the "
+        "import time goes, per package and per module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entry", choices=ENTRY_POINTS, default="wsgi")
+        parser.add_argument(
+            "--command",
+            default="check",
+            help="The manage.py command to start with --entry manage.",
+        )
+        parser.add_argument(
+            "--settings-module",
+            default=os.environ.get("DJANGO_SETTINGS_MODULE"),
+            help="DJANGO_SETTINGS_MODULE of the profiled process, e.g. "
+            "storefront.settings_api. Defaults to the current one.",
+        )
+        parser.add_argument("--top", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if options["entry"] == "manage":
+            arguments = ["manage.py", *options["command"].split()]
+        else:
+            arguments = ["-c", ENTRY_POINTS[options["entry"]]]
+
+        environment = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": options["settings_module"],
+        }
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", *arguments],
+            cwd=settings.BASE_DIR,
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            raise CommandError(process.stderr[-2000:])
+
+        modules = self.parse(process.stderr)
+        total = sum(self_time for self_time, _ in modules.values())
+
+        self.stdout.write(
+            f"{options['entry']} ({options['settings_module']}): "
+            f"{elapsed * 1000:.0f} ms wall, {total / 1000:.0f} ms importing "
+            f"{len(modules)} modules"
+        )
+
+        packages = defaultdict(lambda: [0, 0])
+        for module, (self_time, _) in modules.items():
+            package = packages[module.split(".")[0]]
+            package[0] += self_time
+            package[1] += 1
+        self.stdout.write("\nBy package (self time):")
+        for package, (self_time, count) in sorted(
+            packages.items(), key=lambda item: item[1][0], reverse=True
+        )[: options["top"]]:
+            self.stdout.write(
+                f"  {self_time / 1000:8.1f} ms {self_time / total:6.1%} "
+                f"{count:5} modules  {package}"
+            )
+
+        self.stdout.write("\nSlowest modules (cumulative, self):")
+        for module, (self_time, cumulative) in sorted(
+            modules.items(), key=lambda item: item[1][1], reverse=True
+        )[: options["top"]]:
+            self.stdout.write(
+                f"  {cumulative / 1000:8.1f} ms {self_time / 1000:8.1f} ms  {module}"
+            )
+
+    def parse(self, output):
+        # {module: (self us, cumulative us)}, a module is only imported once
+        modules = {}
+        for line in output.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                self_time, cumulative, module = match.groups()
+                modules[module] = (int(self_time), int(cumulative))
+        return modules
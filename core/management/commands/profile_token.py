@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import get_setting, make_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints a signed token that makes core.middleware.ProfilingMiddleware "
+        "profile one request when sent in the PROFILING['HEADER'] header."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "username", help="The staff user the profile is for, it's recorded"
+        )
+        parser.add_argument(
+            "path_prefix",
+            nargs="?",
+            default="/",
+            help="Only requests under this path are profiled, e.g. /store/orders/",
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if not User.objects.filter(
+            username=options["username"], is_staff=True, is_active=True
+        ).exists():
+            raise CommandError(f"No active staff user {options['username']!r}")
+        header = get_setting("HEADER", "X-Profile")
+        max_age = get_setting("TOKEN_MAX_AGE", 3600)
+        token = make_token(options["username"], options["path_prefix"])
+        self.stdout.write(f"{header}: {token}")
+        self.stderr.write(f"Good for one request in the next {max_age} seconds")
@@ -0,0 +1,111 @@
+import glob
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.querylog import get_setting
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Sums up the query log (core.querylog): the slowest query shapes, the "
+        "probable N+1s by where they come from and the routes running "
+        "duplicate queries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            default=get_setting("FILE"),
+            help="Defaults to QUERY_LOG['FILE'], rotated files are read too.",
+        )
+        parser.add_argument("--route", help="Only this route, e.g. orders-list")
+        parser.add_argument("--top", type=int, default=10)
+
+    def handle(self, *args, **options):
+        if not options["file"]:
+            raise CommandError("No query log file, set QUERY_LOG['FILE'] or --file")
+        records = list(self.read(str(options["file"]), options["route"]))
+        if not records:
+            self.stdout.write("The query log is empty")
+            return
+        top = options["top"]
+
+        slow = defaultdict(list)
+        slow_where = {}
+        n_plus_one = defaultdict(lambda: {"requests": 0, "queries": 0, "time": 0.0})
+        duplicates = defaultdict(lambda: {"requests": 0, "wasted": 0})
+        for record in records:
+            kind = record.get("kind")
+            if kind == "slow_query":
+                slow[record["shape"]].append(record["duration_ms"])
+                slow_where[record["shape"]] = record
+            elif kind == "n_plus_one":
+                key = (
+                    record["route"],
+                    record.get("view"),
+                    record.get("serializer"),
+                    record.get("origin"),
+                    record["shape"],
+                )
+                n_plus_one[key]["requests"] += 1
+                n_plus_one[key]["queries"] += record["count"]
+                n_plus_one[key]["time"] += record["duration_ms"]
+            elif kind == "duplicate_queries":
+                duplicates[record["route"]]["requests"] += 1
+                duplicates[record["route"]]["wasted"] += record["wasted"]
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Slowest query shapes"))
+        for shape, durations in sorted(
+            slow.items(), key=lambda item: sum(item[1]), reverse=True
+        )[:top]:
+            where = slow_where[shape]
+            self.stdout.write(
+                f"{len(durations):6}x  p95 {percentile(durations, 95):8.1f} ms  "
+                f"max {max(durations):8.1f} ms  {where['route']}"
+            )
+            self.write_where(where)
+            self.stdout.write(f"        {shape[:300]}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("\nProbable N+1 queries"))
+        for (route, view, serializer, origin, shape), totals in sorted(
+            n_plus_one.items(), key=lambda item: item[1]["time"], reverse=True
+        )[:top]:
+            self.stdout.write(
+                f"{totals['requests']:6} requests, "
+                f"{totals['queries'] / totals['requests']:.0f} queries each, "
+                f"{totals['time']:.1f} ms in all  {route}"
+            )
+            self.write_where({"view": view, "serializer": serializer, "origin": origin})
+            self.stdout.write(f"        {shape[:300]}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("\nDuplicate queries"))
+        for route, totals in sorted(
+            duplicates.items(), key=lambda item: item[1]["wasted"], reverse=True
+        )[:top]:
+            self.stdout.write(
+                f"{totals['requests']:6} requests, {totals['wasted']} repeated "
+                f"queries  {route}"
+            )
+
+    def write_where(self, record):
+        for name in ["view", "serializer", "origin"]:
+            if record.get(name):
+                self.stdout.write(f"        {name}: {record[name]}")
+
+    def read(self, path, route):
+        for filename in sorted(glob.glob(f"{glob.escape(path)}*")):
+            with open(filename) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if route is None or record.get("route") == route:
+                        yield record
@@ -0,0 +1,416 @@
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections
+from django.db.models import Count, Max
+
+from likes.models import LikeCounter, LikedItem
+from store import sharding
+from store.models import (
+    Cart,
+    CartItem,
+    Collection,
+    Customer,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+)
+from tags.models import Tag, TaggedItem
+
+WORDS = (
+    "alpine amber arctic aroma basil berry bold breeze cedar cherry citrus "
+    "classic cocoa coral cotton crisp crystal dawn delta ember fresh frost "
+    "garden ginger golden harbor honey indigo island ivory jade lemon linen "
+    "lunar maple meadow mint mocha nordic ocean olive onyx orchard pearl "
+    "pepper pine prairie quartz rapid royal rustic saffron sage sierra silver "
+    "smoky solar spice spruce storm summit sunset thunder timber tropic urban "
+    "velvet vintage walnut wild willow zesty"
+).split()
+NOUNS = (
+    "bagel blend bread candle chips coffee cookies crackers dressing granola "
+    "jam juice kettle mug noodles oil pasta pepper rice salsa sauce snack "
+    "soap soup spread syrup tea tortillas vinegar wipes yogurt"
+).split()
+FIRST_NAMES = (
+    "Ada Alan Amir Ana Ben Chen Chloe Dana Diego Elena Emma Farah Grace Hana "
+    "Ivan Jade Jonas Kai Lena Leo Lina Maya Mei Nia Noah Omar Priya Rosa Sam "
+    "Sara Tariq Uma Yara Yusuf Zoe"
+).split()
+LAST_NAMES = (
+    "Adams Baker Costa Diaz Evans Fischer Garcia Hughes Ito Jensen Khan Kim "
+    "Lopez Martin Novak Okafor Patel Quinn Rossi Silva Smith Tanaka Ueda "
+    "Varga Weber Xu Young Zhang"
+).split()
+
+
+def title(rng):
+    return " ".join([rng.choice(WORDS), rng.choice(WORDS), rng.choice(NOUNS)]).title()
+
+
+def price(rng):
+    return Decimal(rng.randint(100, 99999)) / 100
+
+
+# Every chunk gets its own random generator seeded from the command seed, the
+# table and the chunk number, so the data doesn't depend on the worker count
+
+
+def seed_users(rng, context, start, count):
+    users, customers = [], []
+    for i in range(start, start + count):
+        user_id = context["user_start"] + i
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        users.append(
+            get_user_model()(
+                id=user_id,
+                username=f"seed{user_id}",
+                email=f"seed{user_id}@example.com",
+                first_name=first_name,
+                last_name=last_name,
+                password=context["password"],
+            )
+        )
+        customers.append(
+            Customer(
+                id=context["customer_start"] + i,
+                user_id=user_id,
+                phone=f"+1{rng.randint(2000000000, 9999999999)}",
+                birth_date=date(1950, 1, 1) + timedelta(days=rng.randrange(20000)),
+                membership=rng.choice("BBBSSG"),
+            )
+        )
+    # bulk_create doesn't send post_save, so no customer is created for the
+    # users by store.signals
+    get_user_model().objects.using("default").bulk_create(users)
+    Customer.objects.using("default").bulk_create(customers)
+    return count
+
+
+def seed_products(rng, context, start, count):
+    products = []
+    for i in range(start, start + count):
+        product_title = title(rng)
+        products.append(
+            Product(
+                id=context["product_start"] + i,
+                title=product_title,
+                slug=f"{product_title.lower().replace(' ', '-')}-{i}",
+                description=" ".join(rng.choices(WORDS, k=rng.randint(8, 40))),
+                unit_price=price(rng),
+                inventory=rng.randint(0, 500),
+                collection_id=rng.choice(context["collection_ids"]),
+            )
+        )
+    Product.objects.using("default").bulk_create(products)
+    return count
+
+
+def random_product(rng, context):
+    return context["product_start"] + rng.randrange(context["products"])
+
+
+def seed_orders(rng, context, start, count):
+    # {alias: ([orders], [items])}, orders go to their customer's shard
+    rows = {}
+    max_items = context["max_items"]
+    for i in range(start, start + count):
+        customer_id = context["customer_start"] + rng.randrange(context["customers"])
+        order_id = context["order_start"] + i
+        orders, items = rows.setdefault(
+            sharding.shard_for_customer(customer_id), ([], [])
+        )
+        orders.append(
+            Order(
+                id=order_id, customer_id=customer_id, payment_status=rng.choice("CCCPF")
+            )
+        )
+        product_ids = {
+            random_product(rng, context) for _ in range(rng.randint(1, max_items))
+        }
+        for slot, product_id in enumerate(product_ids):
+            items.append(
+                OrderItem(
+                    # Every order has max_items ids set aside for its items
+                    id=context["order_item_start"] + i * max_items + slot,
+                    order_id=order_id,
+                    product_id=product_id,
+                    quantity=rng.randint(1, 5),
+                    unit_price=price(rng),
+                )
+            )
+    for alias, (orders, items) in rows.items():
+        Order.objects.using(alias).bulk_create(orders)
+        OrderItem.objects.using(alias).bulk_create(items)
+    return count
+
+
+def seed_carts(rng, context, start, count):
+    rows = {}
+    for _ in range(count):
+        cart_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        carts, items = rows.setdefault(sharding.shard_for_cart(cart_id), ([], []))
+        carts.append(Cart(id=cart_id))
+        product_ids = {random_product(rng, context) for _ in range(rng.randint(0, 6))}
+        for product_id in product_ids:
+            items.append(
+                CartItem(
+                    cart_id=cart_id, product_id=product_id, quantity=rng.randint(1, 5)
+                )
+            )
+    for alias, (carts, items) in rows.items():
+        Cart.objects.using(alias).bulk_create(carts)
+        CartItem.objects.using(alias).bulk_create(items)
+    return count
+
+
+def seed_reviews(rng, context, start, count):
+    Review.objects.using("default").bulk_create(
+        Review(
+            product_id=random_product(rng, context),
+            name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)[0]}.",
+            description=" ".join(rng.choices(WORDS, k=rng.randint(5, 60))),
+        )
+        for _ in range(count)
+    )
+    return count
+
+
+def seed_tagged_items(rng, context, start, count):
+    TaggedItem.objects.using("default").bulk_create(
+        TaggedItem(
+            tag_id=rng.choice(context["tag_ids"]),
+            content_type_id=context["product_type_id"],
+            object_id=random_product(rng, context),
+        )
+        for _ in range(count)
+    )
+    return count
+
+
+def seed_likes(rng, context, start, count):
+    # Random pairs repeat and a user likes an object once, the counters are
+    # recounted afterwards from the likes that made it in
+    LikedItem.objects.using("default").bulk_create(
+        [
+            LikedItem(
+                user_id=context["user_start"] + rng.randrange(context["customers"]),
+                content_type_id=context["product_type_id"],
+                # Skewed towards the first products, like real likes
+                object_id=context["product_start"]
+                + min(
+                    int(rng.expovariate(10 / context["products"])),
+                    context["products"] - 1,
+                ),
+            )
+            for _ in range(count)
+        ],
+        ignore_conflicts=True,
+    )
+    return count
+
+
+SEEDERS = {
+    "users": seed_users,
+    "products": seed_products,
+    "orders": seed_orders,
+    "carts": seed_carts,
+    "reviews": seed_reviews,
+    "tagged_items": seed_tagged_items,
+    "likes": seed_likes,
+}
+
+
+def run_chunk(task):
+    name, chunk, start, count, context = task
+    rng = random.Random(f"{context['seed']}:{name}:{chunk}")
+    try:
+        return SEEDERS[name](rng, context, start, count)
+    finally:
+        connections.close_all()
+
+
+def init_worker():
+    # Under the spawn start method the worker starts from scratch
+    import django
+
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with reproducible synthetic data (users, customers, "
+        "products, orders, carts, reviews, tags and likes) for scale testing. "
+        "Rows are inserted with bulk_create in batches, by parallel worker "
+        "processes, with ids handed out up front."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--collections", type=int, default=50)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--customers", type=int, default=10_000)
+        parser.add_argument("--orders", type=int, default=100_000)
+        parser.add_argument(
+            "--max-items", type=int, default=5, help="Items per order, at most."
+        )
+        parser.add_argument("--carts", type=int, default=10_000)
+        parser.add_argument("--reviews", type=int, default=50_000)
+        parser.add_argument("--tags", type=int, default=200)
+        parser.add_argument("--tagged-items", type=int, default=50_000)
+        parser.add_argument("--likes", type=int, default=100_000)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument(
+            "--password",
+            default=getattr(settings, "SEED_PASSWORD", "storefront"),
+            help="Password of every seeded user, hashed once.",
+        )
+
+    def handle(self, *args, **options):
+        if options["products"] < 1 or options["customers"] < 1:
+            raise CommandError("Seeding needs at least one product and one customer")
+        workers = options["workers"]
+        if connections["default"].vendor == "sqlite" and workers > 1:
+            # SQLite has a single writer, more processes only wait on each other
+            self.stdout.write("SQLite: using one worker")
+            workers = 1
+
+        rng = random.Random(options["seed"])
+        collection_ids = self.seed_collections(rng, options["collections"])
+        tag_ids = self.seed_tags(rng, options["tags"])
+        if not collection_ids:
+            raise CommandError("Products need a collection, use --collections")
+        if options["tagged_items"] and not tag_ids:
+            raise CommandError("Tagged items need a tag, use --tags")
+
+        max_items = options["max_items"]
+        context = {
+            "seed": options["seed"],
+            "password": make_password(options["password"]),
+            "customers": options["customers"],
+            "products": options["products"],
+            "max_items": max_items,
+            "collection_ids": collection_ids,
+            "tag_ids": tag_ids,
+            "product_type_id": ContentType.objects.get_for_model(Product).id,
+            "user_start": self.next_id(get_user_model()),
+            "customer_start": self.next_id(Customer),
+            "product_start": self.next_id(Product),
+            "order_start": self.reserve_ids(Order, options["orders"]),
+            "order_item_start": self.reserve_ids(
+                OrderItem, options["orders"] * max_items
+            ),
+        }
+
+        # Orders, carts, reviews... point at the users and products, so those
+        # go first
+        phases = [
+            [("users", options["customers"]), ("products", options["products"])],
+            [
+                ("orders", options["orders"]),
+                ("carts", options["carts"]),
+                ("reviews", options["reviews"]),
+                ("tagged_items", options["tagged_items"]),
+                ("likes", options["likes"]),
+            ],
+        ]
+        connections.close_all()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(workers, initializer=init_worker) as executor:
+            for phase in phases:
+                self.run_phase(executor, phase, context, options["batch_size"])
+
+        self.rebuild_like_counters(context["product_type_id"])
+        self.reset_sequences()
+        self.stdout.write(
+            self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s")
+        )
+
+    def run_phase(self, executor, phase, context, batch_size):
+        tasks = []
+        for name, total in phase:
+            for chunk, start in enumerate(range(0, total, batch_size)):
+                tasks.append(
+                    (name, chunk, start, min(batch_size, total - start), context)
+                )
+        started = time.perf_counter()
+        rows = sum(executor.map(run_chunk, tasks))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{', '.join(f'{total} {name}' for name, total in phase)}: "
+            f"{elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+
+    def seed_collections(self, rng, count):
+        collections = Collection.objects.using("default").bulk_create(
+            Collection(title=f"{rng.choice(WORDS).title()} {rng.choice(NOUNS).title()}")
+            for _ in range(count)
+        )
+        if collections and collections[0].pk is None:
+            # MySQL doesn't return the ids of bulk inserted rows
+            collections = Collection.objects.order_by("-id")[:count]
+        ids = [collection.pk for collection in collections]
+        return ids or list(Collection.objects.values_list("id", flat=True))
+
+    def seed_tags(self, rng, count):
+        tags = Tag.objects.using("default").bulk_create(
+            Tag(label=f"{rng.choice(WORDS)}-{i}") for i in range(count)
+        )
+        if tags and tags[0].pk is None:
+            tags = Tag.objects.order_by("-id")[:count]
+        ids = [tag.pk for tag in tags]
+        return ids or list(Tag.objects.values_list("id", flat=True))
+
+    def next_id(self, model):
+        return (model.objects.using("default").aggregate(Max("id"))["id__max"] or 0) + 1
+
+    def reserve_ids(self, model, count):
+        # Sharded ids come from the shard sequence so they stay unique
+        if sharding.is_enabled():
+            return sharding.allocate_ids(model, count)[0] if count else 0
+        return self.next_id(model)
+
+    def rebuild_like_counters(self, content_type_id):
+        # bulk_create skips likes.counters, so recount from the likes
+        counts = (
+            LikedItem.objects.filter(content_type_id=content_type_id)
+            .values("object_id")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        LikeCounter.objects.filter(content_type_id=content_type_id).delete()
+        LikeCounter.objects.bulk_create(
+            (
+                LikeCounter(
+                    content_type_id=content_type_id,
+                    object_id=row["object_id"],
+                    count=row["count"],
+                )
+                for row in counts.iterator()
+            ),
+            batch_size=5_000,
+        )
+
+    def reset_sequences(self):
+        # Rows were inserted with explicit ids, PostgreSQL's sequences don't
+        # know about them
+        models = [get_user_model(), Customer, Product, Order, OrderItem]
+        for alias in {"default", *sharding.all_shards()}:
+            connection = connections[alias]
+            statements = connection.ops.sequence_reset_sql(no_style(), models)
+            if statements:
+                with connection.cursor() as cursor:
+                    for statement in statements:
+                        cursor.execute(statement)
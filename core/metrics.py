@@ -0,0 +1,413 @@
+"""
+Per-request timings and per-route aggregates.
+
+core.middleware.MetricsMiddleware starts a RequestTimings for every request and
+counts the queries it runs. The viewset and serializer mixins below add the
+time spent on authentication, permissions and serialization. Each response
+gets a Server-Timing header, and the numbers are aggregated per route name
+(e.g. "products-list") into histograms.
+
+Every worker process keeps its own aggregates and a thread writes them to
+METRICS["DIR"]/<pid>-<random>.json every METRICS["FLUSH_INTERVAL"] seconds, so
+a reused pid gets a file of its own. /metrics adds up the files of all workers
+and serves them in the Prometheus text format. Files of workers that stopped,
+not written for METRICS["STALE_INTERVALS"] flush intervals or whose pid is
+gone on this host, are deleted instead.
+"""
+
+import copy
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import uuid4
+
+from django.conf import settings
+from rest_framework.fields import empty
+
+from .cache import all_stats as cache_stats
+from .db.pool import all_stats
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+current_timings = ContextVar("current_timings", default=None)
+
+HOST = socket.gethostname()
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "METRICS", {}).get(name, default)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}  # {name: seconds}
+        self.queries = 0
+        self._depth = {}
+        # The parallel sub-requests of a batch (store.batch) add to the
+        # timings of the batch request
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, queries=0):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0) + seconds
+            self.queries += queries
+
+    @contextmanager
+    def timer(self, name):
+        # Nested timers of the same name (a serializer inside a serializer)
+        # only count once, per thread
+        key = (threading.get_ident(), name)
+        depth = self._depth.get(key, 0)
+        self._depth[key] = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[key] = depth
+            if depth == 0:
+                self.add(name, time.perf_counter() - start)
+
+    def server_timing(self, total):
+        entries = [
+            f'db;dur={self.durations.get("db", 0) * 1000:.2f};desc="{self.queries} queries"'
+        ]
+        for name, seconds in self.durations.items():
+            if name != "db":
+                entries.append(f"{name};dur={seconds * 1000:.2f}")
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def timer(name):
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    with timings.timer(name):
+        yield
+
+
+class QueryTimer:
+    # Installed with connection.execute_wrapper() for the whole request
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings.add("db", time.perf_counter() - start, queries=1)
+
+
+class RouteMetrics:
+    """
+    The aggregates of this worker:
+    {(route, method): {"count", "sum", "buckets", "queries", "db", ...}}
+    """
+
+    SUMS = ["queries", "db", "auth", "permissions", "serialize", "render", "bytes"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._pid = None
+        self._filename = None
+        self._writer_pid = None
+
+    @property
+    def buckets(self):
+        return get_setting("BUCKETS", DEFAULT_BUCKETS)
+
+    def observe(self, route, method, status_code, total, timings, size):
+        with self._lock:
+            entry = self._routes.get((route, method))
+            if entry is None:
+                entry = self._routes[(route, method)] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                    "statuses": {},
+                    **{name: 0 for name in self.SUMS},
+                }
+            entry["count"] += 1
+            entry["sum"] += total
+            entry["buckets"][bisect_left(self.buckets, total)] += 1
+            status_class = f"{status_code // 100}xx"
+            entry["statuses"][status_class] = entry["statuses"].get(status_class, 0) + 1
+            entry["queries"] += timings.queries
+            for name, seconds in timings.durations.items():
+                if name in entry:
+                    entry[name] += seconds
+            entry["bytes"] += size
+        self.start_writer()
+
+    def snapshot(self):
+        with self._lock:
+            routes = [
+                {"route": route, "method": method, **copy.deepcopy(entry)}
+                for (route, method), entry in self._routes.items()
+            ]
+        return {
+            "pid": os.getpid(),
+            "host": HOST,
+            "buckets": self.buckets,
+            "routes": routes,
+            "pools": all_stats(),
+            "caches": cache_stats(),
+        }
+
+    @property
+    def filename(self):
+        # Set again in forked workers
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._filename = f"{self._pid}-{uuid4().hex[:8]}.json"
+        return self._filename
+
+    def start_writer(self):
+        # One thread per worker process, it keeps the file's mtime fresh while
+        # the worker is idle too
+        if get_setting("DIR") is None or self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        threading.Thread(target=self._write_every, name="metrics", daemon=True).start()
+
+    def _write_every(self):
+        while True:
+            time.sleep(get_setting("FLUSH_INTERVAL", 10))
+            try:
+                self.write()
+            except Exception:
+                logger.exception("Writing the metrics failed")
+
+    def write(self):
+        directory = get_setting("DIR")
+        if directory is None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f"{path}.tmp", path)
+
+
+route_metrics = RouteMetrics()
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process
+        return True
+    return True
+
+
+def collect():
+    """
+    Returns the snapshots of all running workers, with the one of this worker
+    fresh, and deletes the files of the others.
+    """
+    route_metrics.write()
+    snapshots = [route_metrics.snapshot()]
+    directory = get_setting("DIR")
+    if directory is None or not os.path.isdir(directory):
+        return snapshots
+    stale_after = get_setting("FLUSH_INTERVAL", 10) * get_setting("STALE_INTERVALS", 3)
+    for name in os.listdir(directory):
+        if not name.endswith(".json") or name == route_metrics.filename:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue
+        # Only this host's pids can be looked up
+        if age > stale_after or (
+            snapshot.get("host") == HOST and not is_running(snapshot["pid"])
+        ):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(**values):
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in values.items())
+    return "{" + pairs + "}"
+
+
+def render_prometheus(snapshots):
+    # Routes add up over the workers, pools are reported per worker
+    routes = {}
+    for snapshot in snapshots:
+        bucket_bounds = snapshot["buckets"]
+        for entry in snapshot["routes"]:
+            key = (entry["route"], entry["method"])
+            total = routes.setdefault(
+                key,
+                {
+                    "count": 0,
+                    "sum": 0.0,
+                    "buckets": {bound: 0 for bound in bucket_bounds},
+                    "statuses": {},
+                    **{name: 0 for name in RouteMetrics.SUMS},
+                },
+            )
+            total["count"] += entry["count"]
+            total["sum"] += entry["sum"]
+            for bound, count in zip(bucket_bounds, entry["buckets"]):
+                total["buckets"][bound] = total["buckets"].get(bound, 0) + count
+            for status_class, count in entry["statuses"].items():
+                total["statuses"][status_class] = (
+                    total["statuses"].get(status_class, 0) + count
+                )
+            for name in RouteMetrics.SUMS:
+                total[name] += entry.get(name, 0)
+
+    lines = [
+        "# HELP storefront_request_duration_seconds Request latency per route.",
+        "# TYPE storefront_request_duration_seconds histogram",
+    ]
+    for (route, method), total in sorted(routes.items()):
+        cumulative = 0
+        for bound in sorted(total["buckets"]):
+            cumulative += total["buckets"][bound]
+            lines.append(
+                "storefront_request_duration_seconds_bucket"
+                f"{labels(route=route, method=method, le=bound)} {cumulative}"
+            )
+        lines.append(
+            "storefront_request_duration_seconds_bucket"
+            f'{labels(route=route, method=method, le="+Inf")} {total["count"]}'
+        )
+        lines.append(
+            "storefront_request_duration_seconds_sum"
+            f"{labels(route=route, method=method)} {total['sum']}"
+        )
+        lines.append(
+            "storefront_request_duration_seconds_count"
+            f"{labels(route=route, method=method)} {total['count']}"
+        )
+
+    lines += [
+        "# HELP storefront_responses_total Responses per route and status class.",
+        "# TYPE storefront_responses_total counter",
+    ]
+    for (route, method), total in sorted(routes.items()):
+        for status_class, count in sorted(total["statuses"].items()):
+            lines.append(
+                "storefront_responses_total"
+                f"{labels(route=route, method=method, status=status_class)} {count}"
+            )
+
+    for name, unit, help_text in [
+        ("queries", "total", "Database queries."),
+        ("db", "seconds_total", "Time spent in database queries."),
+        ("auth", "seconds_total", "Time spent authenticating."),
+        ("permissions", "seconds_total", "Time spent checking permissions."),
+        ("serialize", "seconds_total", "Time spent in serializers."),
+        ("render", "seconds_total", "Time spent rendering responses."),
+        ("bytes", "total", "Response body bytes."),
+    ]:
+        metric = f"storefront_request_{name}_{unit}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for (route, method), total in sorted(routes.items()):
+            lines.append(f"{metric}{labels(route=route, method=method)} {total[name]}")
+
+    for name, kind in [
+        ("size", "gauge"),
+        ("in_use", "gauge"),
+        ("checkouts", "counter"),
+        ("waits", "counter"),
+        ("wait_time", "counter"),
+        ("timeouts", "counter"),
+        ("connects", "counter"),
+    ]:
+        metric = f"storefront_db_pool_{name}"
+        lines.append(f"# TYPE {metric} {kind}")
+        for snapshot in snapshots:
+            for pool in snapshot["pools"]:
+                lines.append(
+                    f"{metric}{labels(alias=pool['alias'], pid=pool['pid'])} {pool[name]}"
+                )
+
+    for name, kind in [
+        ("entries", "gauge"),
+        ("bytes", "gauge"),
+        ("local_hits", "counter"),
+        ("shared_hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+        ("flushes", "counter"),
+    ]:
+        metric = f"storefront_cache_{name}"
+        lines.append(f"# TYPE {metric} {kind}")
+        for snapshot in snapshots:
+            # Older snapshot files have no caches
+            for cache in snapshot.get("caches", []):
+                lines.append(
+                    f"{metric}{labels(cache=cache['name'], pid=snapshot['pid'])} "
+                    f"{cache[name]}"
+                )
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsViewMixin:
+    """
+    Times authentication and permission checks of a viewset for the request
+    metrics.
+    """
+
+    def perform_authentication(self, request):
+        with timer("auth"):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with timer("permissions"):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with timer("permissions"):
+            super().check_object_permissions(request, obj)
+
+
+class MetricsSerializerMixin:
+    """
+    Times a serializer's validation and representation for the request
+    metrics. Nested serializers are counted as part of their parent.
+    """
+
+    def run_validation(self, data=empty):
+        with timer("serialize"):
+            return super().run_validation(data)
+
+    def to_representation(self, instance):
+        with timer("serialize"):
+            return super().to_representation(instance)
@@ -0,0 +1,581 @@
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import (
+    async_to_sync,
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+
+from . import metrics, profiling, querylog
+from .models import ProfileRecord
+from .routers import get_replica_setting, reads_from_replicas, use_replica
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# The execute wrappers installed for the current request (query timer, query
+# log), for the threads running part of it (store.batch) to install on their
+# own connections
+query_wrappers = ContextVar("query_wrappers", default=())
+
+
+@contextmanager
+def wrap_queries(*wrappers):
+    token = query_wrappers.set((*query_wrappers.get(), *wrappers))
+    try:
+        with installed(wrappers):
+            yield
+    finally:
+        query_wrappers.reset(token)
+
+
+@contextmanager
+def installed(wrappers):
+    # On this thread's connections
+    with ExitStack() as stack:
+        for connection in connections.all():
+            for wrapper in wrappers:
+                stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets the catalog views read from the replicas. A client that just wrote
+    something (added to a cart, placed an order...) sticks to the primary for
+    READ_REPLICAS["STICKY_SECONDS"] so it always reads its own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.pinned_to_primary = bool(cache.get(self.pin_key(request)))
+        # Set and reset in the same frame. Under ASGI a sync process_view() runs
+        # in a copy of the request's context, where the token isn't valid
+        token = use_replica.set(True) if self.may_use_replica(request) else None
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                use_replica.reset(token)
+
+        sticky_seconds = get_replica_setting("STICKY_SECONDS", 5)
+        if (
+            sticky_seconds
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+            # A POST that only reads, like a batch of GETs
+            and getattr(request, "has_writes", True)
+        ):
+            cache.set(self.pin_key(request), True, sticky_seconds)
+        return response
+
+    def may_use_replica(self, request):
+        if request.method not in SAFE_METHODS or request.pinned_to_primary:
+            return False
+        try:
+            match = resolve(request.path_info, getattr(request, "urlconf", None))
+        except Resolver404:
+            return False
+        return reads_from_replicas(match.func)
+
+    def pin_key(self, request):
+        # API clients are identified by their token, everyone else by address
+        client = request.META.get("HTTP_AUTHORIZATION") or "{}|{}".format(
+            request.META.get("REMOTE_ADDR", ""),
+            request.META.get("HTTP_USER_AGENT", ""),
+        )
+        return "db-pin:" + hashlib.sha256(client.encode()).hexdigest()
+
+
+class WriteQueue:
+    # A first come, first served lock
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        self._busy = False
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        ticket = object()
+        with self._condition:
+            self._waiting.append(ticket)
+            while self._busy or self._waiting[0] is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._condition.notify_all()
+                    return False
+                self._condition.wait(remaining)
+            self._waiting.popleft()
+            self._busy = True
+            return True
+
+    def release(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+
+
+write_queue = WriteQueue()
+
+
+def queues_own_writes(view):
+    """
+    Marks a view that takes the write queue itself, around each of its writes
+    only (store.batch), instead of WriteQueueMiddleware for the whole request.
+    """
+    view.queues_own_writes = True
+    return view
+
+
+def queued(request, get_response):
+    """
+    Runs get_response(request) once it's this write's turn in the queue, or
+    returns a 503 after WRITE_QUEUE["TIMEOUT"] seconds.
+    """
+    timeout = getattr(settings, "WRITE_QUEUE", {}).get("TIMEOUT", 10)
+    if not write_queue.acquire(timeout):
+        response = JsonResponse(
+            {"detail": "The server is busy, try again later."}, status=503
+        )
+        response["Retry-After"] = "1"
+        return response
+    try:
+        return get_response(request)
+    finally:
+        write_queue.release()
+
+
+class WriteQueueMiddleware:
+    """
+    Lets one unsafe request at a time through in this worker, for SQLite where
+    there's only ever one writer anyway. The others queue up in arrival order,
+    and get a 503 after WRITE_QUEUE["TIMEOUT"] seconds. Views marked with
+    queues_own_writes get request.write_queue set and queue their writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in SAFE_METHODS or self.queues_own_writes(request):
+            return self.get_response(request)
+        return queued(request, self.get_response)
+
+    def queues_own_writes(self, request):
+        try:
+            match = resolve(request.path_info, getattr(request, "urlconf", None))
+        except Resolver404:
+            return False
+        request.write_queue = getattr(match.func, "queues_own_writes", False)
+        return request.write_queue
+
+
+class PathMiddlewareRouter:
+    """
+    Runs a different middleware chain depending on the path prefix, so API
+    requests can skip sessions, CSRF, messages... that only the admin needs.
+
+        PATH_MIDDLEWARE = {
+            "/store/": ["django.middleware.common.CommonMiddleware"],
+            "": [...],  # everything else
+        }
+
+    The longest matching prefix wins. Middleware hooks (process_view,
+    process_template_response, process_exception) are called the same way
+    Django calls them for MIDDLEWARE. Under ASGI the chains are built async the
+    way Django builds MIDDLEWARE, so the router itself doesn't add a hop to a
+    thread, only the sync middleware of a chain do.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django awaits the hooks of async middleware
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+        self.chains = {}
+        for prefix, middleware_paths in settings.PATH_MIDDLEWARE.items():
+            self.chains[prefix] = self.build_chain(get_response, middleware_paths)
+        self.prefixes = sorted(self.chains, key=len, reverse=True)
+
+    def build_chain(self, get_response, middleware_paths):
+        # Same as django.core.handlers.base.BaseHandler.load_middleware
+        chain = {"view": [], "template_response": [], "exception": []}
+        handler = convert_exception_to_response(get_response)
+        handler_is_async = self.is_async
+        for middleware_path in reversed(middleware_paths):
+            middleware = import_string(middleware_path)
+            if not handler_is_async and getattr(middleware, "sync_capable", True):
+                middleware_is_async = False
+            else:
+                middleware_is_async = getattr(middleware, "async_capable", False)
+            adapted_handler = adapt(middleware_is_async, handler, handler_is_async)
+            try:
+                middleware = middleware(adapted_handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(middleware, "process_view"):
+                chain["view"].insert(0, adapt(self.is_async, middleware.process_view))
+            if hasattr(middleware, "process_template_response"):
+                chain["template_response"].append(
+                    adapt(self.is_async, middleware.process_template_response)
+                )
+            if hasattr(middleware, "process_exception"):
+                # Always called synchronously, as by Django
+                chain["exception"].append(adapt(False, middleware.process_exception))
+            handler = convert_exception_to_response(middleware)
+            handler_is_async = middleware_is_async
+        chain["handler"] = adapt(self.is_async, handler, handler_is_async)
+        return chain
+
+    def get_chain(self, request):
+        for prefix in self.prefixes:
+            if request.path_info.startswith(prefix):
+                return self.chains[prefix]
+        raise ImproperlyConfigured(
+            f"No PATH_MIDDLEWARE chain for '{request.path_info}', add a '' prefix"
+        )
+
+    def __call__(self, request):
+        # A coroutine under ASGI
+        return self.get_chain(request)["handler"](request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for process_view in self.get_chain(request)["view"]:
+            response = process_view(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        for process_view in self.get_chain(request)["view"]:
+            response = await process_view(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        for process_template_response in self.get_chain(request)["template_response"]:
+            response = process_template_response(request, response)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        for process_template_response in self.get_chain(request)["template_response"]:
+            response = await process_template_response(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        for process_exception in self.get_chain(request)["exception"]:
+            response = process_exception(request, exception)
+            if response is not None:
+                return response
+        return None
+
+
+def adapt(is_async, method, method_is_async=None):
+    # Same as django.core.handlers.base.BaseHandler.adapt_method_mode
+    if method_is_async is None:
+        method_is_async = iscoroutinefunction(method)
+    if is_async and not method_is_async:
+        return sync_to_async(method, thread_sensitive=True)
+    if not is_async and method_is_async:
+        return async_to_sync(method)
+    return method
+
+
+class MetricsMiddleware:
+    """
+    Times the request, its queries and its rendering (see core.metrics), adds
+    a Server-Timing header and feeds the per-route histograms. Goes first in
+    MIDDLEWARE so it sees all the others.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = metrics.RequestTimings()
+        token = metrics.current_timings.set(timings)
+        try:
+            with wrap_queries(metrics.QueryTimer(timings)):
+                response = self.get_response(request)
+        finally:
+            metrics.current_timings.reset(token)
+
+        total = time.perf_counter() - timings.started
+        response["Server-Timing"] = timings.server_timing(total)
+        match = request.resolver_match
+        metrics.route_metrics.observe(
+            route=(match.view_name if match else None) or "unmatched",
+            method=request.method,
+            status_code=response.status_code,
+            total=total,
+            timings=timings,
+            size=0 if response.streaming else len(response.content),
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this, by the handler
+        timings = metrics.current_timings.get()
+        if timings is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                timings.add("render", time.perf_counter() - started)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests picked by core.profiling (signed header or sampled
+    route) and saves a core.ProfileRecord for each.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._profiler = None
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler = request._profiler
+            if profiler is not None:
+                profiler.stop()
+                profiling.profiling_lock.release()
+        if profiler is not None:
+            self.save(request, response, profiler)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Before the token is used up, a busy profiler doesn't waste it
+        if not profiling.profiling_lock.acquire(blocking=False):
+            return None
+        trigger, issued_by = self.get_trigger(request)
+        if trigger is None:
+            profiling.profiling_lock.release()
+            return None
+        request._profiler = profiling.RequestProfiler()
+        request._profiler.trigger = trigger
+        request._profiler.issued_by = issued_by
+        request._profiler.start()
+        return None
+
+    def get_trigger(self, request):
+        token = request.headers.get(profiling.get_setting("HEADER", "X-Profile"), "")
+        if token:
+            issued_by = profiling.use_token(token, request.path)
+            if issued_by is not None:
+                return ProfileRecord.TRIGGER_HEADER, issued_by
+        rates = profiling.get_setting("SAMPLE_RATES", {})
+        rate = rates.get(request.resolver_match.view_name, 0)
+        if rate and random.random() < rate:
+            return ProfileRecord.TRIGGER_SAMPLED, ""
+        return None, ""
+
+    def save(self, request, response, profiler):
+        ProfileRecord.objects.create(
+            route=request.resolver_match.view_name or "",
+            method=request.method,
+            path=request.get_full_path(),
+            status_code=response.status_code,
+            duration=profiler.duration,
+            trigger=profiler.trigger,
+            issued_by=profiler.issued_by,
+            samples=sum(profiler.sampler.stacks.values()),
+            collapsed_stacks=profiler.sampler.collapsed(),
+            allocations=profiler.allocations,
+        )
+
+
+class QueryLogMiddleware:
+    """
+    Logs the slow, repeated and duplicate queries of each request, see
+    core.querylog.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_log = querylog.RequestQueryLog(request)
+        with wrap_queries(query_log):
+            response = self.get_response(request)
+        query_log.finish()
+        return response
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # {"status", "headers", "content"} if it can be shared
+
+
+class Flights:
+    # The coalesced requests in progress in this worker
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join(self, key):
+        # Returns the flight and whether this request leads it
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def land(self, key, flight, result):
+        with self._lock:
+            del self._flights[key]
+        flight.result = result
+        flight.done.set()
+
+
+flights = Flights()
+
+
+def get_single_flight_setting(name, default=None):
+    return getattr(settings, "SINGLE_FLIGHT", {}).get(name, default)
+
+
+class SingleFlightMiddleware:
+    """
+    Coalesces identical concurrent anonymous GETs under
+    SINGLE_FLIGHT["PREFIXES"]: the first one runs the view, the others wait for
+    it (up to SINGLE_FLIGHT["TIMEOUT"] seconds) and get a copy of its response.
+    Only 200s are shared, waiters run the view themselves otherwise.
+
+    With SINGLE_FLIGHT["CACHE"] set, the first request of each worker also
+    takes a lock key in that cache, and the workers that don't get it poll the
+    cache for the response of the one that did.
+
+    Goes after ReplicaRoutingMiddleware, so that clients pinned to the primary
+    only share with each other.
+    """
+
+    def __init__(self, get_response):
+        if not get_single_flight_setting("PREFIXES"):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefixes = tuple(get_single_flight_setting("PREFIXES"))
+        self.timeout = get_single_flight_setting("TIMEOUT", 5)
+        self.cache_alias = get_single_flight_setting("CACHE")
+
+    def __call__(self, request):
+        key = self.flight_key(request)
+        if key is None:
+            return self.get_response(request)
+
+        flight, leading = flights.join(key)
+        if not leading:
+            if flight.done.wait(self.timeout) and flight.result is not None:
+                return self.shared_response(request, flight.result)
+            return self.get_response(request)
+
+        result = None
+        try:
+            if self.cache_alias:
+                response, result = self.lead_across_workers(request, key)
+            else:
+                response = self.get_response(request)
+                result = self.shareable(response)
+        finally:
+            flights.land(key, flight, result)
+        return response
+
+    def flight_key(self, request):
+        if (
+            request.method != "GET"
+            or not request.path_info.startswith(self.prefixes)
+            or "HTTP_AUTHORIZATION" in request.META
+        ):
+            return None
+        signature = "|".join(
+            [
+                request.scheme,
+                request.META.get("HTTP_HOST", ""),
+                request.get_full_path(),
+                # The renderer
+                request.META.get("HTTP_ACCEPT", ""),
+                str(getattr(request, "pinned_to_primary", False)),
+            ]
+        )
+        return hashlib.sha256(signature.encode()).hexdigest()
+
+    def lead_across_workers(self, request, key):
+        shared_cache = caches[self.cache_alias]
+        lock_key = f"single-flight:lock:{key}"
+        result_key = f"single-flight:result:{key}"
+        # Expires on its own if this worker dies
+        if shared_cache.add(lock_key, True, self.timeout):
+            try:
+                # Left over from an earlier flight
+                shared_cache.delete(result_key)
+                response = self.get_response(request)
+                result = self.shareable(response)
+                if result is not None:
+                    shared_cache.set(result_key, result, self.timeout)
+            finally:
+                shared_cache.delete(lock_key)
+            return response, result
+
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            # The result is stored before the lock goes away
+            locked = shared_cache.has_key(lock_key)
+            result = shared_cache.get(result_key)
+            if result is not None:
+                return self.shared_response(request, result), result
+            if not locked:
+                break
+            time.sleep(get_single_flight_setting("POLL_INTERVAL", 0.01))
+        response = self.get_response(request)
+        return response, self.shareable(response)
+
+    def shareable(self, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return None
+        return {
+            "status": response.status_code,
+            "headers": list(response.items()),
+            "content": response.content,
+        }
+
+    def shared_response(self, request, result):
+        response = HttpResponse(result["content"], status=result["status"])
+        for name, value in result["headers"]:
+            response[name] = value
+        response["X-Single-Flight"] = "shared"
+        try:
+            # For the per-route metrics, the view never ran for this request
+            request.resolver_match = resolve(request.path_info)
+        except Resolver404:
+            pass
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-19 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_profilerecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilerecord',
+            name='issued_by',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+    ]
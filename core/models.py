@@ -5,3 +5,33 @@ from django.contrib.auth.models import AbstractUser
 # When extending the user model
 class User(AbstractUser):
     email = models.EmailField(unique=True)
+
+
+# A request profiled by core.middleware.ProfilingMiddleware
+class ProfileRecord(models.Model):
+    TRIGGER_HEADER = "H"
+    TRIGGER_SAMPLED = "S"
+    TRIGGER_CHOICES = [
+        (TRIGGER_HEADER, "Signed header"),
+        (TRIGGER_SAMPLED, "Sampled"),
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    route = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text="Seconds")
+    trigger = models.CharField(max_length=1, choices=TRIGGER_CHOICES)
+    # The staff user the header's token was made for
+    issued_by = models.CharField(max_length=150, blank=True)
+    samples = models.PositiveIntegerField()
+    # One "outer;...;inner count" line per stack, for flamegraph.pl or speedscope
+    collapsed_stacks = models.TextField(blank=True)
+    allocations = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path}"
+
+    class Meta:
+        ordering = ["-created_at"]
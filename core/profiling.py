@@ -0,0 +1,155 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries a valid signed PROFILING["HEADER"]
+(`manage.py profile_token` makes one for a staff user, good for one request
+within PROFILING["TOKEN_MAX_AGE"] seconds), or at random for the routes listed in
+PROFILING["SAMPLE_RATES"], e.g. {"orders-list": 0.01}. While the view runs a
+thread samples its stack every PROFILING["INTERVAL"] seconds, and tracemalloc
+compares memory before and after. The result is saved as a core.ProfileRecord:
+collapsed stacks for flamegraph.pl / speedscope and the top allocations.
+
+Only one request per worker is profiled at a time, and tracemalloc sees the
+whole process, so allocations of concurrent requests can show up too.
+"""
+
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from uuid import uuid4
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+SIGNING_SALT = "core.profiling"
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "PROFILING", {}).get(name, default)
+
+
+def nonce_key(nonce):
+    return f"profiling:token:{nonce}"
+
+
+def make_token(issued_by, path_prefix="/"):
+    # The nonce is in the cache all the workers share until the token is used
+    nonce = uuid4().hex
+    cache.set(nonce_key(nonce), issued_by, get_setting("TOKEN_MAX_AGE", 3600))
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign_object(
+        {"path": path_prefix, "nonce": nonce, "by": issued_by}
+    )
+
+
+def use_token(token, path):
+    """
+    Returns who issued the token if it's valid for the path and wasn't used
+    yet, and uses it up.
+    """
+    try:
+        data = signing.TimestampSigner(salt=SIGNING_SALT).unsign_object(
+            token, max_age=get_setting("TOKEN_MAX_AGE", 3600)
+        )
+    except signing.BadSignature:
+        return None
+    if not path.startswith(data["path"]):
+        return None
+    # Whichever request deletes it first is profiled
+    if not cache.delete(nonce_key(data["nonce"])):
+        return None
+    return data["by"]
+
+
+def frame_name(frame):
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread and counts the
+    collapsed stacks ("outer;...;inner").
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self):
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.most_common()
+        )
+
+
+class RequestProfiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sampler = StackSampler(
+            threading.get_ident(), get_setting("INTERVAL", 0.005)
+        )
+        self.tracing = get_setting("TRACEMALLOC", True)
+        self.started_tracemalloc = False
+        self.before = None
+
+    def start(self):
+        if self.tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(get_setting("TRACEMALLOC_FRAMES", 10))
+                self.started_tracemalloc = True
+            self.before = tracemalloc.take_snapshot()
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self.started
+        self.allocations = ""
+        if self.tracing:
+            after = tracemalloc.take_snapshot()
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+            # Leave out the profiler's own allocations
+            ignored = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+            differences = after.filter_traces(ignored).compare_to(
+                self.before.filter_traces(ignored), "traceback"
+            )
+            self.allocations = self.format_allocations(differences)
+
+    def format_allocations(self, differences):
+        lines = []
+        for difference in differences[: get_setting("TOP_ALLOCATIONS", 20)]:
+            lines.append(
+                f"{difference.size_diff / 1024:+.1f} KiB in "
+                f"{difference.count_diff:+} blocks"
+            )
+            lines += [f"    {frame}" for frame in difference.traceback.format()]
+        return "\n".join(lines)
+
+
+# One profiled request at a time per worker
+profiling_lock = threading.Lock()
@@ -0,0 +1,330 @@
+"""
+Query result cache with table level invalidation.
+
+Querysets of a CachedQuerySet are cached after `.cache()`, models whose
+default manager is a QueryCacheManager have all of them cached:
+
+    Product.objects.filter(pk=product_id).cache().exists()
+
+    class Collection(models.Model):
+        objects = QueryCacheManager()
+
+Results (rows, exists() and count()) go in the QUERY_CACHE["CACHE"] cache
+under a key made of the compiled SQL, its params and the current version of
+every table the SQL mentions, joins and subqueries included. The version of
+a table is a token in the same cache that changes whenever Django writes to
+the table: an execute wrapper on every connection spots INSERT, UPDATE,
+DELETE and REPLACE statements, whether they come from save(), bulk update()
+and delete() or raw SQL, and bumps the version right away or when the
+transaction commits. Keys with an old version are never looked up again and
+expire. Writes that don't go through Django (another app, a SQL shell) aren't
+seen, they show up after QUERY_CACHE["TIMEOUT"].
+
+Nothing is cached or read from the cache inside transaction.atomic(), the
+transaction may see its own writes before they're committed. Nor are rows
+read from a replica less than READ_REPLICAS["STICKY_SECONDS"] after one of
+their tables changed, the replica may not have the change yet.
+
+Requests allowed to read from a replica (core.routers.use_replica) use the
+versions their worker read less than QUERY_CACHE["VERSION_TTL"] seconds ago,
+so they may miss a write made in another worker for that long, like a replica
+would. Everything else, clients that just wrote included, reads the versions
+from the cache.
+
+Within a request_cache scope (a batch), cached querysets are also kept by SQL
+alone for the rest of the scope.
+"""
+
+import hashlib
+import pickle
+import re
+import time
+from contextvars import ContextVar
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models, transaction
+
+from .routers import get_replica_setting, use_replica
+
+# INSERT [OR REPLACE|OR IGNORE|IGNORE] INTO t, REPLACE INTO t, UPDATE t [JOIN
+# u ...] SET, DELETE FROM t, DELETE t [, u] FROM t JOIN u ..., TRUNCATE t
+WRITE = re.compile(
+    r"\s*(?:"
+    r"(?:INSERT|REPLACE)(?:\s+OR\s+\w+|\s+IGNORE)?\s+INTO\s+(?P<into>[`\"]?\w+)"
+    r"|UPDATE\s+(?:OR\s+\w+\s+)?(?P<update>.+?)\s+SET\b"
+    r"|DELETE\s+(?P<delete>.*?)\s*\bFROM\s+(?P<from>[`\"]?\w+)"
+    r"|TRUNCATE\s+(?:TABLE\s+)?(?P<truncate>[`\"]?\w+)"
+    r")",
+    re.IGNORECASE | re.DOTALL,
+)
+NAME = re.compile(r"[`\"]?(\w+)[`\"]?")
+QUOTED_NAME = re.compile(r"[`\"](\w+)[`\"]")
+
+_tables = None
+
+# {table: (version, when it was read)}, this worker's latest view of the versions
+_versions = {}
+
+# A dict the sub-requests of a /store/batch/ request share (store.batch): their
+# cached querysets by SQL, no cache lookups and table versions until one of
+# them writes and the batch empties it
+request_cache = ContextVar("request_cache", default=None)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "QUERY_CACHE", {}).get(name, default)
+
+
+def get_cache():
+    return caches[get_setting("CACHE", "default")]
+
+
+def model_tables():
+    global _tables
+    if _tables is None:
+        _tables = frozenset(
+            model._meta.db_table for model in apps.get_models(include_auto_created=True)
+        )
+    return _tables
+
+
+def tables_of(sql):
+    # Column names that happen to be table names only add a dependency
+    return sorted(set(QUOTED_NAME.findall(sql)) & model_tables())
+
+
+def written_tables(sql):
+    """
+    Returns the model tables a statement writes to, every table of a multi
+    table UPDATE or DELETE.
+    """
+    match = WRITE.match(sql)
+    if match is None:
+        return set()
+    # Only MySQL's DELETE t FROM t JOIN u names them before FROM
+    names = match["into"] or match["update"] or match["delete"] or match["from"]
+    names = names or match["truncate"]
+    return set(NAME.findall(names)) & model_tables()
+
+
+def version_key(table):
+    return f"querycache:table:{table}"
+
+
+def new_version():
+    # When it was made, for the replica lag
+    return f"{uuid4().hex}:{time.time()}"
+
+
+def table_versions(tables):
+    # Reads that may come from a replica (core.routers) may as well use
+    # versions a little old, without a trip to the shared cache
+    ttl = get_setting("VERSION_TTL", 1)
+    if ttl and use_replica.get():
+        now = time.monotonic()
+        known = [_versions.get(table) for table in tables]
+        if all(entry and now - entry[1] < ttl for entry in known):
+            return [entry[0] for entry in known]
+
+    cache = get_cache()
+    keys = [version_key(table) for table in tables]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Never written to, or dropped by the cache: a new version, so results
+        # cached under the old one can't come back
+        for key in missing:
+            cache.add(key, new_version(), None)
+        versions.update(cache.get_many(missing))
+    remember({table: versions.get(key) for table, key in zip(tables, keys)})
+    return [versions.get(key) for key in keys]
+
+
+def remember(versions):
+    now = time.monotonic()
+    _versions.update(
+        {table: (version, now) for table, version in versions.items() if version}
+    )
+
+
+def bump(tables):
+    versions = {table: new_version() for table in tables}
+    get_cache().set_many(
+        {version_key(table): version for table, version in versions.items()}, None
+    )
+    # This worker sees its own writes right away
+    remember(versions)
+
+
+class TableWatch:
+    """
+    Tells whether tables were written to since start(), by any worker and in
+    any way the WriteDetector sees (bulk_create(), update(), raw SQL), looking
+    at their versions at most every `interval` seconds. For the in-process
+    indexes (tags.index, store.autocomplete) to know when to rebuild.
+    """
+
+    def __init__(self, tables, interval=1):
+        self.tables = tables
+        self.interval = interval
+        self.versions = None
+        self.checked_at = float("-inf")
+
+    def start(self):
+        # Before the tables are read, so a write made meanwhile still shows up
+        self.versions = table_versions(self.tables)
+        self.checked_at = time.monotonic()
+
+    def changed(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.interval:
+            return False
+        self.checked_at = now
+        return table_versions(self.tables) != self.versions
+
+
+class WriteDetector:
+    # Installed on every connection by core.signals.handlers
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        tables = written_tables(sql)
+        if tables:
+            connection = context["connection"]
+            if connection.in_atomic_block:
+                transaction.on_commit(lambda: bump(tables), using=connection.alias)
+            else:
+                bump(tables)
+        return result
+
+
+def install(connection):
+    if not any(
+        isinstance(wrapper, WriteDetector) for wrapper in connection.execute_wrappers
+    ):
+        # First, so connection.execute_wrapper() blocks still pop their own
+        connection.execute_wrappers.insert(0, WriteDetector())
+
+
+class CachedQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached = False
+        self._cache_timeout = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._cached = self._cached
+        clone._cache_timeout = self._cache_timeout
+        return clone
+
+    def cache(self, timeout=None):
+        """
+        Caches the results, for QUERY_CACHE["TIMEOUT"] seconds by default.
+        """
+        clone = self._chain()
+        clone._cached = True
+        clone._cache_timeout = timeout
+        return clone
+
+    def uncached(self):
+        clone = self._chain()
+        clone._cached = False
+        return clone
+
+    def cached(self, kind, query, load):
+        """
+        Returns the cached result of query, or runs load() and caches what it
+        returns.
+        """
+        if (
+            not self._cached
+            or self.query.select_for_update
+            or connections[self.db].in_atomic_block
+        ):
+            return load()
+        try:
+            sql, params = query.get_compiler(using=self.db).as_sql()
+        except EmptyResultSet:
+            return load()
+        tables = tables_of(sql)
+        if not tables:
+            return load()
+        signature = repr(
+            (
+                self.db,
+                kind,
+                self._iterable_class.__qualname__,
+                self._fields,
+                sql,
+                params,
+            )
+        )
+
+        # Kept pickled, the requests of a batch run in parallel and may change
+        # the instances they get (prefetching)
+        scope = request_cache.get()
+        if scope is not None and signature in scope:
+            return pickle.loads(scope[signature])
+
+        versions = table_versions(tables)
+        # "store:" keys are kept in the per-worker LRU of core.cache
+        key = (
+            "store:query:" + hashlib.sha1(f"{signature}{versions}".encode()).hexdigest()
+        )
+        cache = get_cache()
+        value = cache.get(key)
+        if value is None:
+            value = load()
+            if not self.too_big(value) and self.storable(versions):
+                timeout = self._cache_timeout or get_setting("TIMEOUT", 300)
+                cache.add(key, value, timeout)
+        if scope is not None and not self.too_big(value):
+            scope[signature] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return value
+
+    def too_big(self, value):
+        return isinstance(value, list) and len(value) > get_setting("MAX_ROWS", 1000)
+
+    def storable(self, versions):
+        if self.db not in get_replica_setting("ALIASES", []):
+            return True
+        changed_at = max(float(version.rpartition(":")[2]) for version in versions)
+        return time.time() - changed_at > get_replica_setting("STICKY_SECONDS", 5)
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._cached:
+            # Prefetching runs after, on the cached rows
+            self._result_cache = self.cached(
+                "rows", self.query, lambda: list(self._iterable_class(self))
+            )
+        super()._fetch_all()
+
+    def exists(self):
+        if self._result_cache is None and self._cached:
+            return self.cached("exists", self.query.exists(), super().exists)
+        return super().exists()
+
+    def count(self):
+        if self._result_cache is None and self._cached:
+            return self.cached("count", self.query, super().count)
+        return super().count()
+
+
+class QueryCacheManager(models.Manager.from_queryset(CachedQuerySet)):
+    """
+    A manager whose querysets are all cached, `.uncached()` opts one out.
+    """
+
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def get_queryset(self):
+        return super().get_queryset().cache(self.timeout)
+
+
+CachedManager = models.Manager.from_queryset(CachedQuerySet)
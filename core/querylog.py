@@ -0,0 +1,200 @@
+"""
+Slow query log and duplicate query detection.
+
+core.middleware.QueryLogMiddleware wraps the queries of every request. Queries
+slower than QUERY_LOG["SLOW_MS"] are logged right away, with the view and
+serializer they came from and the innermost project frame. At the end of the
+request, query shapes (the SQL with literals and IN lists collapsed) that ran
+QUERY_LOG["N_PLUS_ONE_THRESHOLD"] times or more are logged as probable N+1s,
+and identical queries (same SQL and params) run more than once as duplicates.
+
+Records go to the "core.querylog" logger as JSON lines, see LOGGING in the
+settings, and `manage.py querylog_summary` sums them up.
+"""
+
+import json
+import logging
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.views import View
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r"\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)")
+TRANSACTION_CONTROL = re.compile(
+    r"\s*(?:BEGIN|START TRANSACTION|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT)\b",
+    re.IGNORECASE,
+)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "QUERY_LOG", {}).get(name, default)
+
+
+def query_shape(sql):
+    sql = STRING_LITERAL.sub("?", sql)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    return IN_LIST.sub("IN (...)", sql)
+
+
+# Our own wrappers are on the stack of every query
+INSTRUMENTATION_MODULES = (
+    "core.db",
+    "core.metrics",
+    "core.middleware",
+    "core.querycache",
+    __name__,
+)
+
+
+def is_project_frame(frame):
+    return (
+        frame.f_code.co_filename.startswith(str(settings.BASE_DIR))
+        and "site-packages" not in frame.f_code.co_filename
+        and not frame.f_globals.get("__name__", "").startswith(INSTRUMENTATION_MODULES)
+    )
+
+
+def describe(frame):
+    self = frame.f_locals.get("self")
+    name = frame.f_code.co_name
+    if self is not None:
+        name = f"{type(self).__name__}.{name}"
+    return f"{frame.f_globals.get('__name__', '?')}:{name}:{frame.f_lineno}"
+
+
+def is_view(cls):
+    if issubclass(cls, (APIView, View)):
+        return True
+    # Admin views are ModelAdmin methods, without importing the admin into
+    # processes that don't use it
+    options = sys.modules.get("django.contrib.admin.options")
+    return options is not None and issubclass(cls, options.BaseModelAdmin)
+
+
+def attribute(frame):
+    """
+    Finds where a query comes from: the view and serializer on the stack and
+    the innermost frame of project code.
+    """
+    origin = view = serializer = None
+    while frame is not None:
+        # type() and not isinstance(), which would evaluate lazy objects like
+        # request.user and run more queries
+        cls = type(frame.f_locals.get("self"))
+        if origin is None and is_project_frame(frame):
+            origin = describe(frame)
+        if serializer is None and issubclass(cls, BaseSerializer):
+            serializer = describe(frame)
+        if view is None and is_view(cls):
+            view = describe(frame)
+        frame = frame.f_back
+    return {"origin": origin, "view": view, "serializer": serializer}
+
+
+class RequestQueryLog:
+    def __init__(self, request):
+        self.request = request
+        self.slow_ms = get_setting("SLOW_MS", 100)
+        self.shapes = {}  # {shape: {"count", "time", "where"}}
+        self.identical = {}  # {(sql, params): count}
+        # The parallel sub-requests of a batch (store.batch) log here too
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.record(sql, params, duration, context["connection"].alias)
+
+    def record(self, sql, params, duration, alias):
+        shape = query_shape(sql)
+        # Every atomic() block runs these, they are neither N+1s nor duplicates
+        if not TRANSACTION_CONTROL.match(sql):
+            self.count(sql, params, shape, duration)
+
+        if duration >= self.slow_ms:
+            self.log(
+                "slow_query",
+                alias=alias,
+                shape=shape,
+                sql=sql,
+                params=repr(params)[:500],
+                duration_ms=round(duration, 2),
+                **attribute(sys._getframe(2)),
+            )
+
+    def count(self, sql, params, shape, duration):
+        key = (sql, repr(params))
+        with self._lock:
+            entry = self.shapes.get(shape)
+            if entry is None:
+                # Attributing every query would be too slow, the first one of a
+                # shape is enough to find where the loop is
+                entry = self.shapes[shape] = {
+                    "count": 0,
+                    "time": 0.0,
+                    "where": attribute(sys._getframe(3)),
+                }
+            entry["count"] += 1
+            entry["time"] += duration
+            self.identical[key] = self.identical.get(key, 0) + 1
+
+    def finish(self):
+        threshold = get_setting("N_PLUS_ONE_THRESHOLD", 5)
+        for shape, entry in self.shapes.items():
+            if entry["count"] >= threshold:
+                self.log(
+                    "n_plus_one",
+                    shape=shape,
+                    count=entry["count"],
+                    duration_ms=round(entry["time"], 2),
+                    **entry["where"],
+                )
+        duplicates = {key: count for key, count in self.identical.items() if count > 1}
+        if duplicates:
+            self.log(
+                "duplicate_queries",
+                queries=len(duplicates),
+                wasted=sum(duplicates.values()) - len(duplicates),
+                top=[
+                    {"shape": query_shape(sql), "count": count}
+                    for (sql, _), count in sorted(
+                        duplicates.items(), key=lambda item: item[1], reverse=True
+                    )[:5]
+                ],
+            )
+
+    def log(self, kind, **fields):
+        match = self.request.resolver_match
+        logger.warning(
+            kind,
+            extra={
+                "query_log": {
+                    "kind": kind,
+                    "route": (match.view_name if match else None) or "unmatched",
+                    "method": self.request.method,
+                    "path": self.request.path,
+                    **fields,
+                }
+            },
+        )
+
+
+class JSONFormatter(logging.Formatter):
+    # One JSON object per line, for the "core.querylog" handler
+    def format(self, record):
+        data = {"time": self.formatTime(record), "level": record.levelname}
+        data.update(getattr(record, "query_log", {"message": record.getMessage()}))
+        return json.dumps(data, default=str)
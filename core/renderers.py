@@ -0,0 +1,133 @@
+"""
+Faster JSON rendering and parsing, and MessagePack for internal services.
+
+FastJSONRenderer encodes with orjson when it's installed, which writes
+Decimal, UUID and datetimes itself instead of calling back into Python for
+every value. The output is the same bytes as DRF's JSONRenderer: compact, UTF-8,
+\\u2028/\\u2029 escaped, decimals as floats (COERCE_DECIMAL_TO_STRING is off).
+The one difference is plain floats below 1e-4 or from 1e16 up, which orjson
+writes without Python's zero padded exponent (1e-5 and not 1e-05), same value.
+Pretty printed output (`Accept: application/json; indent=4`, the browsable
+API) and anything orjson can't encode go through DRF's renderer.
+
+MessagePackRenderer and MessagePackParser handle application/msgpack and need
+the msgpack package, see REST_FRAMEWORK in the settings.
+"""
+
+import decimal
+import io
+import math
+import re
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# DRF's encoder for everything orjson and msgpack don't know
+fallback_encoder = JSONEncoder()
+
+LONG_NUMBER = re.compile(rb"\d{19}")
+
+
+def encode_float(number):
+    if not math.isfinite(number):
+        # What json.dumps(allow_nan=False) does
+        raise ValueError("Out of range float values are not JSON compliant")
+    # float.__repr__ is what json.dumps writes
+    return orjson.Fragment(repr(number))
+
+
+def orjson_default(value):
+    if isinstance(value, decimal.Decimal):
+        number = float(value)
+        # orjson writes these the same way as json.dumps, only exponents differ
+        if number == 0 or 1e-4 <= abs(number) < 1e16:
+            return number
+        return encode_float(number)
+    return fallback_encoder.default(value)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(
+                data, default=orjson_default, option=orjson.OPT_UTC_Z
+            )
+        except orjson.JSONEncodeError:
+            # Let DRF's renderer encode it (e.g. dicts with int keys), or raise
+            # its usual error
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, keep the output a strict javascript subset
+        if b"\xe2\x80\xa8" in content or b"\xe2\x80\xa9" in content:
+            content = content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return content
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace("-", "") != "utf8":
+            return super().parse(stream, media_type, parser_context)
+        content = stream.read()
+        # orjson reads integers over 64 bits as floats, json keeps them exact
+        if not LONG_NUMBER.search(content):
+            try:
+                return orjson.loads(content)
+            except orjson.JSONDecodeError:
+                pass
+        # json.load raises the usual ParseError
+        return super().parse(io.BytesIO(content), media_type, parser_context)
+
+
+def msgpack_default(value):
+    # Same values as in the JSON, UUIDs and datetimes as strings
+    return fallback_encoder.default(value)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=msgpack_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except ValueError as exc:
+            raise ParseError(
+                f"MessagePack parse error - {str(exc) or exc.__class__.__name__}"
+            )
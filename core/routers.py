@@ -0,0 +1,137 @@
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from store import sharding
+
+
+# Set by core.middleware.ReplicaRoutingMiddleware for safe requests handled by
+# the catalog views, while the client isn't pinned to the primary
+use_replica = ContextVar("use_replica", default=False)
+
+
+def get_replica_setting(name, default=None):
+    return getattr(settings, "READ_REPLICAS", {}).get(name, default)
+
+
+def reads_from_replicas(view_func):
+    # The catalog views, by module
+    view_class = getattr(view_func, "cls", None) or getattr(
+        view_func, "view_class", None
+    )
+    module = getattr(view_class or view_func, "__module__", "")
+    return module in get_replica_setting("VIEW_MODULES", [])
+
+
+class ReplicaSet:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._down_until = {}
+        self._checked_at = {}
+
+    @property
+    def aliases(self):
+        return get_replica_setting("ALIASES", [])
+
+    def mark_down(self, alias):
+        retry_after = get_replica_setting("RETRY_AFTER", 30)
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + retry_after
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        if self._down_until.get(alias, 0) > now:
+            return False
+        interval = get_replica_setting("HEALTH_CHECK_INTERVAL", 10)
+        if now - self._checked_at.get(alias, 0) < interval:
+            return True
+
+        self._checked_at[alias] = now
+        connection = connections[alias]
+        try:
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+            connection.ensure_connection()
+        except Exception:
+            self.mark_down(alias)
+            return False
+        return True
+
+    def choose(self):
+        # Round robin over the healthy replicas, falling back to the primary
+        healthy = [alias for alias in self.aliases if self.is_healthy(alias)]
+        if not healthy:
+            return "default"
+        return healthy[next(self._counter) % len(healthy)]
+
+
+replicas = ReplicaSet()
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to a replica while core.middleware.ReplicaRoutingMiddleware says
+    so, everything else goes to the primary ("default").
+    """
+
+    def db_for_read(self, model, **hints):
+        if use_replica.get() and replicas.aliases:
+            return replicas.choose()
+        # Django reads related rows from the database of the instance they hang
+        # off, but an order's customer or product isn't on the order's shard
+        instance = hints.get("instance")
+        if (
+            instance is not None
+            and instance._state.db not in (None, "default")
+            and not sharding.is_sharded(model)
+        ):
+            return "default"
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {"default", *replicas.aliases}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ShardRouter:
+    """
+    Sends orders and carts (store.sharding.SHARDED_MODELS) to their shard and
+    leaves every other model to the next router.
+    """
+
+    def route(self, model, hints):
+        if not sharding.is_enabled() or not sharding.is_sharded(model):
+            return None
+        instance = hints.get("instance")
+        if instance is not None:
+            if sharding.is_sharded(type(instance)) and instance._state.db:
+                return instance._state.db
+            alias = sharding.shard_for_instance(instance)
+            if alias is not None:
+                return alias
+        return sharding.current_shard.get() or "default"
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows point at customers and products on the default database
+        if sharding.is_enabled() and (
+            sharding.is_sharded(type(obj1)) or sharding.is_sharded(type(obj2))
+        ):
+            return True
+        return None
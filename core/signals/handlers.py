@@ -1,7 +1,15 @@
+from core import querycache
 from store.signals import order_created
+from django.db.backends.signals import connection_created
 from django.dispatch import receiver
 
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
-    print(kwargs['order'])
\ No newline at end of file
+    print(kwargs['order'])
+
+
+# Bumps the query cache versions of the tables every write touches
+@receiver(connection_created)
+def detect_writes(sender, connection, **kwargs):
+    querycache.install(connection)
@@ -1,3 +1,882 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db.models import Count
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from likes.models import LikeCounter, LikedItem
+from store.models import Collection, Customer, Order, OrderItem, Product, Promotion
+
+from . import cache as two_tier
+from . import metrics, profiling, querycache, querylog
+from .db import pool as db_pool
+from .management.commands import benchmark, seed_store
+from .cache import LocalTier, TwoTierCache
+from .expand import ExpandableSerializerMixin
+from .middleware import PathMiddlewareRouter, ReplicaRoutingMiddleware
+from .models import ProfileRecord
+from .routers import PrimaryReplicaRouter, replicas, use_replica
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shared",
+    },
+}
+
+READ_REPLICAS = {
+    "ALIASES": ["replica"],
+    "VIEW_MODULES": ["store.views", "store.async_views"],
+    "STICKY_SECONDS": 5,
+}
+
+
+@override_settings(READ_REPLICAS=READ_REPLICAS)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        patcher = mock.patch.object(replicas, "is_healthy", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_a_replica_while_use_replica_is_set(self):
+        token = use_replica.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(Product), "replica")
+        finally:
+            use_replica.reset(token)
+
+    def test_other_reads_are_left_to_django(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+        product = Product(id=1)
+        product._state.db = "default"
+        self.assertIsNone(self.router.db_for_read(Collection, instance=product))
+
+    def test_related_rows_of_a_sharded_instance_come_from_default(self):
+        order = Order(id=1)
+        order._state.db = "shard1"
+        self.assertEqual(self.router.db_for_read(Customer, instance=order), "default")
+        self.assertIsNone(self.router.db_for_read(OrderItem, instance=order))
+
+    def test_writes_go_to_the_primary(self):
+        token = use_replica.set(True)
+        try:
+            self.assertEqual(self.router.db_for_write(Product), "default")
+        finally:
+            use_replica.reset(token)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, READ_REPLICAS=READ_REPLICAS)
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.seen = []
+
+    def call(self, method, path, status=200, has_writes=None, token="JWT a"):
+        def get_response(request):
+            self.seen.append(use_replica.get())
+            if has_writes is not None:
+                request.has_writes = has_writes
+            return HttpResponse(status=status)
+
+        request = getattr(self.factory, method.lower())(path, HTTP_AUTHORIZATION=token)
+        ReplicaRoutingMiddleware(get_response)(request)
+        return request
+
+    def test_catalog_reads_use_a_replica(self):
+        self.call("GET", "/store/products/")
+        self.call("GET", "/store/collections/1/")
+        self.assertEqual(self.seen, [True, True])
+        # Reset once the response is out
+        self.assertFalse(use_replica.get())
+
+    def test_other_requests_use_the_primary(self):
+        self.call("GET", "/auth/users/")
+        self.call("GET", "/no/such/page/")
+        self.call("POST", "/store/carts/", status=201)
+        self.assertEqual(self.seen, [False, False, False])
+
+    def test_a_client_sticks_to_the_primary_after_a_write(self):
+        self.call("POST", "/store/carts/", status=201)
+        request = self.call("GET", "/store/products/")
+        self.assertTrue(request.pinned_to_primary)
+        self.assertEqual(self.seen, [False, False])
+        # Other clients don't
+        self.call("GET", "/store/products/", token="JWT b")
+        self.assertEqual(self.seen[-1], True)
+
+    def test_failed_and_read_only_posts_dont_pin(self):
+        self.call("POST", "/store/carts/", status=400)
+        self.call("POST", "/store/batch/", has_writes=False)
+        request = self.call("GET", "/store/products/")
+        self.assertFalse(request.pinned_to_primary)
+        self.assertEqual(self.seen[-1], True)
+
+    def test_use_replica_is_reset_when_the_view_raises(self):
+        def get_response(request):
+            raise ValueError
+
+        request = self.factory.get("/store/products/")
+        with self.assertRaises(ValueError):
+            ReplicaRoutingMiddleware(get_response)(request)
+        self.assertFalse(use_replica.get())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, READ_REPLICAS={**READ_REPLICAS, "ALIASES": []})
+class AsyncReplicaRoutingTests(TestCase):
+    async def test_async_catalog_views_under_asgi(self):
+        # The middleware runs in a thread, the view in the event loop
+        response = await self.async_client.get("/store/async/collections/")
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get("/store/async/products/")
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncOnlyMiddleware:
+    sync_capable = False
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        markcoroutinefunction(self)
+
+    async def __call__(self, request):
+        response = await self.get_response(request)
+        response["X-Chain"] = "async"
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if "stop" in request.GET:
+            return HttpResponse("stopped")
+        return None
+
+
+@override_settings(
+    PATH_MIDDLEWARE={
+        "": [
+            "core.tests.AsyncOnlyMiddleware",
+            "django.middleware.common.CommonMiddleware",
+        ]
+    }
+)
+class PathMiddlewareRouterTests(SimpleTestCase):
+    factory = RequestFactory()
+
+    async def test_the_chains_are_async_under_asgi(self):
+        async def view(request):
+            return HttpResponse()
+
+        router = PathMiddlewareRouter(view)
+        self.assertTrue(iscoroutinefunction(router))
+        response = await router(self.factory.get("/"))
+        self.assertEqual(response["X-Chain"], "async")
+        # Sync hooks are awaited in a thread, as by Django
+        request = self.factory.get("/?stop")
+        response = await router.process_view(request, view, (), {})
+        self.assertEqual(response.content, b"stopped")
+
+    def test_async_middleware_under_wsgi(self):
+        router = PathMiddlewareRouter(lambda request: HttpResponse())
+        self.assertFalse(iscoroutinefunction(router))
+        self.assertEqual(router(self.factory.get("/"))["X-Chain"], "async")
+
+
+class LocalTierTests(SimpleTestCase):
+    def test_least_recently_used_entries_go_first(self):
+        tier = LocalTier("test", max_entries=2, max_bytes=1000, max_item_bytes=100)
+        tier.set("a", b"1", 30)
+        tier.set("b", b"2", 30)
+        tier.get("a")
+        tier.set("c", b"3", 30)
+        self.assertEqual(tier.get("a"), b"1")
+        self.assertIsNone(tier.get("b"))
+        self.assertEqual(tier.get_stats()["evictions"], 1)
+
+    def test_bytes_are_bounded(self):
+        tier = LocalTier("test", max_entries=100, max_bytes=10, max_item_bytes=8)
+        tier.set("a", b"x" * 6, 30)
+        tier.set("b", b"x" * 6, 30)
+        self.assertIsNone(tier.get("a"))
+        self.assertEqual(tier.get_stats()["bytes"], 6)
+        # Too big to keep at all, and the old value goes
+        tier.set("b", b"x" * 9, 30)
+        self.assertIsNone(tier.get("b"))
+        self.assertEqual(tier.get_stats()["bytes"], 0)
+
+    def test_entries_expire(self):
+        tier = LocalTier("test", max_entries=10, max_bytes=1000, max_item_bytes=100)
+        tier.set("a", b"1", 0)
+        self.assertIsNone(tier.get("a"))
+        self.assertEqual(tier.get_stats()["entries"], 0)
+
+    def test_clearing_a_namespace_keeps_the_others(self):
+        tier = LocalTier("test", max_entries=10, max_bytes=1000, max_item_bytes=100)
+        tier.set("a", b"1", 30, "store:query")
+        tier.set("b", b"2", 30, "store:other")
+        tier.clear("store:other")
+        self.assertEqual(tier.get("a"), b"1")
+        self.assertIsNone(tier.get("b"))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        two_tier._tiers.clear()
+        self.addCleanup(two_tier._tiers.clear)
+        caches["shared"].clear()
+        # Two workers, their watcher threads never wake up during a test
+        params = {
+            "OPTIONS": {"LOCAL_PREFIXES": ["store:"], "GENERATION_INTERVAL": 3600}
+        }
+        self.one = TwoTierCache("one", params)
+        self.two = TwoTierCache("two", params)
+
+    def check(self, cache):
+        cache.local.check_generations(caches["shared"])
+
+    def test_reads_fill_the_local_tier(self):
+        self.one.set("store:product:1", "a")
+        self.assertEqual(self.two.get("store:product:1"), "a")
+        self.assertEqual(self.two.get("store:product:1"), "a")
+        stats = self.two.local.get_stats()
+        self.assertEqual((stats["shared_hits"], stats["local_hits"]), (1, 1))
+        self.assertIsNone(self.two.get("store:product:2"))
+        self.assertEqual(self.two.local.get_stats()["misses"], 1)
+
+    def test_writes_elsewhere_show_up_after_a_check(self):
+        self.one.set("store:product:1", "a")
+        self.two.get("store:product:1")
+        self.one.set("store:product:1", "b")
+        self.assertEqual(self.two.get("store:product:1"), "a")
+        self.check(self.two)
+        self.assertEqual(self.two.get("store:product:1"), "b")
+
+        self.one.delete("store:product:1")
+        self.check(self.two)
+        self.assertIsNone(self.two.get("store:product:1"))
+
+    def test_writes_only_flush_their_namespace(self):
+        self.one.add("store:query:1", "rows")
+        self.one.set("store:product:1", "a")
+        self.two.get("store:query:1")
+        self.two.get("store:product:1")
+        self.one.set("store:product:1", "b")
+        self.check(self.two)
+        self.assertEqual(self.two.get("store:query:1"), "rows")
+        self.assertEqual(self.two.local.get_stats()["local_hits"], 1)
+
+    def test_add_doesnt_flush(self):
+        self.one.add("store:query:1", "rows")
+        self.two.get("store:query:1")
+        self.one.add("store:query:2", "more rows")
+        self.check(self.two)
+        self.assertEqual(self.two.get("store:query:1"), "rows")
+        self.assertEqual(self.two.local.get_stats()["flushes"], 0)
+
+    def test_a_write_here_drops_what_changed_elsewhere(self):
+        self.one.set("store:product:1", "a")
+        self.two.get("store:product:1")
+        self.one.set("store:product:1", "b")
+        # Before two's watcher noticed
+        self.two.set("store:product:2", "c")
+        self.assertEqual(self.two.get("store:product:1"), "b")
+
+    def test_other_keys_skip_the_local_tier(self):
+        self.one.set("db-pin:x", True)
+        self.assertTrue(self.two.get("db-pin:x"))
+        self.assertEqual(self.two.local.get_stats()["entries"], 0)
+
+
+class WrittenTablesTests(SimpleTestCase):
+    def assertWrites(self, sql, *tables):
+        self.assertEqual(querycache.written_tables(sql), set(tables), sql)
+
+    def test_inserts(self):
+        self.assertWrites('INSERT INTO "store_cart" ("id") VALUES (%s)', "store_cart")
+        self.assertWrites(
+            'INSERT OR IGNORE INTO "store_cart" ("id") VALUES (%s)', "store_cart"
+        )
+        self.assertWrites(
+            'INSERT OR REPLACE INTO "store_cart" ("id") VALUES (%s)', "store_cart"
+        )
+        self.assertWrites(
+            "INSERT IGNORE INTO `store_cart` (`id`) VALUES (%s)", "store_cart"
+        )
+        self.assertWrites("REPLACE INTO `store_cart` (`id`) VALUES (%s)", "store_cart")
+        self.assertWrites(
+            'INSERT INTO "store_product" ("id", "title") VALUES (%s, %s) '
+            'ON CONFLICT("id") DO UPDATE SET "title" = EXCLUDED."title"',
+            "store_product",
+        )
+
+    def test_updates(self):
+        self.assertWrites(
+            'UPDATE "store_product" SET "inventory" = %s WHERE "store_product"."id" '
+            'IN (SELECT U0."id" FROM "store_collection" U0)',
+            "store_product",
+        )
+        self.assertWrites(
+            "UPDATE `store_product` INNER JOIN `store_collection` ON "
+            "(`store_product`.`collection_id` = `store_collection`.`id`) "
+            "SET `store_product`.`inventory` = %s",
+            "store_product",
+            "store_collection",
+        )
+        self.assertWrites(
+            "UPDATE `store_product`, `store_collection` SET `inventory` = %s",
+            "store_product",
+            "store_collection",
+        )
+
+    def test_deletes(self):
+        self.assertWrites(
+            'DELETE FROM "store_cartitem" WHERE "store_cartitem"."id" IN (%s)',
+            "store_cartitem",
+        )
+        self.assertWrites(
+            "DELETE `store_cartitem` FROM `store_cartitem` INNER JOIN `store_cart` "
+            "ON (`store_cartitem`.`cart_id` = `store_cart`.`id`)",
+            "store_cartitem",
+        )
+        self.assertWrites(
+            "DELETE `store_cartitem`, `store_cart` FROM `store_cartitem` "
+            "INNER JOIN `store_cart` ON (`store_cartitem`.`cart_id` = `store_cart`.`id`)",
+            "store_cartitem",
+            "store_cart",
+        )
+        self.assertWrites("TRUNCATE `store_cart`", "store_cart")
+
+    def test_reads_and_unknown_tables(self):
+        self.assertWrites('SELECT "store_product"."id" FROM "store_product" FOR UPDATE')
+        self.assertWrites('INSERT INTO "django_migrations" ("app") VALUES (%s)')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryCacheTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        querycache._versions.clear()
+
+    def version(self):
+        return querycache.table_versions(["store_collection"])[0]
+
+    def assertBumps(self, write):
+        before = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(self.version(), before)
+
+    def test_writes_bump_the_table_version(self):
+        self.assertBumps(lambda: Collection.objects.create(title="a"))
+        self.assertBumps(
+            lambda: Collection.objects.bulk_create(
+                [Collection(id=1, title="b")], ignore_conflicts=True
+            )
+        )
+        self.assertBumps(
+            lambda: Collection.objects.bulk_create(
+                [Collection(id=1, title="c")],
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=["title"],
+            )
+        )
+        self.assertBumps(lambda: Collection.objects.update(title="d"))
+        self.assertBumps(lambda: Collection.objects.all().delete())
+
+    def test_replica_reads_reuse_recent_versions(self):
+        version = self.version()
+        # Written by another worker
+        caches["default"].set(querycache.version_key("store_collection"), "other")
+        token = use_replica.set(True)
+        try:
+            self.assertEqual(self.version(), version)
+        finally:
+            use_replica.reset(token)
+        self.assertEqual(self.version(), "other")
+
+    def test_own_writes_are_seen_right_away(self):
+        token = use_replica.set(True)
+        try:
+            version = self.version()
+            querycache.bump(["store_collection"])
+            self.assertNotEqual(self.version(), version)
+        finally:
+            use_replica.reset(token)
+
+
+@override_settings(QUERY_LOG={"SLOW_MS": 0, "N_PLUS_ONE_THRESHOLD": 3})
+class QueryLogTests(TransactionTestCase):
+    def run_logged(self, queries):
+        query_log = querylog.RequestQueryLog(RequestFactory().get("/"))
+        with self.assertLogs("core.querylog") as logs:
+            with connection.execute_wrapper(query_log):
+                queries()
+            query_log.finish()
+        return [record.query_log for record in logs.records]
+
+    def test_queries_are_attributed_to_the_code_that_ran_them(self):
+        # The query cache's WriteDetector is the outermost wrapper
+        self.assertTrue(
+            any(
+                isinstance(wrapper, querycache.WriteDetector)
+                for wrapper in connection.execute_wrappers
+            )
+        )
+        records = self.run_logged(lambda: list(Collection.objects.all()))
+        self.assertEqual(records[0]["kind"], "slow_query")
+        self.assertRegex(records[0]["origin"], r"^core\.tests:<lambda>:")
+
+    def test_transaction_control_is_not_a_repeated_query(self):
+        def queries():
+            for write in [
+                lambda: Collection.objects.create(title="a"),
+                lambda: Collection.objects.update(title="b"),
+                lambda: Collection.objects.all().delete(),
+            ]:
+                with transaction.atomic():
+                    with transaction.atomic():
+                        write()
+
+        kinds = {record["kind"] for record in self.run_logged(queries)}
+        self.assertEqual(kinds, {"slow_query"})
+
+    def test_repeated_queries_are_logged(self):
+        def queries():
+            with connection.cursor() as cursor:
+                for _ in range(3):
+                    cursor.execute("SELECT %s", [1])
+
+        kinds = {record["kind"] for record in self.run_logged(queries)}
+        self.assertEqual(kinds, {"slow_query", "n_plus_one", "duplicate_queries"})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProfilingTests(TestCase):
+    def test_a_token_profiles_one_request(self):
+        token = profiling.make_token("admin", "/store/collections/")
+        # Not used up by a request it isn't for
+        self.client.get("/store/products/", HTTP_X_PROFILE=token)
+        for _ in range(2):
+            self.client.get("/store/collections/", HTTP_X_PROFILE=token)
+        record = ProfileRecord.objects.get()
+        self.assertEqual(record.path, "/store/collections/")
+        self.assertEqual(record.trigger, ProfileRecord.TRIGGER_HEADER)
+        self.assertEqual(record.issued_by, "admin")
+
+    def test_bad_tokens_are_ignored(self):
+        token = profiling.make_token("admin")
+        self.assertIsNone(profiling.use_token(token[:-1] + "x", "/"))
+        self.assertIsNone(profiling.use_token("nonsense", "/"))
+        self.assertEqual(profiling.use_token(token, "/"), "admin")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedQuerySetTests(TransactionTestCase):
+    # Outside of atomic(), where cached querysets use the cache
+
+    def setUp(self):
+        caches["default"].clear()
+        querycache._versions.clear()
+
+    def test_cached_querysets_see_every_kind_of_write(self):
+        Collection.objects.all().delete()
+        titles = lambda: sorted(Collection.objects.values_list("title", flat=True))
+        Collection.objects.bulk_create([Collection(id=1, title="a")])
+        self.assertEqual(titles(), ["a"])
+        self.assertEqual(Collection.objects.count(), 1)
+
+        Collection.objects.bulk_create(
+            [Collection(id=1, title="x"), Collection(id=2, title="b")],
+            ignore_conflicts=True,
+        )
+        self.assertEqual(titles(), ["a", "b"])
+        self.assertEqual(Collection.objects.count(), 2)
+        Collection.objects.bulk_create(
+            [Collection(id=1, title="c")],
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=["title"],
+        )
+        self.assertEqual(titles(), ["b", "c"])
+        Collection.objects.filter(pk=2).update(title="d")
+        self.assertEqual(titles(), ["c", "d"])
+        Collection.objects.filter(pk=2).delete()
+        self.assertEqual(titles(), ["c"])
+        self.assertFalse(Collection.objects.filter(title="d").exists())
+
+
+def metrics_snapshot(pid, routes, buckets=(0.1, 1), host=metrics.HOST):
+    return {
+        "pid": pid,
+        "host": host,
+        "buckets": list(buckets),
+        "routes": routes,
+        "pools": [
+            {
+                "alias": "default",
+                "pid": pid,
+                "size": 2,
+                "in_use": 1,
+                **dict.fromkeys(
+                    ["checkouts", "waits", "wait_time", "timeouts", "connects"], 0
+                ),
+            }
+        ],
+        "caches": [],
+    }
+
+
+def route(name, count, total, buckets, statuses, **sums):
+    return {
+        "route": name,
+        "method": "GET",
+        "count": count,
+        "sum": total,
+        "buckets": buckets,
+        "statuses": statuses,
+        **{name: 0 for name in metrics.RouteMetrics.SUMS},
+        **sums,
+    }
+
+
+class RenderPrometheusTests(SimpleTestCase):
+    def render(self, snapshots):
+        lines = metrics.render_prometheus(snapshots).splitlines()
+        return {
+            line.rpartition(" ")[0]: line.rpartition(" ")[2]
+            for line in lines
+            if not line.startswith("#")
+        }
+
+    def test_routes_add_up_over_the_workers(self):
+        values = self.render(
+            [
+                metrics_snapshot(
+                    1,
+                    [route("products-list", 3, 0.5, [2, 1, 0], {"2xx": 3}, queries=6)],
+                ),
+                metrics_snapshot(
+                    2, [route("products-list", 2, 2.5, [0, 1, 1], {"2xx": 1, "5xx": 1})]
+                ),
+            ]
+        )
+        labels = 'route="products-list",method="GET"'
+        histogram = "storefront_request_duration_seconds"
+        self.assertEqual(values[f'{histogram}_bucket{{{labels},le="0.1"}}'], "2")
+        self.assertEqual(values[f'{histogram}_bucket{{{labels},le="1"}}'], "4")
+        self.assertEqual(values[f'{histogram}_bucket{{{labels},le="+Inf"}}'], "5")
+        self.assertEqual(values[f"{histogram}_sum{{{labels}}}"], "3.0")
+        self.assertEqual(values[f"{histogram}_count{{{labels}}}"], "5")
+        self.assertEqual(
+            values[f'storefront_responses_total{{{labels},status="2xx"}}'], "4"
+        )
+        self.assertEqual(
+            values[f'storefront_responses_total{{{labels},status="5xx"}}'], "1"
+        )
+        self.assertEqual(values[f"storefront_request_queries_total{{{labels}}}"], "6")
+
+    def test_pools_are_per_worker(self):
+        values = self.render([metrics_snapshot(1, []), metrics_snapshot(2, [])])
+        self.assertEqual(
+            values['storefront_db_pool_in_use{alias="default",pid="1"}'], "1"
+        )
+        self.assertEqual(
+            values['storefront_db_pool_in_use{alias="default",pid="2"}'], "1"
+        )
+
+    def test_labels_are_escaped(self):
+        values = self.render(
+            [metrics_snapshot(1, [route('a"b\\c', 1, 0.1, [1, 0, 0], {})])]
+        )
+        self.assertIn(
+            'storefront_request_duration_seconds_count{route="a\\"b\\\\c",method="GET"}',
+            values,
+        )
+
+
+class CollectTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(
+            METRICS={"DIR": self.directory, "FLUSH_INTERVAL": 10, "STALE_INTERVALS": 3}
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, name, snapshot, age=0):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as file:
+            json.dump(snapshot, file)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_files_of_stopped_workers_are_dropped(self):
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        # A live process of this host, another host's unknown one
+        running = self.write("1-a.json", metrics_snapshot(os.getppid(), []))
+        elsewhere = self.write("2-a.json", metrics_snapshot(exited.pid, [], host="x"))
+        dead = self.write("3-a.json", metrics_snapshot(exited.pid, []))
+        idle = self.write("4-a.json", metrics_snapshot(os.getppid(), [], host="x"), 31)
+
+        pids = sorted(snapshot["pid"] for snapshot in metrics.collect())
+        self.assertEqual(pids, sorted([os.getpid(), os.getppid(), exited.pid]))
+        self.assertTrue(os.path.exists(running))
+        self.assertTrue(os.path.exists(elsewhere))
+        self.assertFalse(os.path.exists(dead))
+        self.assertFalse(os.path.exists(idle))
+
+    def test_a_reused_pid_gets_its_own_file(self):
+        self.write(f"{os.getpid()}.json", metrics_snapshot(os.getpid(), []))
+        metrics.collect()
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_stats_under_concurrent_checkouts(self):
+        pool = db_pool.ConnectionPool("test", max_size=4)
+
+        def use(_):
+            for _ in range(200):
+                connection = pool.checkout(FakeConnection, lambda connection: True)
+                pool.checkin(connection)
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(use, range(8)))
+        stats = pool.get_stats()
+        self.assertEqual(stats["checkouts"], 1600)
+        self.assertEqual(stats["connects"], stats["size"])
+        self.assertEqual(stats["in_use"], 0)
+
+    def test_a_new_pool_when_the_alias_changes_database(self):
+        self.addCleanup(db_pool._pools.pop, "test", None)
+        first = db_pool.get_pool("test", "a", {})
+        self.assertIs(db_pool.get_pool("test", "a", {}), first)
+        idle, in_use = FakeConnection(), FakeConnection()
+        for connection in [idle, in_use]:
+            first.checkout(lambda connection=connection: connection, None)
+        first.checkin(idle)
+
+        second = db_pool.get_pool("test", "b", {})
+        self.assertIsNot(second, first)
+        self.assertTrue(idle.closed)
+        first.checkin(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(
+            [stats["alias"] for stats in db_pool.all_stats()].count("test"), 1
+        )
+
+
+class MetricsEndpointTests(TestCase):
+    def test_staff_logged_in_to_the_admin_can_read_it(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        staff = get_user_model().objects.create_user("staff", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertEqual(self.client.get("/metrics/db-pool/").status_code, 200)
+
+
+class TagSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    label = serializers.CharField()
+
+
+class InnerSerializer(ExpandableSerializerMixin, serializers.Serializer):
+    tag = serializers.IntegerField(source="tag.id")
+    expandable_fields = {"tag": (TagSerializer, {})}
+
+
+class OuterSerializer(ExpandableSerializerMixin, serializers.Serializer):
+    tag = serializers.IntegerField(source="tag.id")
+    inner = InnerSerializer()
+    expandable_fields = {"tag": (TagSerializer, {}), "inner": (InnerSerializer, {})}
+
+
+class ExpandableSerializerTests(SimpleTestCase):
+    instance = {
+        "tag": {"id": 1, "label": "a"},
+        "inner": {"tag": {"id": 2, "label": "b"}},
+    }
+
+    def test_nested_serializers_only_expand_what_reaches_them(self):
+        data = OuterSerializer(self.instance, context={"expand": {"tag"}}).data
+        self.assertEqual(data, {"tag": {"id": 1, "label": "a"}, "inner": {"tag": 2}})
+        data = OuterSerializer(self.instance, context={"expand": {"inner.tag"}}).data
+        self.assertEqual(data, {"tag": 1, "inner": {"tag": {"id": 2, "label": "b"}}})
+
+    def test_many(self):
+        data = OuterSerializer(
+            [self.instance], many=True, context={"expand": {"tag"}}
+        ).data
+        self.assertEqual(data[0]["tag"], {"id": 1, "label": "a"})
+        self.assertEqual(data[0]["inner"], {"tag": 2})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExpandTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.collection = Collection.objects.create(title="Shoes")
+        self.promotion = Promotion.objects.create(description="Sale", discount=10)
+        self.add_products(2)
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                title=f"p{i}",
+                slug="p",
+                unit_price=1,
+                inventory=1,
+                collection=self.collection,
+            )
+            product.promotions.add(self.promotion)
+
+    def queries(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context), response.json()
+
+    def test_unknown_names_are_rejected(self):
+        response = self.client.get("/store/products/?expand=collection,nope")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("nope", response.json()["expand"])
+
+    def test_relations_take_one_query_per_page(self):
+        path = "/store/products/?expand=collection,promotions"
+        before, data = self.queries(path)
+        self.assertEqual(data["results"][0]["collection"]["title"], "Shoes")
+        self.assertEqual(data["results"][0]["promotions"][0]["description"], "Sale")
+        self.add_products(3)
+        after, data = self.queries(path)
+        self.assertEqual(len(data["results"]), 5)
+        self.assertEqual(after, before)
+
+    def test_writes_ignore_expand(self):
+        user = get_user_model().objects.create_user(
+            username="staff", email="staff@example.com", password="x", is_staff=True
+        )
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            "/store/products/?expand=collection",
+            {
+                "title": "New",
+                "slug": "new",
+                "inventory": 1,
+                "unit_price": 1,
+                "collection": self.collection.id,
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["collection"], self.collection.id)
+        # Unknown names too
+        response = self.client.put(
+            f"/store/products/{response.json()['id']}/?expand=nope",
+            {
+                "title": "Newer",
+                "slug": "new",
+                "inventory": 1,
+                "unit_price": 1,
+                "collection": self.collection.id,
+            },
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EndpointBenchmarkTests(TransactionTestCase):
+    # The endpoint half of `manage.py benchmark`, against the same baseline
+    databases = "__all__"
+
+    @skipIf(len(settings.DATABASES) > 1, "the baseline is made with one database")
+    def test_endpoints_run_no_more_queries_than_the_baseline(self):
+        with open(benchmark.default_baseline()) as file:
+            baseline = json.load(file)["endpoints"]
+        command = benchmark.Command()
+        fixtures = command.make_fixtures()
+        for name, method, path, user, data in command.endpoints(fixtures):
+            with self.subTest(name):
+                result = command.bench_endpoint(method, path, user, data)
+                self.assertEqual(result["status"], baseline[name]["status"])
+                self.assertLessEqual(result["queries"], baseline[name]["queries"])
+
+    def test_customers_orders_are_listed_in_a_fixed_number_of_queries(self):
+        command = benchmark.Command()
+        fixtures = command.make_fixtures()
+        client = APIClient()
+        client.force_authenticate(fixtures["customer"])
+        with CaptureQueriesContext(connection) as few:
+            client.get("/store/orders/")
+        client.post("/store/orders/", {"cart_id": fixtures["cart"]}, format="json")
+        with CaptureQueriesContext(connection) as more:
+            client.get("/store/orders/")
+        self.assertEqual(len(more), len(few))
+
+
+class SeedStoreTests(TransactionTestCase):
+    databases = "__all__"
+
+    def test_seeds_a_small_store(self):
+        # Worker threads instead of processes, they share the test databases
+        with mock.patch.object(seed_store, "ProcessPoolExecutor", ThreadPoolExecutor):
+            call_command(
+                "seed_store",
+                collections=2,
+                products=20,
+                customers=10,
+                orders=30,
+                carts=5,
+                reviews=20,
+                tags=3,
+                tagged_items=20,
+                # Many more than there are (user, product) pairs to like
+                likes=500,
+                workers=1,
+                stdout=io.StringIO(),
+            )
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertLessEqual(LikedItem.objects.count(), 10 * 20)
+        counts = dict(
+            LikedItem.objects.values_list("object_id")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        self.assertEqual(
+            dict(LikeCounter.objects.values_list("object_id", "count")), counts
+        )
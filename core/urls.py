@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path("metrics", views.prometheus_metrics),
+    path("metrics/db-pool/", views.db_pool_stats),
+]
@@ -1,3 +1,56 @@
-from django.shortcuts import render
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    permission_classes,
+    renderer_classes,
+)
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-# Create your views here.
+from . import metrics
+from .db.pool import all_stats
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "prometheus"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Errors (401, 403) come as a dict
+        return "".join(f"# {key}: {value}\n" for key, value in data.items()).encode(
+            self.charset
+        )
+
+
+# Staff members logged in to the admin can open these in the browser (the
+# /metrics chain of PATH_MIDDLEWARE has sessions), GET only so no CSRF
+METRICS_AUTHENTICATION = [
+    *api_settings.DEFAULT_AUTHENTICATION_CLASSES,
+    SessionAuthentication,
+]
+
+
+@api_view()
+@authentication_classes(METRICS_AUTHENTICATION)
+@permission_classes([IsAdminUser])
+def db_pool_stats(request):
+    # Only covers the worker that handles the request
+    return Response(all_stats())
+
+
+# Prometheus scrape target, aggregated over all the workers (see core.metrics)
+@api_view()
+@authentication_classes(METRICS_AUTHENTICATION)
+@permission_classes([IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def prometheus_metrics(request):
+    return Response(
+        metrics.render_prometheus(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,137 @@
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import LikedItem
+
+
+# Optional per-user cache for heavy likers: every content type maps to a bytes
+# bitset (bit n set = object n liked), so a liked/not-liked check for a whole
+# page is a few byte lookups. When the ids are sparse or large and the bitset
+# would be bigger than the ids themselves, the sorted ids are kept instead. Only
+# users with at least MIN_LIKES likes are cached, up to BITSET_CACHE_USERS users
+# and BITSET_CACHE_BYTES bytes; everyone else goes straight to
+# LikedItem.objects.liked_by.
+#
+# Entries are dropped once a like/unlike commits in this worker, and other
+# workers notice through a version key in the default cache.
+
+
+def get_setting(name, default):
+    return getattr(settings, 'LIKES', {}).get(name, default)
+
+
+def to_bitset(object_ids):
+    # object_id is a PositiveIntegerField, 4 bytes are enough
+    if len(object_ids) * 4 < max(object_ids) // 8 + 1:
+        return array('I', sorted(object_ids))
+    bits = bytearray(max(object_ids) // 8 + 1)
+    for object_id in object_ids:
+        bits[object_id // 8] |= 1 << (object_id % 8)
+    return bytes(bits)
+
+
+def is_set(bits, object_id):
+    if isinstance(bits, array):
+        i = bisect_left(bits, object_id)
+        return i < len(bits) and bits[i] == object_id
+    # One byte, a shift of an int as big as the bitset would copy all of it
+    i = object_id // 8
+    return i < len(bits) and bits[i] >> (object_id % 8) & 1 == 1
+
+
+def size(bitsets):
+    if bitsets is None:
+        return 0
+    return sum(memoryview(bits).nbytes for bits in bitsets.values())
+
+
+def version_key(user_id):
+    return f'likes:bitset:{user_id}'
+
+
+class LikedBitsetCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {user_id: (version, {content_type_id: bytes})}
+        self._bytes = 0
+
+    @property
+    def max_users(self):
+        return get_setting('BITSET_CACHE_USERS', 0)
+
+    @property
+    def max_bytes(self):
+        return get_setting('BITSET_CACHE_BYTES', 16 * 1024 * 1024)
+
+    @property
+    def min_likes(self):
+        return get_setting('BITSET_MIN_LIKES', 200)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+        cache.set(version_key(user_id), uuid4().hex, timeout=None)
+
+    def get(self, user_id):
+        if not self.max_users:
+            return None
+        version = cache.get(version_key(user_id))
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        object_ids = {}
+        likes = LikedItem.objects.filter(user_id=user_id) \
+            .values_list('content_type_id', 'object_id')
+        for content_type_id, object_id in likes.iterator():
+            object_ids.setdefault(content_type_id, []).append(object_id)
+
+        # Light users are remembered as None so we don't reload them every time,
+        # and so are the ones whose bitsets alone would fill the cache
+        bitsets = None
+        if sum(len(ids) for ids in object_ids.values()) >= self.min_likes:
+            bitsets = {
+                content_type_id: to_bitset(ids)
+                for content_type_id, ids in object_ids.items()
+            }
+            if size(bitsets) > self.max_bytes:
+                bitsets = None
+
+        with self._lock:
+            self._drop(user_id)
+            self._entries[user_id] = (version, bitsets)
+            self._bytes += size(bitsets)
+            while len(self._entries) > self.max_users or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+        return bitsets
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= size(entry[1])
+
+
+bitsets = LikedBitsetCache()
+
+
+def liked_by(user, targets):
+    """
+    Returns the subset of (content_type_id, object_id) pairs the user has liked,
+    from the bitset cache when the user is in it and with one query otherwise.
+    """
+    user_bitsets = bitsets.get(user.id)
+    if user_bitsets is None:
+        return LikedItem.objects.liked_by(user, targets)
+    return {
+        (content_type_id, object_id)
+        for content_type_id, object_id in targets
+        if is_set(user_bitsets.get(content_type_id, b''), object_id)
+    }
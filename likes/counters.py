@@ -0,0 +1,143 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import LikeCounter
+
+
+logger = logging.getLogger(__name__)
+
+
+# Like/unlike bursts on a popular object would all update the same counter row.
+# Instead every worker buffers the increments in memory and flushes them to
+# LikeCounter in one go, either every FLUSH_INTERVAL seconds or as soon as
+# FLUSH_THRESHOLD distinct objects are waiting.
+
+
+def get_setting(name, default):
+    return getattr(settings, 'LIKES', {}).get(name, default)
+
+
+class LikeCounterBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(int)  # {(content_type_id, object_id): delta}
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    @property
+    def flush_interval(self):
+        return get_setting('FLUSH_INTERVAL', 5)
+
+    @property
+    def flush_threshold(self):
+        return get_setting('FLUSH_THRESHOLD', 500)
+
+    def add(self, content_type_id, object_id, delta):
+        with self._lock:
+            self._deltas[(content_type_id, object_id)] += delta
+            due = (
+                len(self._deltas) >= self.flush_threshold
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        self._start_flusher()
+        if due:
+            self.flush_quietly()
+
+    def pending(self, content_type_id, object_ids):
+        with self._lock:
+            return {
+                object_id: self._deltas.get((content_type_id, object_id), 0)
+                for object_id in object_ids
+            }
+
+    def flush(self):
+        with self._lock:
+            deltas = {key: delta for key, delta in self._deltas.items() if delta}
+            self._deltas.clear()
+            self._last_flush = time.monotonic()
+        if not deltas:
+            return 0
+
+        # Group the keys by content type and delta so a flush is a handful of
+        # UPDATEs instead of one per object
+        groups = defaultdict(list)
+        for (content_type_id, object_id), delta in deltas.items():
+            groups[(content_type_id, delta)].append(object_id)
+
+        try:
+            with transaction.atomic():
+                LikeCounter.objects.bulk_create(
+                    [
+                        LikeCounter(
+                            content_type_id=content_type_id, object_id=object_id
+                        )
+                        for content_type_id, object_id in deltas
+                    ],
+                    ignore_conflicts=True,
+                )
+                for (content_type_id, delta), object_ids in groups.items():
+                    LikeCounter.objects.filter(
+                        content_type_id=content_type_id, object_id__in=object_ids
+                    ).update(count=F('count') + delta)
+        except Exception:
+            # Put the increments back so they go out with the next flush
+            with self._lock:
+                for key, delta in deltas.items():
+                    self._deltas[key] += delta
+            raise
+        return len(deltas)
+
+    def _start_flusher(self):
+        # A background thread makes sure increments don't sit in memory when
+        # this worker stops receiving likes
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_periodically,
+                name='like-counter-flusher',
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush_quietly()
+            connection.close()
+
+    def flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not flush like counters')
+
+
+buffer = LikeCounterBuffer()
+atexit.register(buffer.flush_quietly)
+
+
+def get_counts(content_type, object_ids):
+    """
+    Returns {object_id: like count} for a page of objects in a single query,
+    including the increments this worker hasn't flushed yet.
+    """
+    object_ids = list(object_ids)
+    counts = dict.fromkeys(object_ids, 0)
+    counts.update(
+        LikeCounter.objects.filter(
+            content_type=content_type, object_id__in=object_ids
+        ).values_list('object_id', 'count')
+    )
+    for object_id, delta in buffer.pending(content_type.id, object_ids).items():
+        counts[object_id] += delta
+    return counts
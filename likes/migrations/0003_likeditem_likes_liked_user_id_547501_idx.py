@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-19 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('likes', '0002_likecounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='likeditem',
+            index=models.Index(fields=['user', 'content_type', 'object_id'], name='likes_liked_user_id_547501_idx'),
+        ),
+    ]
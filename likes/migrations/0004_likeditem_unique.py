@@ -0,0 +1,42 @@
+# Generated by Django 4.2.3 on 2026-10-19 08:26
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # Concurrent toggles could insert the same like twice, each counted
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCounter = apps.get_model('likes', 'LikeCounter')
+    duplicates = LikedItem.objects.values('user_id', 'content_type_id', 'object_id') \
+        .annotate(count=Count('id'), keep=Min('id')) \
+        .filter(count__gt=1) \
+        .order_by()
+    for row in duplicates.iterator():
+        LikedItem.objects.filter(
+            user_id=row['user_id'],
+            content_type_id=row['content_type_id'],
+            object_id=row['object_id'],
+        ).exclude(id=row['keep']).delete()
+        LikeCounter.objects.filter(
+            content_type_id=row['content_type_id'], object_id=row['object_id']
+        ).update(count=F('count') - (row['count'] - 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('likes', '0003_likeditem_likes_liked_user_id_547501_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='likeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='likes_likeditem_unique_user_object'),
+        ),
+        migrations.RemoveIndex(
+            model_name='likeditem',
+            name='likes_liked_user_id_547501_idx',
+        ),
+    ]
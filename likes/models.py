@@ -1,12 +1,67 @@
 from django.db import models
+from django.db.models import Exists, OuterRef, Q
 from django.conf import settings
 from core.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 
+class LikedItemManager(models.Manager):
+    def liked_by(self, user, targets):
+        """
+        Takes a list of (content_type_id, object_id) pairs and returns the set of
+        pairs the user has liked, using a single query on the user index.
+        """
+        object_ids = {}
+        for content_type_id, object_id in targets:
+            object_ids.setdefault(content_type_id, set()).add(object_id)
+        if not object_ids:
+            return set()
+
+        condition = Q()
+        for content_type_id, ids in object_ids.items():
+            condition |= Q(content_type_id=content_type_id, object_id__in=ids)
+
+        return set(
+            self.filter(condition, user=user)
+            .values_list('content_type_id', 'object_id')
+        )
+
+    def annotate_liked(self, queryset, user, name='liked'):
+        # Adds a boolean `liked` column to any queryset of likeable objects
+        if not user.is_authenticated:
+            return queryset.annotate(**{name: models.Value(False)})
+        content_type = ContentType.objects.get_for_model(queryset.model)
+        return queryset.annotate(**{name: Exists(
+            self.filter(
+                user=user, content_type=content_type, object_id=OuterRef('pk')
+            )
+        )})
+
+
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        # One like per user and object, two concurrent toggles can't both insert.
+        # Its index also serves the per-user lookups
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'content_type', 'object_id'],
+                name='likes_likeditem_unique_user_object',
+            )
+        ]
+
+
+# Denormalized like count per object, kept up to date by likes.counters
+class LikeCounter(models.Model):
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['content_type', 'object_id']]
@@ -0,0 +1,29 @@
+from django.contrib.contenttypes.models import ContentType
+from rest_framework import serializers
+
+
+class ContentTypeField(serializers.CharField):
+    # Content types are referenced by their natural key, e.g. "store.product"
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            app_label, model = value.lower().split('.')
+            return ContentType.objects.get_by_natural_key(app_label, model)
+        except (ValueError, ContentType.DoesNotExist):
+            raise serializers.ValidationError(f"Unknown content type '{value}'")
+
+
+class LikeTargetSerializer(serializers.Serializer):
+    content_type = ContentTypeField()
+    object_id = serializers.IntegerField(min_value=0)
+
+
+class LikeCountsSerializer(serializers.Serializer):
+    content_type = ContentTypeField()
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), max_length=1000
+    )
+
+
+class LikedCheckSerializer(serializers.Serializer):
+    items = serializers.ListField(child=LikeTargetSerializer(), max_length=1000)
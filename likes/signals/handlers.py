@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from likes.bitsets import bitsets
+from likes.counters import buffer
+from likes.models import LikedItem
+
+
+# Drop the user's cached liked bitsets whenever they like or unlike something.
+# Once it's committed, or another request could cache the old likes under the
+# new version
+@receiver(post_save, sender=LikedItem)
+@receiver(post_delete, sender=LikedItem)
+def invalidate_liked_bitsets(sender, **kwargs):
+    user_id = kwargs['instance'].user_id
+    transaction.on_commit(lambda: bitsets.invalidate(user_id), using=kwargs['using'])
+
+
+# Counted however a like comes or goes (toggle, the admin, a deleted user's likes
+# going with them), once it's committed
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, **kwargs):
+    if kwargs['created']:
+        item = kwargs['instance']
+        args = (item.content_type_id, item.object_id, 1)
+        transaction.on_commit(lambda: buffer.add(*args), using=kwargs['using'])
+
+
+@receiver(post_delete, sender=LikedItem)
+def uncount_like(sender, **kwargs):
+    item = kwargs['instance']
+    args = (item.content_type_id, item.object_id, -1)
+    transaction.on_commit(lambda: buffer.add(*args), using=kwargs['using'])
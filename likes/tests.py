@@ -1,3 +1,203 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from store.models import Collection, Product
+
+from .bitsets import bitsets, is_set, liked_by, to_bitset, version_key
+from .counters import buffer
+from .models import LikeCounter, LikedItem
+
+LIKES = {
+    # Flushed by the tests only
+    "FLUSH_INTERVAL": 3600,
+    "FLUSH_THRESHOLD": 10**6,
+    "BITSET_CACHE_USERS": 10,
+    "BITSET_MIN_LIKES": 2,
+}
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+@override_settings(LIKES=LIKES, CACHES=LOCMEM_CACHES)
+class LikeTestCase(TestCase):
+    def setUp(self):
+        # Into the test's transaction, rolled back with it
+        self.addCleanup(buffer.flush)
+        self.content_type = ContentType.objects.get_for_model(Product)
+        self.user = self.make_user("a")
+        # Ids come back after a rollback, so may the cached bitsets
+        bitsets.invalidate(self.user.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_user(self, name):
+        return get_user_model().objects.create_user(
+            username=name, email=f"{name}@example.com", password="x"
+        )
+
+    def like(self, user, object_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return LikedItem.objects.create(
+                user=user, content_type=self.content_type, object_id=object_id
+            )
+
+    def counter(self, object_id):
+        buffer.flush()
+        row = LikeCounter.objects.filter(
+            content_type=self.content_type, object_id=object_id
+        ).first()
+        return row.count if row else 0
+
+
+class ToggleTests(LikeTestCase):
+    def toggle(self, object_id=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/likes/toggle/",
+                {"content_type": "store.product", "object_id": object_id},
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_toggle(self):
+        self.assertTrue(self.toggle()["liked"])
+        self.assertEqual(self.counter(1), 1)
+        self.assertFalse(self.toggle()["liked"])
+        self.assertEqual(self.counter(1), 0)
+
+    def test_a_user_likes_an_object_once(self):
+        self.like(self.user, 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LikedItem.objects.create(
+                user=self.user, content_type=self.content_type, object_id=1
+            )
+
+    def test_losing_a_race_to_like_counts_once(self):
+        self.like(self.user, 1)
+        # The other toggle's like wasn't there yet when this one looked
+        with mock.patch.object(QuerySet, "delete", return_value=(0, {})):
+            self.assertTrue(self.toggle()["liked"])
+        self.assertEqual(self.counter(1), 1)
+        self.assertEqual(LikedItem.objects.count(), 1)
+
+    def test_counts_follow_deletes_outside_toggle(self):
+        other = self.make_user("b")
+        self.like(self.user, 1)
+        self.like(other, 1)
+        self.like(other, 2)
+        self.assertEqual(self.counter(1), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.counter(1), 1)
+        self.assertEqual(self.counter(2), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            LikedItem.objects.all().delete()
+        self.assertEqual(self.counter(1), 0)
+
+
+class ProductLikedTests(LikeTestCase):
+    def test_products_say_whether_the_user_liked_them(self):
+        collection = Collection.objects.create(title="Shoes")
+        products = [
+            Product.objects.create(
+                title=title,
+                slug=title,
+                unit_price=1,
+                inventory=1,
+                collection=collection,
+            )
+            for title in ["a", "b"]
+        ]
+        self.like(self.user, products[0].id)
+
+        response = self.client.get("/store/products/", {"collection_id": collection.id})
+        liked = {
+            product["id"]: product["liked"] for product in response.json()["results"]
+        }
+        self.assertEqual(liked, {products[0].id: True, products[1].id: False})
+        response = self.client.get(f"/store/products/{products[0].id}/")
+        self.assertTrue(response.json()["liked"])
+
+        # Anonymous responses are shared, they don't have it
+        response = APIClient().get(f"/store/products/{products[0].id}/")
+        self.assertNotIn("liked", response.json())
+
+
+class BitsetTests(SimpleTestCase):
+    def test_bits(self):
+        bits = to_bitset([0, 7, 8, 100])
+        self.assertEqual(len(bits), 13)
+        for object_id in [0, 7, 8, 100]:
+            self.assertTrue(is_set(bits, object_id))
+        for object_id in [1, 9, 99, 101, 10**9]:
+            self.assertFalse(is_set(bits, object_id))
+
+    def test_sparse_ids_are_kept_as_ids(self):
+        bits = to_bitset([3, 2**31 - 1, 10**6])
+        self.assertEqual(memoryview(bits).nbytes, 12)
+        for object_id in [3, 10**6, 2**31 - 1]:
+            self.assertTrue(is_set(bits, object_id))
+        for object_id in [0, 4, 10**6 + 1, 2**32]:
+            self.assertFalse(is_set(bits, object_id))
+
+
+class LikedByTests(LikeTestCase):
+    def liked(self, object_ids):
+        targets = [(self.content_type.id, object_id) for object_id in object_ids]
+        expected = LikedItem.objects.liked_by(self.user, targets)
+        result = liked_by(self.user, targets)
+        self.assertEqual(result, expected)
+        return sorted(object_id for _, object_id in result)
+
+    def test_heavy_likers_are_answered_from_their_bitsets(self):
+        for object_id in [1, 5, 300]:
+            self.like(self.user, object_id)
+        self.assertEqual(self.liked([1, 2, 5, 300, 301]), [1, 5, 300])
+        targets = [(self.content_type.id, 1), (self.content_type.id, 2)]
+        with self.assertNumQueries(0):
+            self.assertEqual(liked_by(self.user, targets), {(self.content_type.id, 1)})
+
+    def test_the_cache_is_bounded_in_bytes(self):
+        other = self.make_user("b")
+        for user in [self.user, other]:
+            for object_id in [1, 80 * 1000]:
+                self.like(user, object_id)
+        # 8 bytes of ids each, the second pushes the first out
+        with override_settings(LIKES={**LIKES, "BITSET_CACHE_BYTES": 12}):
+            self.assertIsNotNone(bitsets.get(self.user.id))
+            self.assertIsNotNone(bitsets.get(other.id))
+            with self.assertNumQueries(1):
+                bitsets.get(self.user.id)
+        with override_settings(LIKES={**LIKES, "BITSET_CACHE_BYTES": 4}):
+            bitsets.invalidate(self.user.id)
+            self.assertIsNone(bitsets.get(self.user.id))
+            self.assertEqual(self.liked([1, 2]), [1])
+
+    def test_light_likers_are_looked_up(self):
+        self.like(self.user, 1)
+        self.assertEqual(self.liked([1, 2]), [1])
+
+    def test_bitsets_change_once_the_like_commits(self):
+        self.like(self.user, 1)
+        self.like(self.user, 2)
+        self.assertEqual(self.liked([1, 2, 3]), [1, 2])
+        version = cache.get(version_key(self.user.id))
+        with self.captureOnCommitCallbacks() as callbacks:
+            LikedItem.objects.create(
+                user=self.user, content_type=self.content_type, object_id=3
+            )
+        # Not committed yet
+        self.assertEqual(cache.get(version_key(self.user.id)), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(cache.get(version_key(self.user.id)), version)
+        self.assertEqual(self.liked([1, 2, 3]), [1, 2, 3])
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+# URLConf
+urlpatterns = [
+    path('toggle/', views.toggle, name='like-toggle'),
+    path('count/', views.count, name='like-count'),
+    path('counts/', views.counts, name='like-counts'),
+    path('liked/', views.liked, name='liked'),
+]
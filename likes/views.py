@@ -1,3 +1,81 @@
-from django.shortcuts import render
+from django.db import IntegrityError, transaction
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
-# Create your views here.
+from .bitsets import liked_by
+from .counters import get_counts
+from .models import LikedItem
+from .serializers import (
+    LikeCountsSerializer,
+    LikedCheckSerializer,
+    LikeTargetSerializer,
+)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def toggle(request):
+    serializer = LikeTargetSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    content_type = serializer.validated_data['content_type']
+    object_id = serializer.validated_data['object_id']
+
+    try:
+        with transaction.atomic():
+            deleted, _ = LikedItem.objects.filter(
+                user=request.user, content_type=content_type, object_id=object_id
+            ).delete()
+            if not deleted:
+                LikedItem.objects.create(
+                    user=request.user, content_type=content_type, object_id=object_id
+                )
+    except IntegrityError:
+        # A concurrent toggle liked it first, and counted it
+        deleted = 0
+    # The counts follow the likes through likes.signals.handlers
+
+    return Response({
+        'liked': not deleted,
+        'count': get_counts(content_type, [object_id])[object_id],
+    })
+
+
+@api_view()
+def count(request):
+    serializer = LikeTargetSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    content_type = serializer.validated_data['content_type']
+    object_id = serializer.validated_data['object_id']
+    return Response({'count': get_counts(content_type, [object_id])[object_id]})
+
+
+# /likes/counts/?content_type=store.product&ids=1,2,3
+@api_view()
+def counts(request):
+    serializer = LikeCountsSerializer(data={
+        'content_type': request.query_params.get('content_type'),
+        'ids': [id for id in request.query_params.get('ids', '').split(',') if id],
+    })
+    serializer.is_valid(raise_exception=True)
+    like_counts = get_counts(
+        serializer.validated_data['content_type'], serializer.validated_data['ids']
+    )
+    return Response(
+        {str(object_id): count for object_id, count in like_counts.items()}
+    )
+
+
+# Answers "has the current user liked these objects" for a whole page at once.
+# Body: {"items": [{"content_type": "store.product", "object_id": 1}, ...]}
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def liked(request):
+    serializer = LikedCheckSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    targets = [
+        (item['content_type'].id, item['object_id'])
+        for item in serializer.validated_data['items']
+    ]
+    liked_targets = liked_by(request.user, targets)
+    return Response({'liked': [target in liked_targets for target in targets]})
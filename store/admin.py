@@ -4,6 +4,22 @@ from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from . import models
+from .autocomplete import autocomplete, get_setting as get_autocomplete_setting
+
+
+class PrefixSearchMixin:
+    # Answers admin searches (including autocomplete_fields lookups) from the
+    # in-memory prefix index instead of an icontains scan over search_fields
+    def get_search_results(self, request, queryset, search_term):
+        source = autocomplete.for_model(self.model)
+        if source is None or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        max_ids = get_autocomplete_setting("MAX_ADMIN_IDS", 500)
+        pks = source.search(search_term, max_ids + 1)
+        # Too many to send as query parameters, the database searches instead
+        if len(pks) > max_ids:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=pks), False
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -19,7 +35,7 @@ class InventoryFilter(admin.SimpleListFilter):
 
 
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(PrefixSearchMixin, admin.ModelAdmin):
     autocomplete_fields = ["collection"]
     prepopulated_fields = {"slug": ["title"]}
     actions = ["clear_inventory"]
@@ -50,7 +66,7 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Collection)
-class CollectionAdmin(admin.ModelAdmin):
+class CollectionAdmin(PrefixSearchMixin, admin.ModelAdmin):
     autocomplete_fields = ["featured_product"]
     list_display = ["title", "products_count"]
     search_fields = ["title"]
@@ -71,7 +87,7 @@ class CollectionAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(PrefixSearchMixin, admin.ModelAdmin):
     list_display = ["first_name", "last_name", "membership", "orders"]
     list_editable = ["membership"]
     list_per_page = 10
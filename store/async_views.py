@@ -0,0 +1,131 @@
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.views import View
+
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.response import Response
+
+from .views import CollectionViewSet, ProductViewSet, ReviewViewSet
+
+# Async variants of the read-only actions of the catalog viewsets. They reuse the
+# viewset for authentication, permissions, filtering, pagination, serialization
+# and rendering, which run in hops to the sync thread; only the reads of the rows
+# themselves go through the async ORM (acount, afirst, async for), so under ASGI a
+# worker isn't tied up while it waits on the database for them.
+
+
+class PageRows:
+    """
+    The rows of one page, read ahead with the async ORM, standing in for the
+    whole queryset when the viewset's paginator slices out that page.
+    """
+
+    def __init__(self, count, offset, rows):
+        self._count = count
+        self.offset = offset
+        self.rows = rows
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        # The paginator only asks for the page it picked from the same count
+        return self.rows[index.start - self.offset : index.stop - self.offset]
+
+
+class AsyncReadOnlyView(View):
+    viewset_class = None
+    http_method_names = ["get", "head", "options"]
+
+    def get_viewset(self, request, kwargs):
+        action = "retrieve" if "pk" in kwargs else "list"
+        viewset = self.viewset_class(
+            action_map={"get": action, "head": action},
+            args=(),
+            kwargs=kwargs,
+            format_kwarg=None,
+        )
+        viewset.request = viewset.initialize_request(request)
+        viewset.headers = viewset.default_response_headers
+        return viewset
+
+    def prepare(self, viewset):
+        # Everything that may touch the database synchronously (JWT user lookup,
+        # the tag index) runs in one hop to the sync thread
+        viewset.initial(viewset.request)
+        return viewset.filter_queryset(viewset.get_queryset())
+
+    async def get(self, request, *args, **kwargs):
+        viewset = self.get_viewset(request, kwargs)
+        try:
+            queryset = await sync_to_async(self.prepare)(viewset)
+            if "pk" in kwargs:
+                obj = await queryset.filter(pk=kwargs["pk"]).afirst()
+                if obj is None:
+                    raise NotFound
+                data = await sync_to_async(self.serialize)(viewset, obj)
+            else:
+                data = await self.list(viewset, queryset)
+        except APIException as exc:
+            return await sync_to_async(self.render_exception)(viewset, exc)
+        return await sync_to_async(self.render)(viewset, Response(data))
+
+    async def list(self, viewset, queryset):
+        paginator = viewset.paginator
+        if paginator is None or not paginator.get_page_size(viewset.request):
+            rows = [obj async for obj in queryset]
+            return await sync_to_async(self.serialize)(viewset, rows, many=True)
+
+        count = await queryset.acount()
+        start, stop = self.page_bounds(viewset, count)
+        rows = [obj async for obj in queryset[start:stop]] if stop > start else []
+        return await sync_to_async(self.serialize_page)(
+            viewset, PageRows(count, start, rows)
+        )
+
+    def page_bounds(self, viewset, count):
+        # Where the page the paginator is going to pick lies, from the count only
+        paginator = viewset.paginator
+        django_paginator = paginator.django_paginator_class(
+            range(count), paginator.get_page_size(viewset.request)
+        )
+        try:
+            page = django_paginator.page(
+                paginator.get_page_number(viewset.request, django_paginator)
+            )
+        except InvalidPage:
+            # paginate_queryset raises the NotFound
+            return 0, 0
+        return page.object_list.start, page.object_list.stop
+
+    def serialize(self, viewset, instance, many=False):
+        return viewset.get_serializer(instance, many=many).data
+
+    def serialize_page(self, viewset, rows):
+        page = viewset.paginate_queryset(rows)
+        return viewset.get_paginated_response(self.serialize(viewset, page, True)).data
+
+    def render(self, viewset, response):
+        # With the renderer content negotiation picked in initial() (Accept,
+        # ?format=), or the default one when it failed before, as the viewset
+        # would
+        response = viewset.finalize_response(viewset.request, response)
+        return response.render()
+
+    def render_exception(self, viewset, exc):
+        return self.render(viewset, viewset.handle_exception(exc))
+
+
+class AsyncProductView(AsyncReadOnlyView):
+    viewset_class = ProductViewSet
+
+
+class AsyncCollectionView(AsyncReadOnlyView):
+    viewset_class = CollectionViewSet
+
+
+class AsyncReviewView(AsyncReadOnlyView):
+    viewset_class = ReviewViewSet
@@ -0,0 +1,216 @@
+import heapq
+from bisect import bisect_left, insort
+from threading import RLock
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from core.querycache import TableWatch
+
+# Shared autocomplete service. Each source keeps a sorted list of (token, pk)
+# pairs so a prefix lookup is a bisect plus a short scan instead of an
+# icontains scan on the table. Sources are registered in the signal handlers
+# and refreshed incrementally once a saved or deleted row commits. Indexes are
+# per worker: when the tables of a source change any other way (another
+# worker, bulk_create(), update()) it's rebuilt, at most
+# AUTOCOMPLETE["CHECK_INTERVAL"] seconds later.
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "AUTOCOMPLETE", {}).get(name, default)
+
+
+def tokenize(text):
+    return sorted(set(text.casefold().split()))
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = RLock()
+        self._entries = []  # sorted [(token, pk), ...]
+        self._tokens = {}  # {pk: [token, ...]}
+        self.labels = {}  # {pk: label}
+
+    def load(self, items):
+        entries = []
+        tokens = {}
+        labels = {}
+        for pk, label in items:
+            tokens[pk] = tokenize(label)
+            labels[pk] = label
+            entries.extend((token, pk) for token in tokens[pk])
+        entries.sort()
+        with self._lock:
+            self._entries, self._tokens, self.labels = entries, tokens, labels
+
+    def set(self, pk, label):
+        with self._lock:
+            self._discard(pk)
+            self._tokens[pk] = tokenize(label)
+            self.labels[pk] = label
+            for token in self._tokens[pk]:
+                insort(self._entries, (token, pk))
+
+    def remove(self, pk):
+        with self._lock:
+            self._discard(pk)
+
+    def _discard(self, pk):
+        for token in self._tokens.pop(pk, ()):
+            i = bisect_left(self._entries, (token, pk))
+            if i < len(self._entries) and self._entries[i] == (token, pk):
+                del self._entries[i]
+        self.labels.pop(pk, None)
+
+    def _prefix_matches(self, prefix):
+        pks = set()
+        i = bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and self._entries[i][0].startswith(prefix):
+            pks.add(self._entries[i][1])
+            i += 1
+        return pks
+
+    def search(self, term, limit=None):
+        # Every word of the term has to prefix-match one of the words of the label
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1")
+        words = tokenize(term)
+        if not words:
+            return []
+        with self._lock:
+            pks = None
+            for word in sorted(words, key=len, reverse=True):
+                matches = self._prefix_matches(word)
+                pks = matches if pks is None else pks & matches
+                if not pks:
+                    return []
+            key = lambda pk: (self.labels[pk].casefold(), pk)
+            if limit is None:
+                return sorted(pks, key=key)
+            # Short terms match most of the index, only order what's returned
+            return heapq.nsmallest(limit, pks, key=key)
+
+
+class AutocompleteSource:
+    def __init__(
+        self, name, model, get_queryset, get_label, staff_only=False, related=()
+    ):
+        self.name = name
+        self.model = model
+        self.get_queryset = get_queryset
+        self.get_label = get_label
+        self.staff_only = staff_only
+        self.related = related
+        self._index = None
+        self._watch = None
+        self._lock = RLock()
+
+    @property
+    def watch(self):
+        # Made on first use, related models may be given as "app.Model"
+        if self._watch is None:
+            models = [self.model]
+            models += [
+                apps.get_model(model) if isinstance(model, str) else model
+                for model in self.related
+            ]
+            self._watch = TableWatch(
+                [model._meta.db_table for model in models],
+                get_setting("CHECK_INTERVAL", 5),
+            )
+        return self._watch
+
+    @property
+    def index(self):
+        with self._lock:
+            if self._index is None or self.watch.changed():
+                self.watch.start()
+                index = PrefixIndex()
+                index.load(
+                    (obj.pk, self.get_label(obj))
+                    for obj in self.get_queryset().iterator(chunk_size=2000)
+                )
+                self._index = index
+            return self._index
+
+    def refresh(self, obj):
+        # Nothing to do until somebody has actually searched this source
+        if self._index is not None:
+            self._index.set(obj.pk, self.get_label(obj))
+
+    def remove(self, pk):
+        if self._index is not None:
+            self._index.remove(pk)
+
+    def search(self, term, limit=None):
+        return self.index.search(term, limit)
+
+    def suggestions(self, term, limit=10):
+        index = self.index
+        return [
+            {"id": pk, "label": index.labels[pk]} for pk in index.search(term, limit)
+        ]
+
+
+class AutocompleteService:
+    def __init__(self):
+        self.sources = {}
+
+    def register(
+        self,
+        name,
+        model,
+        get_label=str,
+        get_queryset=None,
+        staff_only=False,
+        related=None,
+    ):
+        """
+        Registers a model as an autocomplete source and keeps it in sync through
+        post_save/post_delete. `related` maps other models to a function returning
+        the instances of `model` whose label depends on them
+        (e.g. a Customer's label comes from its User).
+        """
+        if get_queryset is None:
+            get_queryset = model._default_manager.all
+        related = related or {}
+        source = AutocompleteSource(
+            name, model, get_queryset, get_label, staff_only, list(related)
+        )
+        self.sources[name] = source
+
+        # Once committed, a rolled back change never shows up
+        def on_save(sender, instance, using, **kwargs):
+            transaction.on_commit(lambda: source.refresh(instance), using=using)
+
+        def on_delete(sender, instance, using, **kwargs):
+            pk = instance.pk
+            transaction.on_commit(lambda: source.remove(pk), using=using)
+
+        post_save.connect(on_save, sender=model, weak=False)
+        post_delete.connect(on_delete, sender=model, weak=False)
+
+        for related_model, get_instances in related.items():
+
+            def on_related_save(
+                sender, instance, using, get_instances=get_instances, **kwargs
+            ):
+                def refresh():
+                    for obj in get_instances(instance):
+                        source.refresh(obj)
+
+                transaction.on_commit(refresh, using=using)
+
+            post_save.connect(on_related_save, sender=related_model, weak=False)
+        return source
+
+    def for_model(self, model):
+        for source in self.sources.values():
+            if source.model is model:
+                return source
+        return None
+
+
+autocomplete = AutocompleteService()
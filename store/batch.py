@@ -0,0 +1,227 @@
+"""
+Several store API calls in one request, for /store/batch/.
+
+    POST /store/batch/
+    {"requests": [
+        {"id": "collections", "path": "/store/collections/"},
+        {"id": "me", "path": "/store/customers/me/"},
+        {"id": "cart", "method": "POST", "path": "/store/carts/", "body": {}}
+    ]}
+
+    {"responses": [{"id": "collections", "status": 200, "body": [...]}, ...]}
+
+Each sub-request goes straight to its view, without the middleware, as the
+user the batch request was authenticated as. Runs of consecutive GETs are
+independent reads and run in parallel on BATCH["WORKERS"] threads. Anything
+else runs on its own, in order, and the GETs after it see what it wrote. The
+responses come back in the order of the requests. With
+core.middleware.WriteQueueMiddleware (SQLite), each of those writes waits for
+its turn in the write queue, the reads don't.
+
+Querysets cached anyway (`.cache()` or a QueryCacheManager, see
+core.querycache) are also kept by SQL for the rest of the batch, until one of
+its sub-requests writes. Other queries run every time.
+"""
+
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from core.middleware import installed, query_wrappers, queued
+from core.querycache import request_cache
+from core.routers import reads_from_replicas, use_replica
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "BATCH", {}).get(name, default)
+
+
+# Shared by all the batches of a worker, so they can't open more than
+# BATCH["WORKERS"] extra connections
+executor = ThreadPoolExecutor(
+    max_workers=get_setting("WORKERS", 4), thread_name_prefix="batch"
+)
+
+
+# Not passed on to the sub-requests, or set for them
+SKIPPED_HEADERS = (
+    "CONTENT_LENGTH",
+    "CONTENT_TYPE",
+    "HTTP_ACCEPT",
+    "HTTP_AUTHORIZATION",
+)
+
+
+def sub_request(request, item, may_use_replica):
+    parts = urlsplit(item["path"])
+    body = json.dumps(item["body"]).encode() if "body" in item else b""
+    if isinstance(request._request, ASGIRequest):
+        sub = asgi_sub_request(request._request, item["method"], parts, body)
+    else:
+        sub = wsgi_sub_request(request._request, item["method"], parts, body)
+    # Authenticated once, by the batch (see rest_framework.request.Request)
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    sub.may_use_replica = may_use_replica
+    return sub
+
+
+def wsgi_sub_request(request, method, parts, body):
+    environ = {
+        name: value
+        for name, value in request.META.items()
+        if name not in SKIPPED_HEADERS
+    }
+    environ.update(
+        {
+            "REQUEST_METHOD": method,
+            # WSGI paths are latin-1 strings
+            "PATH_INFO": parts.path.encode().decode("iso-8859-1"),
+            "QUERY_STRING": parts.query,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "HTTP_ACCEPT": "application/json",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.url_scheme": request.scheme,
+        }
+    )
+    return WSGIRequest(environ)
+
+
+def asgi_sub_request(request, method, parts, body):
+    skipped = {
+        name.lower().removeprefix("http_").replace("_", "-").encode()
+        for name in SKIPPED_HEADERS
+    }
+    headers = [
+        (name, value)
+        for name, value in request.scope.get("headers", [])
+        if name.lower() not in skipped
+    ]
+    headers += [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"accept", b"application/json"),
+    ]
+    scope = {
+        **request.scope,
+        "method": method,
+        "path": request.scope.get("root_path", "") + parts.path,
+        "query_string": parts.query.encode(),
+        "headers": headers,
+    }
+    return ASGIRequest(scope, io.BytesIO(body))
+
+
+def call_view(request):
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        # Not Django's HTML page
+        return JsonResponse({"detail": "Not found."}, status=404)
+    request.resolver_match = match
+    token = None
+    if request.may_use_replica and reads_from_replicas(match.func):
+        token = use_replica.set(True)
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+    finally:
+        if token is not None:
+            use_replica.reset(token)
+
+
+# Unhandled exceptions become the usual error responses, and get logged
+handle = convert_exception_to_response(call_view)
+
+
+def handle_in_thread(sub):
+    # In a copy of the batch request's context (the query cache scope, the
+    # timings...), with its query timer and query log on this thread's
+    # connections. The request_started and request_finished of those
+    close_old_connections()
+    try:
+        with installed(query_wrappers.get()):
+            return handle(sub)
+    finally:
+        close_old_connections()
+
+
+def result(item, response):
+    if response.streaming:
+        content = b"".join(response.streaming_content)
+    else:
+        content = response.content
+    body = None
+    if content and response.get("Content-Type", "").startswith("application/json"):
+        body = json.loads(content)
+    elif content:
+        body = content.decode(response.charset, "replace")
+    return {"id": item.get("id"), "status": response.status_code, "body": body}
+
+
+def run_batch(request, items):
+    """
+    Runs the validated sub-requests of a batch, returns their results in order.
+    """
+    scope = {}
+    results = []
+    wrote = False
+    pinned = getattr(request, "pinned_to_primary", False)
+    token = request_cache.set(scope)
+    try:
+        start = 0
+        while start < len(items):
+            end = start
+            while end < len(items) and items[end]["method"] == "GET":
+                end += 1
+            if end == start:
+                sub = sub_request(request, items[start], False)
+                if getattr(request, "write_queue", False):
+                    response = queued(sub, handle)
+                else:
+                    response = handle(sub)
+                # Whatever was read before may have changed
+                scope.clear()
+                wrote = wrote or response.status_code < 400
+                results.append(result(items[start], response))
+                start += 1
+                continue
+
+            # A client reads its own writes from the primary
+            subs = [
+                sub_request(request, item, not (wrote or pinned))
+                for item in items[start:end]
+            ]
+            if len(subs) == 1:
+                responses = [handle(subs[0])]
+            else:
+                futures = [
+                    executor.submit(copy_context().run, handle_in_thread, sub)
+                    for sub in subs
+                ]
+                responses = [future.result() for future in futures]
+            results += [
+                result(item, response)
+                for item, response in zip(items[start:end], responses)
+            ]
+            start = end
+    finally:
+        request_cache.reset(token)
+
+    # Only pin the client to the primary (core.middleware) if something was
+    # written
+    request._request.has_writes = wrote
+    return results
@@ -1,10 +1,32 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import FilterSet, CharFilter, ChoiceFilter
+from core.db.lookups import IdIn
+from tags.index import tag_index
 from .models import Product
 
 class ProductFilter(FilterSet):
+    # ?tags=a,b,c returns products with all of the tags, add &tags_match=any for any of them
+    tags = CharFilter(method='filter_tags')
+    tags_match = ChoiceFilter(
+        choices=[('all', 'All'), ('any', 'Any')], method='filter_tags_match'
+    )
+
     class Meta:
         model = Product
         fields = {
             'collection_id': ['exact'],
             'unit_price': ['gt', 'lt']
         }
+
+    def filter_tags(self, queryset, name, value):
+        labels = [label.strip() for label in value.split(',') if label.strip()]
+        if not labels:
+            return queryset
+        match_all = self.form.cleaned_data.get('tags_match') != 'any'
+        # The ids come from the in-memory tag index and go to the database as a
+        # single parameter, however many products match
+        product_ids = tag_index.object_ids(Product, labels, match_all=match_all)
+        return queryset.filter(IdIn('pk', product_ids))
+
+    def filter_tags_match(self, queryset, name, value):
+        # Only read by filter_tags
+        return queryset
@@ -0,0 +1,34 @@
+import shutil
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-renders the most requested catalog responses to SNAPSHOTS['DIR'] "
+        "for store.middleware.SnapshotMiddleware (see store.snapshots)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete every snapshot first",
+        )
+
+    def handle(self, *args, **options):
+        if not snapshots.is_enabled():
+            raise CommandError("Snapshots are off, set SNAPSHOTS['DIR']")
+        if options["clear"]:
+            shutil.rmtree(snapshots.get_setting("DIR"), ignore_errors=True)
+
+        started = time.perf_counter()
+        built, count = snapshots.build_all()
+        self.stdout.write(
+            f"{built} snapshots ({count - built} skipped) in "
+            f"{time.perf_counter() - started:.1f}s, "
+            f"{'gzip and brotli' if snapshots.brotli else 'gzip'} variants"
+        )
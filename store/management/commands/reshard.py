@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Mod
+
+from store import sharding
+from store.models import Cart, CartItem, Customer, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the orders and carts of a bucket to another shard and updates the "
+        "shard map. Writes to the bucket must be stopped while it runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("bucket", type=int)
+        parser.add_argument("target", help="Database alias to move the bucket to")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError("Sharding is not enabled (SHARDING['SHARDS'] is empty)")
+        bucket, target = options["bucket"], options["target"]
+        if target not in sharding.all_shards():
+            raise CommandError(f"'{target}' is not one of {sharding.all_shards()}")
+        if not 0 <= bucket < sharding.shard_map.buckets:
+            raise CommandError(f"Buckets go from 0 to {sharding.shard_map.buckets - 1}")
+
+        source = sharding.shard_map.alias_for_bucket(bucket)
+        if source == target:
+            self.stdout.write(f"Bucket {bucket} is already on {target}")
+            return
+
+        customer_ids = list(
+            Customer.objects.annotate(bucket=Mod("id", sharding.shard_map.buckets))
+            .filter(bucket=bucket)
+            .values_list("id", flat=True)
+        )
+        cart_ids = [
+            cart_id
+            for cart_id in Cart.objects.using(source).values_list("id", flat=True)
+            if sharding.bucket_for_cart(cart_id) == bucket
+        ]
+        self.stdout.write(
+            f"Bucket {bucket}: {source} -> {target}, "
+            f"{len(customer_ids)} customers, {len(cart_ids)} carts"
+        )
+        if options["dry_run"]:
+            return
+
+        batch_size = options["batch_size"]
+        # 1. Copy everything to the target, orders keep their (globally unique) ids
+        for batch in self.batches(customer_ids, batch_size):
+            orders = list(Order.objects.using(source).filter(customer_id__in=batch))
+            items = list(
+                OrderItem.objects.using(source).filter(order__customer_id__in=batch)
+            )
+            with transaction.atomic(using=target):
+                Order.objects.using(target).bulk_create(orders, batch_size=batch_size)
+                OrderItem.objects.using(target).bulk_create(
+                    items, batch_size=batch_size
+                )
+
+        for batch in self.batches(cart_ids, batch_size):
+            carts = list(Cart.objects.using(source).filter(id__in=batch))
+            items = list(CartItem.objects.using(source).filter(cart_id__in=batch))
+            for item in items:
+                # Cart item ids are only unique per shard
+                item.id = None
+            with transaction.atomic(using=target):
+                Cart.objects.using(target).bulk_create(carts, batch_size=batch_size)
+                CartItem.objects.using(target).bulk_create(items, batch_size=batch_size)
+
+        # 2. From now on the bucket is read from and written to the target
+        sharding.shard_map.move_bucket(bucket, target)
+
+        # 3. Drop the old copies
+        for batch in self.batches(customer_ids, batch_size):
+            with transaction.atomic(using=source):
+                OrderItem.objects.using(source).filter(
+                    order__customer_id__in=batch
+                ).delete()
+                Order.objects.using(source).filter(customer_id__in=batch).delete()
+        for batch in self.batches(cart_ids, batch_size):
+            Cart.objects.using(source).filter(id__in=batch).delete()
+
+        self.stdout.write(self.style.SUCCESS(f"Moved bucket {bucket} to {target}"))
+
+    def batches(self, ids, size):
+        for start in range(0, len(ids), size):
+            yield ids[start : start + size]
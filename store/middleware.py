@@ -0,0 +1,135 @@
+import os
+
+from django.core.exceptions import DisallowedHost, MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import snapshots
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+class SnapshotMiddleware:
+    """
+    Serves the pre-rendered catalog responses of store.snapshots straight
+    from disk, compressed when the client accepts it, before any other
+    middleware or view work. Only anonymous GETs for SNAPSHOTS["HOST"] that
+    the view would answer with compact JSON get them, and only while their
+    snapshot is fresh (see store.snapshots), everything else goes on as
+    usual.
+
+    With SNAPSHOTS["SENDFILE"] = "X-Accel-Redirect" (nginx) the file is left to
+    the web server, at SNAPSHOTS["SENDFILE_URL"] + the file name. With
+    "X-Sendfile" (Apache, lighttpd) the header has the file's path.
+    """
+
+    def __init__(self, get_response):
+        if not snapshots.is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.host = snapshots.get_setting("HOST", "localhost")
+        self.scheme = snapshots.get_setting("SCHEME", "http")
+        self.sendfile = snapshots.get_setting("SENDFILE")
+        self.freshness = snapshots.Freshness(snapshots.get_setting("CHECK_INTERVAL", 1))
+
+    def __call__(self, request):
+        response = self.serve(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    def serve(self, request):
+        if (
+            request.method not in ("GET", "HEAD")
+            or not request.path_info.startswith(snapshots.PREFIXES)
+            # JWT clients may be staff, or have a bad token that must get a 401
+            or "HTTP_AUTHORIZATION" in request.META
+            or request.scheme != self.scheme
+        ):
+            return None
+        try:
+            if request.get_host() != self.host:
+                return None
+        except DisallowedHost:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if not self.renders_json(request, match):
+            return None
+
+        key = snapshots.snapshot_key(
+            request.path_info, request.META.get("QUERY_STRING", "")
+        )
+        if not self.freshness.check(key):
+            return None
+        path = snapshots.snapshot_path(key)
+        if not path.exists():
+            return None
+        encoding = None
+        accepted = accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        for candidate in snapshots.ENCODINGS:
+            if (
+                candidate in accepted
+                and snapshots.snapshot_path(key, candidate).exists()
+            ):
+                path, encoding = snapshots.snapshot_path(key, candidate), candidate
+                break
+
+        try:
+            response = self.file_response(path)
+        except FileNotFoundError:
+            # Deleted by a rebuild in the meantime
+            return None
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Vary"] = "Accept, Accept-Encoding, Authorization"
+        response["X-Snapshot"] = "hit"
+        # For the per-route metrics
+        request.resolver_match = match
+        return response
+
+    def renders_json(self, request, match):
+        # The view's own negotiation: the browsable API, msgpack and indented
+        # JSON are left to it
+        view = getattr(match.func, "cls", None)
+        if view is None:
+            return False
+        renderers = [renderer() for renderer in view.renderer_classes]
+        try:
+            renderer, media_type = view.content_negotiation_class().select_renderer(
+                Request(request), renderers
+            )
+        except NotAcceptable:
+            return False
+        return isinstance(renderer, JSONRenderer) and not renderer.get_indent(
+            media_type, {}
+        )
+
+    def file_response(self, path):
+        if self.sendfile == "X-Accel-Redirect":
+            response = HttpResponse(content_type="application/json")
+            response["X-Accel-Redirect"] = (
+                snapshots.get_setting("SENDFILE_URL", "/snapshots/") + path.name
+            )
+            return response
+        if self.sendfile == "X-Sendfile":
+            response = HttpResponse(content_type="application/json")
+            response["X-Sendfile"] = os.fspath(path)
+            return response
+        response = FileResponse(open(path, "rb"), content_type="application/json")
+        # FileResponse adds an inline filename, the hash means nothing to clients
+        del response["Content-Disposition"]
+        return response
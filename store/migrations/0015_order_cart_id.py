@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-19 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_shard_orders_and_carts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cart_id',
+            field=models.UUIDField(editable=False, null=True, unique=True),
+        ),
+    ]
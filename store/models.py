@@ -1,10 +1,11 @@
 from django.core.validators import MinValueValidator
 from django.conf import settings
-from django.contrib import admin
 from django.db import models
 
 from uuid import uuid4
 
+from core.querycache import CachedManager, QueryCacheManager
+
 
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
@@ -17,6 +18,9 @@ class Collection(models.Model):
         "Product", on_delete=models.SET_NULL, null=True, related_name="+", blank=True
     )
 
+    # Few rows, read on almost every catalog request
+    objects = QueryCacheManager()
+
     def __str__(self) -> str:
         return self.title
 
@@ -38,6 +42,8 @@ class Product(models.Model):
     )
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    objects = CachedManager()
+
     def __str__(self) -> str:
         return self.title
 
@@ -66,10 +72,13 @@ class Customer(models.Model):
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
 
-    @admin.display(ordering="user__first_name")
     def first_name(self):
         return self.user.first_name
 
+    # What @admin.display(ordering=...) does, without importing the admin into
+    # API-only workers
+    first_name.admin_order_field = "user__first_name"
+
     def last_name(self):
         return self.user.last_name
 
@@ -92,7 +101,15 @@ class Order(models.Model):
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING
     )
-    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    # Orders can live on another database than customers and products (see
+    # store.sharding), so these relations have no database-level constraint
+    customer = models.ForeignKey(
+        Customer, on_delete=models.PROTECT, db_constraint=False
+    )
+    # The cart the order was placed from, which may be on another shard and is
+    # deleted after the order commits. Placing the same cart again returns this
+    # order instead of a copy
+    cart_id = models.UUIDField(null=True, unique=True, editable=False)
 
     class Meta:
         permissions = [("cancel_order", "Can cancel order")]
@@ -101,7 +118,10 @@ class Order(models.Model):
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name="items")
     product = models.ForeignKey(
-        Product, on_delete=models.PROTECT, related_name="orderitems"
+        Product,
+        on_delete=models.PROTECT,
+        related_name="orderitems",
+        db_constraint=False,
     )
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -117,10 +137,12 @@ class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CachedManager()
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
 
     # Making cart and product unqiue
@@ -135,3 +157,9 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
+
+
+# Hands out order and order item ids that are unique across shards
+class ShardSequence(models.Model):
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
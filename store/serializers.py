@@ -1,15 +1,23 @@
 from decimal import Decimal
+from urllib.parse import urlsplit
 
-from django.db import transaction
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import Resolver404, resolve
 
 from rest_framework import serializers
 
+from core.expand import ExpandableSerializerMixin
+from core.metrics import MetricsSerializerMixin
+
 from .models import *
 
+from .sharding import allocate_ids, shard_for_cart, shard_for_customer
 from .signals import order_created
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Collection
         fields = ["id", "title", "products_count"]
@@ -45,7 +53,27 @@ class ProductSerializer(serializers.Serializer):  # type: ignore
 
 # As you can see above we had to redefine fields already in the models.py file. Thats bad programming so instead
 # we can use model serializers
-class ProductSerializer(serializers.ModelSerializer):
+class SimpleCollectionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Collection
+        fields = ["id", "title"]
+
+
+class PromotionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Promotion
+        fields = ["id", "description", "discount"]
+
+
+class ProductSerializer(
+    ExpandableSerializerMixin, MetricsSerializerMixin, serializers.ModelSerializer
+):
+    # ?expand=collection,promotions (see core.expand)
+    expandable_fields = {
+        "collection": (SimpleCollectionSerializer, {}),
+        "promotions": (PromotionSerializer, {"many": True}),
+    }
+
     class Meta:
         model = Product
         fields = [
@@ -57,15 +85,31 @@ class ProductSerializer(serializers.ModelSerializer):
             "unit_price",
             "price_with_tax",
             "collection",
+            "liked",
         ]
 
     price_with_tax = serializers.SerializerMethodField(method_name="calculate_tax")
 
+    # For logged in users only, whose responses aren't shared (see
+    # ProductViewSet.get_queryset)
+    liked = serializers.SerializerMethodField()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is None or not request.user.is_authenticated:
+            del fields["liked"]
+        return fields
+
     def calculate_tax(self, product: Product):
         return product.unit_price * Decimal(1.1)
 
+    def get_liked(self, product: Product):
+        # Not annotated on a product that was just created
+        return getattr(product, "liked", False)
+
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ["id", "date", "name", "description"]
@@ -81,7 +125,7 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         fields = ["id", "title", "unit_price"]
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
 
@@ -93,7 +137,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         return cart_item.quantity * cart_item.product.unit_price
 
 
-class CartSerizalizer(serializers.ModelSerializer):
+class CartSerizalizer(MetricsSerializerMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
@@ -103,17 +147,23 @@ class CartSerizalizer(serializers.ModelSerializer):
             [item.quantity * item.product.unit_price for item in cart.items.all()]
         )
 
+    def create(self, validated_data):
+        # The id decides which shard the cart goes to
+        cart = Cart(**validated_data)
+        cart.save(using=shard_for_cart(cart.id))
+        return cart
+
     class Meta:
         model = Cart
         fields = ["id", "items", "total_price"]
 
 
-class AddCartItemSerializer(serializers.ModelSerializer):
+class AddCartItemSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
     # Prevent getting a hard error from django if the product_id from the post request doesnt exist
     def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
+        if not Product.objects.filter(pk=value).cache().exists():
             raise serializers.ValidationError("No product with the given id was found")
         return value
 
@@ -127,17 +177,16 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         cart_id = self.context["cart_id"]
         product_id = self.validated_data["product_id"]
         quantity = self.validated_data["quantity"]
+        cart_items = CartItem.objects.using(shard_for_cart(cart_id))
         try:
             # Update existing item
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+            cart_item = cart_items.get(cart_id=cart_id, product_id=product_id)
             cart_item.quantity += quantity
             cart_item.save()
             self.instance = cart_item
         except CartItem.DoesNotExist:
             # Create a new item
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data
-            )
+            self.instance = cart_items.create(cart_id=cart_id, **self.validated_data)
         return self.instance
 
     class Meta:
@@ -145,13 +194,13 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ["id", "product_id", "quantity"]
 
 
-class UpdateCartItemSerializer(serializers.ModelSerializer):
+class UpdateCartItemSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ["quantity"]
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
 
     class Meta:
@@ -159,69 +208,146 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ["id", "user_id", "phone", "birth_date", "membership"]
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
+    expandable_fields = {"product": (ProductSerializer, {})}
+
     class Meta:
         model = OrderItem
         fields = ["id", "product", "unit_price", "quantity"]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(
+    ExpandableSerializerMixin, MetricsSerializerMixin, serializers.ModelSerializer
+):
     items = OrderItemSerializer(many=True)
 
+    # ?expand=customer,items.product (see core.expand)
+    expandable_fields = {"customer": (CustomerSerializer, {})}
+
     class Meta:
         model = Order
         fields = ["id", "customer", "placed_at", "payment_status", "items"]
 
 
-class UpdateOrderSerializer(serializers.ModelSerializer):
+class UpdateOrderSerializer(MetricsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ["payment_status"]
 
 
 class CreateOrderSerializer(
-    serializers.Serializer
+    MetricsSerializerMixin, serializers.Serializer
 ):  # Can't use model serializer cuz cart_id not part of the Order model
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        alias = shard_for_cart(cart_id)
+        if not Cart.objects.using(alias).filter(pk=cart_id).cache().exists():
             raise serializers.ValidationError("No cart with the given ID was found.")
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if CartItem.objects.using(alias).filter(cart_id=cart_id).count() == 0:
             raise serializers.ValidationError("The cart is empty")
         return cart_id
 
     def save(self, **kwargs):
-        with transaction.atomic():  # We use this because due to the multiple queries we wanna ensure that either all the queries
-            # or none of them run, therefore we use a transaction
-            cart_id = self.validated_data["cart_id"]
+        cart_id = self.validated_data["cart_id"]
+
+        # Create a customer if a customer profile not existing, and create an associated order
+        customer = Customer.objects.get(user_id=self.context["user_id"])
 
-            # Create a customer if a customer profile not existing, and create an associated order
-            customer = Customer.objects.get(user_id=self.context["user_id"])
-            order = Order.objects.create(customer=customer)
+        # The cart and the order can be on different shards (see store.sharding), which no
+        # transaction spans. The order is committed first, with the id of its cart, and the
+        # cart deleted afterwards: if that fails the cart is still there and placing it again
+        # returns the same order and deletes it. On a single database it's all one
+        # transaction like before
+        cart_db = shard_for_cart(cart_id)
+        order_db = shard_for_customer(customer.id)
+
+        try:
+            order, created = self.place_order(customer, cart_id, cart_db, order_db)
+        except IntegrityError:
+            # The same cart placed twice at once, the other request won
+            order = Order.objects.using(order_db).filter(cart_id=cart_id, customer=customer).first()
+            if order is None:
+                raise serializers.ValidationError({"cart_id": "This cart was already ordered."})
+            created = False
+
+        if cart_db != order_db or not created:
+            # Deleting a cart that's gone already does nothing
+            Cart.objects.using(cart_db).filter(pk=cart_id).delete()
+
+        if created:
+            order_created.send_robust(self.__class__, order=order)
+        return order
 
-            # Add all the cart items as order items
-            cart_items = CartItem.objects.select_related("product").filter(
-                cart_id=cart_id
+    def place_order(self, customer, cart_id, cart_db, order_db):
+        with transaction.atomic(using=order_db):  # We use this because due to the multiple queries we wanna ensure that either all the queries
+            # or none of them run, therefore we use a transaction
+            order = Order.objects.using(order_db).filter(cart_id=cart_id, customer=customer).first()
+            if order is not None:
+                return order, False
+
+            order = Order(id=allocate_ids(Order, 1)[0], customer=customer, cart_id=cart_id)
+            order.save(using=order_db)
+
+            # Add all the cart items as order items. Products are on the default
+            # database so they are prefetched instead of joined
+            cart_items = (
+                CartItem.objects.using(cart_db)
+                .prefetch_related("product")
+                .filter(cart_id=cart_id)
             )
 
             order_items = [
                 OrderItem(
+                    id=id,
                     order=order,
                     product=item.product,
                     unit_price=item.product.unit_price,
                     quantity=item.quantity,
                 )
-                for item in cart_items
+                for id, item in zip(
+                    allocate_ids(OrderItem, len(cart_items)), cart_items
+                )
             ]
 
-            OrderItem.objects.bulk_create(order_items)
+            OrderItem.objects.using(order_db).bulk_create(order_items)
 
-            # Delete the cart once we are done
-            Cart.objects.filter(pk=cart_id).delete()
+            if cart_db == order_db:
+                # Delete the cart once we are done
+                Cart.objects.using(cart_db).filter(pk=cart_id).delete()
+
+        return order, True
 
-            order_created.send_robust(self.__class__, order=order)
 
-            return order
+class BatchRequestSerializer(serializers.Serializer):
+    id = serializers.CharField(max_length=100, required=False)
+    method = serializers.ChoiceField(
+        choices=["GET", "POST", "PUT", "PATCH", "DELETE"], default="GET"
+    )
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+
+    # Only the synchronous store API, and no batches in batches
+    def validate_path(self, path):
+        if not path.startswith("/store/"):
+            raise serializers.ValidationError("Only /store/ paths can be batched")
+        try:
+            match = resolve(urlsplit(path).path)
+        except Resolver404:
+            # A 404 in the responses
+            return path
+        if match.url_name == "batch" or iscoroutinefunction(match.func):
+            raise serializers.ValidationError("This path can't be batched")
+        return path
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, requests):
+        limit = getattr(settings, "BATCH", {}).get("MAX_REQUESTS", 20)
+        if len(requests) > limit:
+            raise serializers.ValidationError(f"At most {limit} requests per batch")
+        return requests
@@ -0,0 +1,227 @@
+"""
+Horizontal sharding of orders and carts.
+
+Order/OrderItem rows live on the shard of their customer and Cart/CartItem rows
+on the shard of the cart id. Keys are hashed into a fixed number of buckets and
+every bucket belongs to one of the SHARDING["SHARDS"] databases, by default
+round robin. `manage.py reshard` moves a bucket to another shard and records
+it in SHARDING["MAP_FILE"].
+
+Order and order item ids come from ShardSequence on the default database so
+they stay unique across shards, and a row keeps its id when it's moved.
+With no SHARDS configured everything resolves to "default".
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import UUID
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.models import Max
+
+SHARDED_MODELS = {"order", "orderitem", "cart", "cartitem"}
+
+current_shard = ContextVar("current_shard", default=None)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "SHARDING", {}).get(name, default)
+
+
+def is_enabled():
+    return bool(get_setting("SHARDS"))
+
+
+def all_shards():
+    return get_setting("SHARDS") or ["default"]
+
+
+def is_sharded(model):
+    return model._meta.app_label == "store" and model._meta.model_name in SHARDED_MODELS
+
+
+class ShardMap:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._overrides = {}
+        self._mtime = None
+        self._checked_at = 0
+
+    @property
+    def buckets(self):
+        return get_setting("BUCKETS", 64)
+
+    def _reload(self):
+        # Other workers learn about a reshard through the map file's mtime
+        path = get_setting("MAP_FILE")
+        now = time.monotonic()
+        if path is None or now - self._checked_at < 1:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            self._overrides, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(path) as file:
+                self._overrides = {
+                    int(bucket): alias for bucket, alias in json.load(file).items()
+                }
+            self._mtime = mtime
+
+    def alias_for_bucket(self, bucket):
+        shards = all_shards()
+        with self._lock:
+            self._reload()
+            return self._overrides.get(bucket, shards[bucket % len(shards)])
+
+    def move_bucket(self, bucket, alias):
+        path = get_setting("MAP_FILE")
+        with self._lock:
+            self._checked_at = 0
+            self._reload()
+            overrides = {**self._overrides, bucket: alias}
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(
+                    {str(b): a for b, a in sorted(overrides.items())}, file, indent=2
+                )
+            os.replace(temp_path, path)
+            self._overrides = overrides
+            self._mtime = os.stat(path).st_mtime
+
+
+shard_map = ShardMap()
+
+
+def bucket_for_customer(customer_id):
+    return int(customer_id) % shard_map.buckets
+
+
+def bucket_for_cart(cart_id):
+    return zlib.crc32(UUID(str(cart_id)).bytes) % shard_map.buckets
+
+
+def shard_for_customer(customer_id):
+    if not is_enabled():
+        return "default"
+    return shard_map.alias_for_bucket(bucket_for_customer(customer_id))
+
+
+def shard_for_cart(cart_id):
+    if not is_enabled():
+        return "default"
+    try:
+        return shard_map.alias_for_bucket(bucket_for_cart(cart_id))
+    except ValueError:
+        # Not a valid cart id, the lookup will find nothing anyway
+        return all_shards()[0]
+
+
+def shard_for_instance(instance):
+    """
+    Picks the shard for a sharded instance that hasn't been saved yet, or for the
+    sharded rows related to a customer.
+    """
+    from .models import Cart, CartItem, Customer, Order, OrderItem
+
+    if isinstance(instance, Order):
+        return shard_for_customer(instance.customer_id)
+    if isinstance(instance, Customer):
+        return shard_for_customer(instance.pk)
+    if isinstance(instance, Cart):
+        return shard_for_cart(instance.pk)
+    if isinstance(instance, CartItem):
+        return shard_for_cart(instance.cart_id)
+    if isinstance(instance, OrderItem) and OrderItem.order.is_cached(instance):
+        return instance.order._state.db
+    return None
+
+
+@contextmanager
+def use_shard(alias):
+    token = current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        current_shard.reset(token)
+
+
+def scatter(function):
+    """
+    Calls function(alias) for every shard, in parallel when there's more than
+    one, and returns the results in shard order.
+    """
+    shards = all_shards()
+    if len(shards) == 1:
+        return [function(shards[0])]
+
+    def run(alias):
+        try:
+            return function(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(len(shards)) as executor:
+        return list(executor.map(run, shards))
+
+
+def locate(model, pk):
+    # Finds the shard holding a row when all we have is its id
+    if not is_enabled():
+        return "default"
+    try:
+        pk = model._meta.pk.to_python(pk)
+    except ValidationError:
+        return None
+    for alias, found in zip(
+        all_shards(),
+        scatter(lambda alias: model.objects.using(alias).filter(pk=pk).exists()),
+    ):
+        if found:
+            return alias
+    return None
+
+
+def allocate_ids(model, count):
+    """
+    Reserves `count` ids for new rows of a sharded model. Without sharding the
+    database assigns them as usual, so this returns Nones.
+    """
+    from .models import ShardSequence
+
+    if not is_enabled() or not count:
+        return [None] * count
+
+    name = model._meta.label_lower
+    with transaction.atomic(using="default"):
+        sequence = (
+            ShardSequence.objects.using("default")
+            .select_for_update()
+            .filter(name=name)
+            .first()
+        )
+        if sequence is None:
+            # Start after the rows that were there before the sequence existed
+            highest = scatter(
+                lambda alias: model.objects.using(alias).aggregate(Max("id"))["id__max"]
+            )
+            sequence = ShardSequence(
+                name=name, value=max(filter(None, highest), default=0)
+            )
+            sequence._state.adding = True
+        first = sequence.value + 1
+        sequence.value += count
+        # A worker racing us to create the sequence fails here instead of
+        # handing out the same ids
+        sequence.save(using="default", force_insert=sequence._state.adding)
+    return list(range(first, first + count))
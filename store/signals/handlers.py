@@ -1,11 +1,42 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from store.models import Customer
+from store import sharding
+from store.autocomplete import autocomplete
+from store.models import CartItem, Collection, Customer, Product
 
 
 # Signal Handlers
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
-        Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+        Customer.objects.create(user=kwargs['instance'])
+
+
+# Cart items have no database constraint to their product, and on a sharded setup
+# the cascade only reaches the default database, so clean up every shard
+@receiver(post_delete, sender=Product)
+def delete_cart_items_of_product(sender, **kwargs):
+    if sharding.is_enabled():
+        product_id = kwargs['instance'].id
+        sharding.scatter(
+            lambda alias: CartItem.objects.using(alias).filter(product_id=product_id).delete()
+        )
+
+
+# Autocomplete sources, kept up to date through post_save/post_delete
+autocomplete.register("products", Product, get_label=lambda product: product.title)
+autocomplete.register(
+    "collections", Collection, get_label=lambda collection: collection.title
+)
+autocomplete.register(
+    "customers",
+    Customer,
+    get_queryset=lambda: Customer.objects.select_related("user"),
+    staff_only=True,
+    related={
+        settings.AUTH_USER_MODEL: lambda user: Customer.objects.select_related(
+            "user"
+        ).filter(user=user)
+    },
+)
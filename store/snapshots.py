@@ -0,0 +1,398 @@
+"""
+Pre-rendered catalog snapshots.
+
+`manage.py build_snapshots` renders the catalog responses most traffic asks
+for: the collection index and every collection, the first SNAPSHOTS["PAGES"]
+pages of the product list and of each collection's products, and the
+SNAPSHOTS["TOP_PRODUCTS"] most ordered products. Each one is written to
+SNAPSHOTS["DIR"] as JSON, with a gzip variant and a brotli one when the brotli
+package is installed. store.middleware.SnapshotMiddleware serves them before
+any view runs.
+
+SNAPSHOTS["DIR"]/sources.json records what every snapshot shows: a digest of
+each product and collection row and of the lists they are in, and which of
+those each snapshot depends on. SNAPSHOTS["DIR"]/versions.json has the versions
+(core.querycache) of the product and collection tables the snapshots were last
+checked against, and the keys of the snapshots found stale then.
+
+The middleware compares those versions with the current ones every
+SNAPSHOTS["CHECK_INTERVAL"] seconds. Once a write changed them, whichever way it
+was made (save(), queryset.update(), raw SQL), one worker compares the rows
+with the recorded digests in a background thread and renders again only the
+snapshots showing a row that changed. Until it has found which ones those are
+no snapshot is served, while it renders them the others are.
+
+Pagination links are absolute, so snapshots are rendered for SNAPSHOTS["HOST"]
+and SNAPSHOTS["SCHEME"] and only served to requests for them.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+from django.urls import resolve
+
+from core.querycache import get_cache, table_versions
+
+from .models import Collection, OrderItem, Product
+from .pagination import DefaultPagination
+from .sharding import scatter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding: file suffix, best first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+PREFIXES = ("/store/products/", "/store/collections/")
+
+MANIFEST = "versions.json"
+SOURCES = "sources.json"
+
+REBUILD_LOCK = "snapshots:rebuilding"
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "SNAPSHOTS", {}).get(name, default)
+
+
+def is_enabled():
+    return bool(get_setting("DIR"))
+
+
+def snapshot_key(path, query_string=""):
+    # The query string as sent, the links in the snapshots are built the same way
+    return f"{path}?{query_string}" if query_string else path
+
+
+def snapshot_path(key, encoding=None):
+    name = hashlib.sha1(key.encode()).hexdigest() + ".json"
+    return Path(get_setting("DIR")) / (name + ENCODINGS.get(encoding, ""))
+
+
+def pages(count):
+    last = min(get_setting("PAGES", 3), math.ceil(count / DefaultPagination.page_size))
+    return range(1, last + 1)
+
+
+def list_keys(product_count, collection_id=None):
+    query = f"collection_id={collection_id}" if collection_id is not None else ""
+    keys = []
+    for page in pages(product_count):
+        # Page 1 without ?page=, like the previous link of page 2
+        page_query = "&".join(filter(None, [query, f"page={page}" if page > 1 else ""]))
+        keys.append(snapshot_key("/store/products/", page_query))
+    return keys
+
+
+def top_product_ids(count):
+    # The top of every shard, close enough when there are several
+    def top(alias):
+        return list(
+            OrderItem.objects.using(alias)
+            .values("product_id")
+            .annotate(quantity=Sum("quantity"))
+            .order_by("-quantity")[:count]
+        )
+
+    totals = Counter()
+    for rows in scatter(top):
+        for row in rows:
+            totals[row["product_id"]] += row["quantity"]
+    return [product_id for product_id, _ in totals.most_common(count)]
+
+
+def catalog_keys():
+    keys = [snapshot_key("/store/collections/")]
+    keys += list_keys(Product.objects.count())
+    collection_counts = Counter(
+        Product.objects.values_list("collection_id", flat=True).order_by()
+    )
+    for collection_id in Collection.objects.values_list("id", flat=True):
+        keys.append(snapshot_key(f"/store/collections/{collection_id}/"))
+        keys += list_keys(collection_counts[collection_id], collection_id)
+    for product_id in top_product_ids(get_setting("TOP_PRODUCTS", 200)):
+        keys.append(snapshot_key(f"/store/products/{product_id}/"))
+    return keys
+
+
+def render(key):
+    """
+    Runs the view of a snapshot key the way an anonymous JSON client would
+    call it, returns the content or None if it isn't a 200.
+    """
+    # Not imported up front, django.test is heavy for the workers
+    from django.test import RequestFactory
+
+    path = key.split("?", 1)[0]
+    request = RequestFactory().get(
+        key,
+        HTTP_HOST=get_setting("HOST", "localhost"),
+        HTTP_ACCEPT="application/json",
+        secure=get_setting("SCHEME", "http") == "https",
+    )
+    match = resolve(path)
+    request.resolver_match = match
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    if response.status_code != 200:
+        return None
+    return response.content
+
+
+def write_file(path, content):
+    # Written next to the target and renamed, readers never see half a file
+    fd, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+def write(key, content):
+    os.makedirs(get_setting("DIR"), exist_ok=True)
+    # The variants first, the plain file is what the middleware looks for
+    write_file(snapshot_path(key, "gzip"), gzip.compress(content, 9, mtime=0))
+    if brotli is not None:
+        write_file(snapshot_path(key, "br"), brotli.compress(content))
+    write_file(snapshot_path(key), content)
+
+
+def delete(key):
+    for encoding in [None, *ENCODINGS]:
+        try:
+            os.remove(snapshot_path(key, encoding))
+        except FileNotFoundError:
+            pass
+
+
+def exists(key):
+    return snapshot_path(key).exists()
+
+
+def dependencies(key, content):
+    """
+    Names the rows a snapshot shows (see fingerprints()): the products and
+    collections in it, and the list they were picked from.
+    """
+    path, _, query = key.partition("?")
+    data = json.loads(content)
+    if path == "/store/collections/":
+        return [
+            "collections",
+            *(f"collection:{collection['id']}" for collection in data),
+            *(f"products:{collection['id']}" for collection in data),
+        ]
+    if path.startswith("/store/collections/"):
+        return [f"collection:{data['id']}", f"products:{data['id']}"]
+    if path == "/store/products/":
+        collection_id = parse_qs(query).get("collection_id", [None])[0]
+        members = f"products:{collection_id}" if collection_id else "products"
+        return [members, *(f"product:{product['id']}" for product in data["results"])]
+    return [f"product:{data['id']}"]
+
+
+def digest(values):
+    return hashlib.sha1(repr(values).encode()).hexdigest()[:16]
+
+
+def fingerprints():
+    """
+    A digest of every product and collection row, and of the ids in the
+    product list, in each collection and in the collection index.
+    """
+    rows = {}
+    members = {}
+    fields = [field.attname for field in Product._meta.concrete_fields]
+    collection = fields.index("collection_id")
+    for values in Product.objects.order_by("pk").values_list(*fields).iterator():
+        rows[f"product:{values[0]}"] = digest(values)
+        members.setdefault(f"products:{values[collection]}", []).append(values[0])
+    members["products"] = [name.partition(":")[2] for name in rows]
+
+    fields = [field.attname for field in Collection._meta.concrete_fields]
+    for values in Collection.objects.order_by("pk").values_list(*fields).iterator():
+        rows[f"collection:{values[0]}"] = digest(values)
+    members["collections"] = [
+        name.partition(":")[2] for name in rows if name.startswith("collection:")
+    ]
+
+    rows.update((name, digest(ids)) for name, ids in members.items())
+    return rows
+
+
+def build(keys):
+    """
+    Renders the snapshots of `keys`, returns the dependencies of those built.
+    """
+    built = {}
+    for key in keys:
+        content = render(key)
+        if content is None:
+            delete(key)
+        else:
+            write(key, content)
+            built[key] = dependencies(key, content)
+    return built
+
+
+def prune(keys):
+    # Products and collections deleted since, and what a failed render left
+    names = {
+        snapshot_path(key, encoding).name
+        for key in keys
+        for encoding in [None, *ENCODINGS]
+    }
+    for path in Path(get_setting("DIR")).glob("*.json*"):
+        if path.name not in names and path.name not in (MANIFEST, SOURCES):
+            path.unlink(missing_ok=True)
+
+
+# Freshness
+
+
+def tables():
+    # What the snapshots show, the order items only rank the top products
+    return [Product._meta.db_table, Collection._meta.db_table]
+
+
+def read_json(name):
+    try:
+        return json.loads((Path(get_setting("DIR")) / name).read_bytes())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_json(name, data):
+    os.makedirs(get_setting("DIR"), exist_ok=True)
+    write_file(Path(get_setting("DIR")) / name, json.dumps(data).encode())
+
+
+def built_state():
+    """
+    The table versions the snapshots were last checked against and the keys
+    of those found stale then, which are being rendered again.
+    """
+    return read_json(MANIFEST)
+
+
+def build_all():
+    """
+    Renders every catalog snapshot, deletes the others and records what they
+    show. Returns how many were built out of how many keys.
+    """
+    # Before rendering, a write made meanwhile leaves them stale
+    versions = table_versions(tables())
+    rows = fingerprints()
+    keys = catalog_keys()
+    os.makedirs(get_setting("DIR"), exist_ok=True)
+    built = build(keys)
+    prune(keys)
+    write_json(SOURCES, {"rows": rows, "dependencies": built})
+    write_json(MANIFEST, {"versions": versions, "stale": []})
+    return len(built), len(keys)
+
+
+def refresh():
+    """
+    Renders again only the snapshots showing a row that changed since they
+    were rendered, and those of new catalog keys. The middleware goes on
+    serving the others meanwhile. Returns how many were rendered.
+    """
+    sources = read_json(SOURCES)
+    state = built_state()
+    if sources is None or state is None:
+        return build_all()[1]
+
+    versions = table_versions(tables())
+    rows = fingerprints()
+    keys = catalog_keys()
+    old_rows, old_dependencies = sources["rows"], sources["dependencies"]
+    changed = {
+        name
+        for name in rows.keys() | old_rows.keys()
+        if rows.get(name) != old_rows.get(name)
+    }
+    stale = set(state["stale"]) | {
+        key
+        for key in keys
+        if key not in old_dependencies or not changed.isdisjoint(old_dependencies[key])
+    }
+    removed = old_dependencies.keys() - set(keys)
+    write_json(MANIFEST, {"versions": versions, "stale": sorted(stale | removed)})
+
+    for key in removed:
+        delete(key)
+    dependencies = {
+        key: names
+        for key, names in old_dependencies.items()
+        if key not in stale and key not in removed
+    }
+    dependencies.update(build(key for key in keys if key in stale))
+    write_json(SOURCES, {"rows": rows, "dependencies": dependencies})
+    write_json(MANIFEST, {"versions": versions, "stale": []})
+    return len(stale)
+
+
+# One thread, a worker renders the snapshots once at a time
+rebuilder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshots")
+
+
+def rebuild_in_background():
+    try:
+        refresh()
+    except Exception:
+        logger.exception("Rebuilding the snapshots failed")
+    finally:
+        get_cache().delete(REBUILD_LOCK)
+        connections.close_all()
+
+
+def rebuild():
+    # By one worker, the others send requests to the views meanwhile
+    if get_cache().add(REBUILD_LOCK, 1, get_setting("REBUILD_TIMEOUT", 600)):
+        rebuilder.submit(rebuild_in_background)
+
+
+class Freshness:
+    """
+    Tells whether a snapshot on disk shows the current tables, looking at
+    most every `interval` seconds, and has the stale ones rebuilt.
+    """
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.stale = None  # keys not to serve, None for all of them
+        self.checked_at = float("-inf")
+
+    def check(self, key):
+        now = time.monotonic()
+        if now - self.checked_at >= self.interval:
+            self.checked_at = now
+            state = built_state()
+            if state is None or state["versions"] != table_versions(tables()):
+                # Until a refresh has found which ones the writes touched
+                self.stale = None
+                rebuild()
+            else:
+                self.stale = set(state["stale"])
+                if self.stale:
+                    # Unless it's rendering them already
+                    rebuild()
+        return self.stale is not None and key not in self.stale
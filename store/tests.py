@@ -1,3 +1,703 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+from uuid import UUID, uuid4
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from rest_framework.test import APIClient
+
+from core import middleware
+from core.middleware import ReplicaRoutingMiddleware
+from core.querycache import get_cache
+
+from . import admin as store_admin
+from . import batch, sharding, snapshots
+from .autocomplete import PrefixIndex, autocomplete
+from .middleware import SnapshotMiddleware
+from .models import Cart, CartItem, Collection, Customer, Order, Product
+from .sharding import ShardMap
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.load(
+            [
+                (1, "Red Shoes"),
+                (2, "red hat"),
+                (3, "Blue Shoes"),
+                (4, "Shoe horn"),
+                (5, "Redwood"),
+            ]
+        )
+
+    def test_every_word_has_to_match_a_prefix(self):
+        self.assertEqual(self.index.search("sho"), [3, 1, 4])
+        self.assertEqual(self.index.search("red sh"), [1])
+        self.assertEqual(self.index.search("green"), [])
+        self.assertEqual(self.index.search("  "), [])
+
+    def test_limit_keeps_the_first_in_label_order(self):
+        self.assertEqual(self.index.search("red", 2), [2, 1])
+        self.assertEqual(self.index.search("red", 10), [2, 1, 5])
+        for limit in (0, -1):
+            with self.assertRaises(ValueError):
+                self.index.search("red", limit)
+
+    def test_changes(self):
+        self.index.set(2, "Green hat")
+        self.index.remove(5)
+        self.assertEqual(self.index.search("red"), [1])
+        self.assertEqual(self.index.search("gr"), [2])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        for source in autocomplete.sources.values():
+            source._index = None
+        self.collection = Collection.objects.create(title="Shoes")
+        self.products = [
+            self.product(title) for title in ["Red Shoes", "red hat", "Blue Shoes"]
+        ]
+        self.client = APIClient()
+
+    def product(self, title, **kwargs):
+        return Product.objects.create(
+            title=title,
+            slug="slug",
+            unit_price=1,
+            inventory=1,
+            collection=self.collection,
+            **kwargs,
+        )
+
+    def suggest(self, query):
+        return self.client.get(f"/store/autocomplete/?type=products&{query}")
+
+    def test_suggestions(self):
+        response = self.suggest("q=sh")
+        self.assertEqual(
+            [item["label"] for item in response.json()["products"]],
+            ["Blue Shoes", "Red Shoes"],
+        )
+        response = self.suggest("q=sh&limit=1")
+        self.assertEqual(len(response.json()["products"]), 1)
+
+    def test_bad_limits(self):
+        for limit in ["0", "-1", "many"]:
+            self.assertEqual(self.suggest(f"q=sh&limit={limit}").status_code, 400)
+
+    def test_committed_changes_show_up(self):
+        self.suggest("q=sh")
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.product("Green Shoes")
+        self.assertEqual(len(self.suggest("q=sh").json()["products"]), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(len(self.suggest("q=sh").json()["products"]), 2)
+
+    def test_writes_without_signals_show_up_after_a_check(self):
+        source = autocomplete.sources["products"]
+        self.suggest("q=sh")
+        source.watch.interval = 0
+        self.addCleanup(setattr, source.watch, "interval", 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_create(
+                [
+                    Product(
+                        title="Green Shoes",
+                        slug="slug",
+                        unit_price=1,
+                        inventory=1,
+                        collection=self.collection,
+                    )
+                ]
+            )
+        self.assertEqual(len(self.suggest("q=sh").json()["products"]), 3)
+
+    def admin_search(self, term):
+        model_admin = store_admin.ProductAdmin(Product, admin.site)
+        request = RequestFactory().get("/admin/store/product/")
+        queryset, _ = model_admin.get_search_results(
+            request, Product.objects.all(), term
+        )
+        return sorted(queryset.values_list("title", flat=True))
+
+    def test_admin_search(self):
+        self.assertEqual(self.admin_search("sh"), ["Blue Shoes", "Red Shoes"])
+
+    @override_settings(AUTOCOMPLETE={"MAX_ADMIN_IDS": 1})
+    def test_big_admin_searches_go_to_the_database(self):
+        self.assertEqual(self.admin_search("shoes"), ["Blue Shoes", "Red Shoes"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(
+            SNAPSHOTS={"DIR": directory, "HOST": "testserver", "CHECK_INTERVAL": 0}
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_cache().clear()
+        submit = mock.patch.object(snapshots.rebuilder, "submit")
+        self.submit = submit.start()
+        self.addCleanup(submit.stop)
+
+        self.collection = Collection.objects.create(title="Shoes")
+        for title in ["Red Shoes", "Blue Shoes"]:
+            Product.objects.create(
+                title=title,
+                slug="slug",
+                unit_price=1,
+                inventory=5,
+                collection=self.collection,
+            )
+        snapshots.build_all()
+        self.middleware = SnapshotMiddleware(lambda request: HttpResponse("view"))
+
+    def get(self, path, **headers):
+        return self.middleware(RequestFactory().get(path, **headers))
+
+    def snapshot(self, path, **headers):
+        response = self.get(path, **headers)
+        self.assertEqual(response.get("X-Snapshot"), "hit")
+        content = b"".join(response.streaming_content)
+        if response.get("Content-Encoding") == "gzip":
+            content = gzip.decompress(content)
+        return json.loads(content)
+
+    def assertNotServed(self, path, **headers):
+        self.assertEqual(self.get(path, **headers).content, b"view")
+
+    def test_json_clients_get_snapshots(self):
+        for accept in [None, "*/*", "application/json"]:
+            headers = {"HTTP_ACCEPT": accept} if accept else {}
+            data = self.snapshot("/store/collections/", **headers)
+            self.assertEqual(data[-1]["title"], "Shoes")
+        data = self.snapshot("/store/products/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(data["count"], Product.objects.count())
+
+    def test_other_representations_go_to_the_view(self):
+        for accept in [
+            "text/html",
+            "application/json; indent=4",
+            "application/msgpack",
+        ]:
+            self.assertNotServed("/store/collections/", HTTP_ACCEPT=accept)
+        self.assertNotServed("/store/collections/", HTTP_AUTHORIZATION="JWT x")
+        self.assertNotServed("/store/collections/?format=api")
+
+    def test_writes_without_signals_stop_snapshots_until_rebuilt(self):
+        self.snapshot("/store/products/")
+        model_admin = store_admin.ProductAdmin(Product, admin.site)
+        with mock.patch.object(model_admin, "message_user"):
+            with self.captureOnCommitCallbacks(execute=True):
+                model_admin.clear_inventory(None, Product.objects.all())
+        self.assertNotServed("/store/products/")
+        # By this worker only
+        other = SnapshotMiddleware(lambda request: HttpResponse("view"))
+        self.assertEqual(
+            other(RequestFactory().get("/store/products/")).content, b"view"
+        )
+        self.submit.assert_called_once_with(snapshots.rebuild_in_background)
+
+        snapshots.rebuild_in_background()
+        data = self.snapshot("/store/products/")
+        self.assertEqual({product["inventory"] for product in data["results"]}, {0})
+
+    def test_only_snapshots_of_changed_rows_are_rendered_again(self):
+        product = Product.objects.get(title="Red Shoes")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=product.pk).update(title="Green Shoes")
+        self.assertNotServed("/store/collections/")
+        self.submit.assert_called_once_with(snapshots.rebuild_in_background)
+
+        rendered = []
+        render = snapshots.render
+
+        def render_and_serve(key):
+            rendered.append(key)
+            # The ones still valid are served meanwhile
+            self.snapshot("/store/collections/")
+            self.snapshot(f"/store/collections/{self.collection.id}/")
+            self.assertNotServed("/store/products/")
+            return render(key)
+
+        with mock.patch.object(snapshots, "render", render_and_serve):
+            snapshots.rebuild_in_background()
+        self.assertEqual(
+            set(rendered),
+            {
+                "/store/products/",
+                f"/store/products/?collection_id={self.collection.id}",
+            },
+        )
+        data = self.snapshot("/store/products/")
+        self.assertIn("Green Shoes", [product["title"] for product in data["results"]])
+
+    def test_rebuilds_drop_snapshots_of_deleted_objects(self):
+        key = snapshots.snapshot_key(f"/store/collections/{self.collection.id}/")
+        self.assertTrue(snapshots.exists(key))
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.all().delete()
+            self.collection.delete()
+        snapshots.refresh()
+        self.assertFalse(snapshots.exists(key))
+        self.assertNotServed(key)
+        self.assertNotIn(
+            self.collection.id,
+            [collection["id"] for collection in self.snapshot("/store/collections/")],
+        )
+
+    def test_rebuilds_add_snapshots_of_new_objects(self):
+        collection = Collection.objects.create(title="Hats")
+        self.assertEqual(
+            snapshots.refresh(),
+            # The index and the new collection, its products list is empty
+            2,
+        )
+        data = self.snapshot(f"/store/collections/{collection.id}/")
+        self.assertEqual(data["title"], "Hats")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.collection = Collection.objects.create(title="Shoes")
+        self.products = [
+            Product.objects.create(
+                title=f"Shoes {i}",
+                slug="slug",
+                unit_price=1,
+                inventory=5,
+                collection=self.collection,
+            )
+            for i in range(12)
+        ]
+
+    async def assertSameResponse(self, path, status=200):
+        response = await self.async_client.get("/store/async/" + path)
+        expected = await sync_to_async(self.client.get)(
+            "/store/" + path, HTTP_ACCEPT="application/json"
+        )
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(expected.status_code, status)
+        # Page links point back at the async endpoints
+        content = response.content.decode().replace("/store/async/", "/store/")
+        self.assertEqual(json.loads(content), expected.json())
+
+    async def test_same_responses_as_the_viewsets(self):
+        for path in [
+            "products/",
+            "products/?page=2",
+            "products/?page=last",
+            f"products/{self.products[0].id}/",
+            "collections/",
+            f"collections/{self.collection.id}/",
+        ]:
+            with self.subTest(path=path):
+                await self.assertSameResponse(path)
+
+    async def test_missing_objects_and_pages(self):
+        for path in ["products/?page=3", "products/?page=x", "products/0/"]:
+            with self.subTest(path=path):
+                await self.assertSameResponse(path, status=404)
+
+    async def test_the_renderer_is_negotiated(self):
+        path = f"collections/{self.collection.id}/"
+        for query, accept in [
+            ("", "application/json; indent=4"),
+            ("?format=api", "*/*"),
+            ("", "text/csv"),
+        ]:
+            with self.subTest(query=query, accept=accept):
+                headers = {"Accept": accept}
+                response = await self.async_client.get(
+                    "/store/async/" + path + query, headers=headers
+                )
+                expected = await sync_to_async(self.client.get)(
+                    "/store/" + path + query, headers=headers
+                )
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response["Content-Type"], expected["Content-Type"])
+                if not query:
+                    self.assertEqual(response.content, expected.content)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="staff", email="staff@example.com", password="x", is_staff=True
+        )
+        self.collection = Collection.objects.create(title="Shoes")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *requests, status=200):
+        response = self.client.post(
+            "/store/batch/", {"requests": list(requests)}, format="json"
+        )
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_responses_come_back_in_order(self):
+        responses = self.batch(
+            {"id": "one", "path": f"/store/collections/{self.collection.id}/"},
+            {"id": "two", "path": "/store/collections/"},
+            {"id": "three", "path": "/store/nothing/here/"},
+            {"id": "four", "path": "/store/collections/0/"},
+        )["responses"]
+        self.assertEqual(
+            [(item["id"], item["status"]) for item in responses],
+            [("one", 200), ("two", 200), ("three", 404), ("four", 404)],
+        )
+        self.assertEqual(responses[0]["body"]["title"], "Shoes")
+        self.assertEqual(responses[2]["body"], {"detail": "Not found."})
+
+    def test_reads_after_a_write_see_it(self):
+        responses = self.batch(
+            {"path": "/store/collections/"},
+            {
+                "method": "POST",
+                "path": "/store/collections/",
+                "body": {"title": "Hats"},
+            },
+            {"path": "/store/collections/"},
+            {"path": "/store/products/"},
+        )["responses"]
+        titles = [[item["title"] for item in r["body"]] for r in responses[::2]]
+        self.assertNotIn("Hats", titles[0])
+        self.assertEqual(responses[1]["status"], 201)
+        self.assertIn("Hats", titles[1])
+
+    def test_invalid_batches(self):
+        self.batch(status=400)
+        self.batch({"path": "/auth/users/me/"}, status=400)
+        self.batch({"path": "/store/batch/", "method": "POST"}, status=400)
+        self.batch({"path": "/store/async/products/"}, status=400)
+        self.batch({"path": "/store/products/", "method": "TRACE"}, status=400)
+        with override_settings(BATCH={"MAX_REQUESTS": 1}):
+            self.batch(
+                {"path": "/store/products/"}, {"path": "/store/products/"}, status=400
+            )
+
+    def pinned(self):
+        key = ReplicaRoutingMiddleware(None).pin_key(RequestFactory().post("/"))
+        return bool(cache.get(key))
+
+    @override_settings(READ_REPLICAS={"ALIASES": [], "STICKY_SECONDS": 5})
+    def test_only_batches_that_write_pin_to_the_primary(self):
+        self.batch({"path": "/store/collections/"})
+        self.assertFalse(self.pinned())
+        self.batch(
+            {"method": "POST", "path": "/store/collections/", "body": {"title": ""}}
+        )
+        self.assertFalse(self.pinned())
+        self.batch(
+            {"method": "POST", "path": "/store/collections/", "body": {"title": "Hats"}}
+        )
+        self.assertTrue(self.pinned())
+
+    @override_settings(
+        MIDDLEWARE=[
+            *(
+                name
+                for name in settings.MIDDLEWARE
+                if name != "core.middleware.WriteQueueMiddleware"
+            ),
+            "core.middleware.WriteQueueMiddleware",
+        ]
+    )
+    def test_writes_take_the_write_queue_one_at_a_time(self):
+        held = []
+        acquire = middleware.write_queue.acquire
+
+        def tracked(timeout):
+            held.append(True)
+            return acquire(timeout)
+
+        with mock.patch.object(middleware.write_queue, "acquire", tracked):
+            responses = self.batch(
+                {"path": "/store/collections/"},
+                {
+                    "method": "POST",
+                    "path": "/store/collections/",
+                    "body": {"title": "a"},
+                },
+                {"path": "/store/products/"},
+                {
+                    "method": "POST",
+                    "path": "/store/collections/",
+                    "body": {"title": "b"},
+                },
+            )["responses"]
+            # Not the batch itself, nor its reads
+            self.assertEqual(len(held), 2)
+            self.client.post("/store/collections/", {"title": "c"})
+            self.assertEqual(len(held), 3)
+        self.assertEqual([item["status"] for item in responses], [200, 201, 200, 201])
+
+    def queries(self, response):
+        # From the Server-Timing header of core.middleware.MetricsMiddleware
+        timing = re.search(r'desc="(\d+) queries"', response["Server-Timing"])
+        return int(timing.group(1))
+
+    @override_settings(QUERY_LOG={"SLOW_MS": 0})
+    def test_parallel_reads_are_in_the_batch_metrics_and_query_log(self):
+        paths = ["/store/collections/", "/store/products/"]
+        for path in paths:
+            # Fills the per-process caches (content types) first
+            self.client.get(path)
+        alone = 0
+        for path in paths:
+            get_cache().clear()
+            alone += self.queries(self.client.get(path))
+        get_cache().clear()
+        with self.assertLogs("core.querylog") as logs:
+            response = self.client.post(
+                "/store/batch/",
+                {"requests": [{"path": path} for path in paths]},
+                format="json",
+            )
+        self.assertGreaterEqual(self.queries(response), alone)
+        tables = {
+            table
+            for record in logs.records
+            for table in ["store_collection", "store_product"]
+            if table in record.query_log.get("sql", "")
+        }
+        self.assertEqual(tables, {"store_collection", "store_product"})
+
+    async def test_sub_requests_under_asgi_are_asgi_requests(self):
+        seen = []
+        handle = batch.handle
+
+        def tracked(request):
+            seen.append(type(request))
+            return handle(request)
+
+        with mock.patch.object(batch, "handle", tracked):
+            response = await self.async_client.post(
+                "/store/batch/",
+                {"requests": [{"path": "/store/collections/"}]},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(seen, [ASGIRequest])
+
+
+class ShardMapTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.map_file = os.path.join(directory, "shardmap.json")
+        settings = override_settings(
+            SHARDING={"SHARDS": ["s0", "s1"], "BUCKETS": 8, "MAP_FILE": self.map_file}
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch.object(sharding, "shard_map", ShardMap())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_buckets_go_round_robin(self):
+        self.assertEqual(sharding.shard_for_customer(3), "s1")
+        self.assertEqual(sharding.shard_for_customer(10), "s0")
+        cart_id = UUID("6f1c9d9e-6a67-4c0e-9a43-3b1a3f3f1d2a")
+        bucket = sharding.bucket_for_cart(cart_id)
+        self.assertEqual(sharding.bucket_for_cart(str(cart_id)), bucket)
+        self.assertEqual(sharding.shard_for_cart(cart_id), ["s0", "s1"][bucket % 2])
+        # Finds nothing wherever it looks
+        self.assertEqual(sharding.shard_for_cart("not a uuid"), "s0")
+
+    def test_instances_go_with_their_key(self):
+        self.assertEqual(sharding.shard_for_instance(Customer(pk=3)), "s1")
+        self.assertEqual(sharding.shard_for_instance(Order(customer_id=3)), "s1")
+        cart = Cart()
+        self.assertEqual(
+            sharding.shard_for_instance(CartItem(cart_id=cart.pk)),
+            sharding.shard_for_instance(cart),
+        )
+        self.assertIsNone(sharding.shard_for_instance(Product()))
+
+    def test_moved_buckets_are_seen_by_other_workers(self):
+        sharding.shard_map.move_bucket(3, "s0")
+        self.assertEqual(sharding.shard_for_customer(3), "s0")
+        self.assertEqual(sharding.shard_for_customer(11), "s0")
+        self.assertEqual(ShardMap().alias_for_bucket(3), "s0")
+        with open(self.map_file) as file:
+            self.assertEqual(json.load(file), {"3": "s0"})
+
+    @override_settings(SHARDING={})
+    def test_no_shards(self):
+        self.assertEqual(sharding.shard_for_customer(3), "default")
+        self.assertEqual(sharding.shard_for_cart(uuid4()), "default")
+        self.assertEqual(sharding.locate(Cart, uuid4()), "default")
+
+
+class OrderTestCase:
+    # Orders and carts are on the shards when there are some, which are read
+    # from other threads (sharding.scatter), so nothing is left uncommitted
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="buyer", email="buyer@example.com", password="x"
+        )
+        self.customer = Customer.objects.get(user=self.user)
+        collection = Collection.objects.create(title="Shoes")
+        self.product = Product.objects.create(
+            title="Red Shoes",
+            slug="s",
+            unit_price=2,
+            inventory=5,
+            collection=collection,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def cart(self, alias=None):
+        # On the given shard
+        while True:
+            cart_id = uuid4()
+            if alias is None or sharding.shard_for_cart(cart_id) == alias:
+                break
+        db = sharding.shard_for_cart(cart_id)
+        cart = Cart.objects.using(db).create(id=cart_id)
+        CartItem.objects.using(db).create(cart=cart, product=self.product, quantity=3)
+        return cart
+
+    def orders(self, customer=None):
+        customer = customer or self.customer
+        return Order.objects.using(sharding.shard_for_customer(customer.id))
+
+    def carts(self, cart):
+        return Cart.objects.using(sharding.shard_for_cart(cart.pk)).filter(pk=cart.pk)
+
+    def place(self, cart):
+        response = self.client.post("/store/orders/", {"cart_id": str(cart.pk)})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OrderTests(OrderTestCase, TransactionTestCase):
+    def test_placing_an_order_empties_the_cart(self):
+        cart = self.cart()
+        data = self.place(cart)
+        self.assertEqual(data["items"][0]["quantity"], 3)
+        self.assertEqual(self.orders().get().cart_id, cart.pk)
+        self.assertFalse(self.carts(cart).exists())
+
+    def test_a_cart_left_behind_returns_its_order(self):
+        cart = self.cart()
+        order = self.orders().create(customer=self.customer, cart_id=cart.pk)
+        self.assertEqual(self.place(cart)["id"], order.id)
+        self.assertEqual(self.orders().count(), 1)
+        self.assertFalse(self.carts(cart).exists())
+
+    def test_other_customers_cant_reorder_a_cart(self):
+        cart = self.cart()
+        other = get_user_model().objects.create_user(
+            username="other", email="other@example.com", password="x"
+        )
+        # On the same shard
+        self.orders().create(customer=Customer.objects.get(user=other), cart_id=cart.pk)
+        response = self.client.post("/store/orders/", {"cart_id": str(cart.pk)})
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(
+    len(set(sharding.all_shards()) - {"default"}) > 1,
+    "needs shards, e.g. with storefront.settings_shards",
+)
+@override_settings(CACHES=LOCMEM_CACHES)
+class ShardedTests(OrderTestCase, TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sharding_settings = override_settings(
+            SHARDING={
+                **settings.SHARDING,
+                "MAP_FILE": os.path.join(directory, "shardmap.json"),
+            }
+        )
+        sharding_settings.enable()
+        self.addCleanup(sharding_settings.disable)
+        patcher = mock.patch.object(sharding, "shard_map", ShardMap())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+        self.order_db = sharding.shard_for_customer(self.customer.id)
+        self.other_db = next(
+            alias for alias in sharding.all_shards() if alias != self.order_db
+        )
+
+    def test_locate(self):
+        cart = self.cart(self.other_db)
+        self.assertEqual(sharding.locate(Cart, cart.pk), self.other_db)
+        self.assertIsNone(sharding.locate(Cart, uuid4()))
+        self.assertIsNone(sharding.locate(Cart, "not a uuid"))
+
+    def test_orders_from_a_cart_on_another_shard(self):
+        cart = self.cart(self.other_db)
+        data = self.place(cart)
+        self.assertTrue(
+            Order.objects.using(self.order_db).filter(pk=data["id"]).exists()
+        )
+        self.assertFalse(Cart.objects.using(self.other_db).filter(pk=cart.pk).exists())
+
+    def test_a_failed_cart_delete_is_retried_by_placing_again(self):
+        cart = self.cart(self.other_db)
+        with mock.patch.object(
+            Cart.objects.get_queryset().__class__, "delete", side_effect=OSError
+        ):
+            with self.assertRaises(OSError):
+                self.client.post("/store/orders/", {"cart_id": str(cart.pk)})
+        # The order committed, the cart stayed
+        order = Order.objects.using(self.order_db).get(cart_id=cart.pk)
+        self.assertTrue(Cart.objects.using(self.other_db).filter(pk=cart.pk).exists())
+        self.assertEqual(self.place(cart)["id"], order.id)
+        self.assertEqual(Order.objects.using(self.order_db).count(), 1)
+        self.assertFalse(Cart.objects.using(self.other_db).filter(pk=cart.pk).exists())
+
+    def test_reshard_moves_a_bucket(self):
+        data = self.place(self.cart(self.order_db))
+        bucket = sharding.bucket_for_customer(self.customer.id)
+        call_command("reshard", bucket, self.other_db, stdout=open(os.devnull, "w"))
+        self.assertEqual(sharding.shard_for_customer(self.customer.id), self.other_db)
+        self.assertTrue(
+            Order.objects.using(self.other_db).filter(pk=data["id"]).exists()
+        )
+        self.assertFalse(Order.objects.using(self.order_db).exists())
+        response = self.client.get(f"/store/orders/{data['id']}/")
+        self.assertEqual(response.status_code, 200)
@@ -1,5 +1,5 @@
 from django.urls import path, include
-from . import views
+from . import async_views, views
 
 # from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
@@ -20,9 +20,24 @@ carts_router = routers.NestedDefaultRouter(router, "carts", lookup="cart")
 carts_router.register("items", views.CartItemViewSet, basename="cart-items")
 
 urlpatterns = [
+    path("autocomplete/", views.autocomplete, name="autocomplete"),
+    path("batch/", views.batch, name="batch"),
     path("", include(router.urls)),
     path("", include(products_router.urls)),
-    path("", include(carts_router.urls))
+    path("", include(carts_router.urls)),
+    # Async (ASGI) variants of the catalog reads
+    path("async/products/", async_views.AsyncProductView.as_view()),
+    path("async/products/<int:pk>/", async_views.AsyncProductView.as_view()),
+    path(
+        "async/products/<int:product_pk>/reviews/",
+        async_views.AsyncReviewView.as_view(),
+    ),
+    path(
+        "async/products/<int:product_pk>/reviews/<int:pk>/",
+        async_views.AsyncReviewView.as_view(),
+    ),
+    path("async/collections/", async_views.AsyncCollectionView.as_view()),
+    path("async/collections/<int:pk>/", async_views.AsyncCollectionView.as_view()),
     # Commented out below urls because we no longer need them
     # path("products/", views.ProductList.as_view(), name="product_list"),
     # path("products/<int:pk>/", views.ProductDetail.as_view(), name="product_detail"),
@@ -2,7 +2,7 @@ from django.db.models import Count
 from django.shortcuts import render, get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.response import Response
@@ -22,6 +22,14 @@ from rest_framework.permissions import (
 )
 from rest_framework import status
 
+from core.expand import ExpandMixin
+from core.metrics import MetricsViewMixin
+from core.middleware import queues_own_writes
+from core.streaming import StreamingListMixin
+from likes.models import LikedItem
+
+from .autocomplete import autocomplete as autocomplete_service
+from .batch import run_batch
 from .filters import ProductFilter
 from .models import (
     Product,
@@ -45,8 +53,16 @@ from .serializers import (
     OrderSerializer,
     CreateOrderSerializer,
     UpdateOrderSerializer,
+    BatchSerializer,
 )
 from .pagination import DefaultPagination
+from .sharding import (
+    all_shards,
+    locate,
+    scatter,
+    shard_for_cart,
+    shard_for_customer,
+)
 from .permissions import (
     IsAdminOrReadOnly,
     FullDjangoModelPermissions,
@@ -59,9 +75,12 @@ from .permissions import (
 # PATCH is used to update some fields
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ExpandMixin, MetricsViewMixin, ModelViewSet):
     queryset = Product.objects.all()
 
+    # ?expand=, one query per relation for the whole page
+    expand_prefetches = {"collection": "collection", "promotions": "promotions"}
+
     # For Generic Filtering
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -82,11 +101,26 @@ class ProductViewSet(ModelViewSet):
     # PermissionsClass
     permission_classes = [IsAdminOrReadOnly]
 
+    def get_queryset(self):
+        # Whether the user liked each product, in the same query. Only logged in
+        # users get it, SnapshotMiddleware and SingleFlightMiddleware share the
+        # anonymous responses
+        queryset = super().get_queryset()
+        if self.request.user.is_authenticated:
+            queryset = LikedItem.objects.annotate_liked(queryset, self.request.user)
+        return queryset
+
     def get_serializer_context(self):
-        return {"request": self.request}
+        return {"request": self.request, "expand": self.get_expand()}
 
     def destroy(self, request, *args, **kwargs):
-        if OrderItem.objects.filter(product_id=kwargs["pk"]).count() > 0:
+        # Order items are spread over the shards
+        order_items = scatter(
+            lambda alias: OrderItem.objects.using(alias)
+            .filter(product_id=kwargs["pk"])
+            .count()
+        )
+        if sum(order_items) > 0:
             return Response(
                 {"error": "Product can't be deleted, associated with an order"},
                 status=status.HTTP_405_METHOD_NOT_ALLOWED,
@@ -121,7 +155,7 @@ class CollectionDetail(RetrieveUpdateDestroyAPIView):
 
 
 # Note that you can set ModelViewSet to ReadOnlyModelViewSet to allow read-only functions
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(MetricsViewMixin, ModelViewSet):
     queryset = Collection.objects.annotate(products_count=Count("products"))
     serializer_class = CollectionSerializer
 
@@ -143,7 +177,7 @@ class CollectionViewSet(ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(MetricsViewMixin, StreamingListMixin, ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
 
@@ -156,6 +190,8 @@ class ReviewViewSet(ModelViewSet):
 
 # class CartViewSet(ModelViewSet):
 class CartViewSet(
+    MetricsViewMixin,
+    StreamingListMixin,
     RetrieveModelMixin,
     CreateModelMixin,
     DestroyModelMixin,
@@ -165,11 +201,29 @@ class CartViewSet(
     queryset = Cart.objects.prefetch_related("items__product").all()
     serializer_class = CartSerizalizer
 
+    def get_queryset(self):
+        # A cart lives on the shard its id hashes to
+        if "pk" in self.kwargs:
+            return self.queryset.using(shard_for_cart(self.kwargs["pk"]))
+        return self.queryset
+
+    def list(self, request, *args, **kwargs):
+        if self.wants_stream(request):
+            return self.stream_list(request)
+        carts = scatter(lambda alias: list(self.queryset.using(alias)))
+        serializer = self.get_serializer(
+            [cart for shard_carts in carts for cart in shard_carts], many=True
+        )
+        return Response(serializer.data)
+
+    def get_stream_querysets(self):
+        return [self.queryset.using(alias) for alias in all_shards()]
+
     def get_serializer_context(self):
         return {"request": self.request}
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(MetricsViewMixin, ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
 
     def get_serializer_context(self):
@@ -183,12 +237,16 @@ class CartItemViewSet(ModelViewSet):
         return CartItemSerializer
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related(
-            "product"
+        # Products aren't on the cart's shard, so they can't be joined
+        cart_id = self.kwargs["cart_pk"]
+        return (
+            CartItem.objects.using(shard_for_cart(cart_id))
+            .filter(cart_id=cart_id)
+            .prefetch_related("product")
         )
 
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(MetricsViewMixin, StreamingListMixin, ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
 
@@ -221,9 +279,13 @@ class CustomerViewSet(ModelViewSet):
         return Response("OK")
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ExpandMixin, MetricsViewMixin, StreamingListMixin, ModelViewSet):
     permission_classes = [IsAuthenticated]
 
+    # Customers and products are on the default database, whatever the shard
+    # of the orders
+    expand_prefetches = {"customer": "customer", "items.product": "items__product"}
+
     http_method_names = ["get", "post", "patch", "delete", "head", "options"]
 
     def get_permissions(self):
@@ -250,11 +312,81 @@ class OrderViewSet(ModelViewSet):
         return OrderSerializer
 
     def get_serializer_context(self):
-        return {"user_id": self.request.user.id}
+        return {"user_id": self.request.user.id, "expand": self.get_expand()}
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_staff or self.wants_stream(request):
+            return super().list(request, *args, **kwargs)
+        # Staff see the orders of every shard
+        orders = scatter(lambda alias: list(self.get_shard_queryset(alias)))
+        serializer = self.get_serializer(
+            sorted(
+                (order for shard_orders in orders for order in shard_orders),
+                key=lambda order: order.pk,
+            ),
+            many=True,
+        )
+        return Response(serializer.data)
+
+    def get_stream_querysets(self):
+        if not self.request.user.is_staff:
+            return super().get_stream_querysets()
+        # Staff see the orders of every shard
+        return [self.get_shard_queryset(alias) for alias in all_shards()]
+
+    def get_shard_queryset(self, alias):
+        # Every order is rendered with its items and their products
+        return self.expand_queryset(
+            Order.objects.using(alias).prefetch_related("items__product")
+        )
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all()
-        customer_id = Customer.objects.only("id").get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+            alias = locate(Order, self.kwargs["pk"]) if "pk" in self.kwargs else None
+            return self.get_shard_queryset(alias or "default")
+        customer_id = Customer.objects.only("id").get(user_id=user.id).id
+        return self.get_shard_queryset(shard_for_customer(customer_id)).filter(
+            customer_id=customer_id
+        )
+
+
+# Prefix search over the in-memory autocomplete indexes, e.g. /store/autocomplete/?q=sh&type=products
+@api_view()
+def autocomplete(request):
+    term = request.query_params.get("q", "")
+    try:
+        limit = min(int(request.query_params.get("limit", 10)), 50)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return Response(
+            {"error": "limit must be a whole number of at least 1"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    names = request.query_params.get("type")
+    names = names.split(",") if names else autocomplete_service.sources.keys()
+
+    results = {}
+    for name in names:
+        source = autocomplete_service.sources.get(name)
+        if source is None:
+            return Response(
+                {"error": f"Unknown autocomplete type '{name}'"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if source.staff_only and not request.user.is_staff:
+            continue
+        results[name] = source.suggestions(term, limit) if term else []
+    return Response(results)
+
+
+# Several store API calls in one round trip, see store.batch
+@queues_own_writes
+@api_view(["POST"])
+def batch(request):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response(
+        {"responses": run_batch(request, serializer.validated_data["requests"])}
+    )
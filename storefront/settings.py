@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 from datetime import timedelta
 
@@ -49,15 +50,52 @@ INSTALLED_APPS = [
     "core",
 ]
 
+# The API is measured and logged, the admin and the playground keep sessions,
+# CSRF and messages, each prefix with its own chain (core.middleware.
+# PathMiddlewareRouter, the longest prefix wins)
+API_MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ProfilingMiddleware",
+    "core.middleware.QueryLogMiddleware",
+    "django.middleware.common.CommonMiddleware",
+]
+
+PATH_MIDDLEWARE = {
+    # JWT only, no sessions, cookies or templates
+    "/store/": [
+        "core.middleware.MetricsMiddleware",
+        "core.middleware.ProfilingMiddleware",
+        "core.middleware.QueryLogMiddleware",
+        "store.middleware.SnapshotMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "core.middleware.ReplicaRoutingMiddleware",
+        "core.middleware.SingleFlightMiddleware",
+    ],
+    "/auth/": API_MIDDLEWARE,
+    "/likes/": API_MIDDLEWARE,
+    # Scraped with a JWT, or opened by a staff member logged in to the admin
+    "/metrics": [
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+    ],
+    "": [
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "django.middleware.csrf.CsrfViewMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "django.contrib.messages.middleware.MessageMiddleware",
+        "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    ],
+}
+
+# The admin's checks only look at MIDDLEWARE, the "" chain has what it needs
+SILENCED_SYSTEM_CHECKS = ["admin.E408", "admin.E409", "admin.E410"]
+
 MIDDLEWARE = [
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
-    "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware.PathMiddlewareRouter",
 ]
 
 INTERNAL_IPS = [
@@ -100,16 +138,48 @@ WSGI_APPLICATION = "storefront.wsgi.application"
 #     }
 # }
 
+# core.db.backends.mysql is the MySQL backend with a per-worker connection pool:
+# connections are handed back to the pool at the end of a request instead of
+# being closed, so leave CONN_MAX_AGE at 0. Pool stats are at /metrics/db-pool/.
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.mysql",
+        "ENGINE": "core.db.backends.mysql",
         "NAME": "storefront2",
         "HOST": "localhost",
         "USER": "root",
         "PASSWORD": "mnirayyans1",
+        "POOL": {
+            "MIN_SIZE": 2,
+            "MAX_SIZE": 20,
+            "TIMEOUT": 5,
+            "RECYCLE": 1800,
+            "PRE_PING": True,
+        },
     }
 }
 
+DATABASE_ROUTERS = ["core.routers.ShardRouter", "core.routers.PrimaryReplicaRouter"]
+
+# Orders and carts are spread over these databases by customer / cart id (see
+# store.sharding), leave SHARDS empty to keep everything on "default".
+# MAP_FILE records the buckets moved by manage.py reshard.
+SHARDING = {
+    "SHARDS": [],
+    "BUCKETS": 64,
+    "MAP_FILE": BASE_DIR / "shardmap.json",
+}
+
+# Safe requests to the catalog views read from these databases (see core.routers).
+# A client sticks to the primary for STICKY_SECONDS after a write, and a replica
+# that fails its health check is skipped for RETRY_AFTER seconds.
+READ_REPLICAS = {
+    "ALIASES": [],
+    "VIEW_MODULES": ["store.views", "store.async_views"],
+    "STICKY_SECONDS": 5,
+    "HEALTH_CHECK_INTERVAL": 10,
+    "RETRY_AFTER": 30,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -158,8 +228,26 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    # orjson when installed, same output as the stock JSON renderer (see
+    # core.renderers)
+    "DEFAULT_RENDERER_CLASSES": [
+        "core.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "core.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
+# application/msgpack for internal services, when msgpack is installed
+if find_spec("msgpack"):
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"].append(
+        "core.renderers.MessagePackRenderer"
+    )
+    REST_FRAMEWORK["DEFAULT_PARSER_CLASSES"].append("core.renderers.MessagePackParser")
+
 
 # When extending the user model
 AUTH_USER_MODEL = "core.user"
@@ -172,6 +260,155 @@ DJOSER = {
     }
 }
 
+# The per-worker tag index (tags.index) behind ?tags= on products. It's rebuilt
+# when the tag tables change in another worker, CHECK_INTERVAL seconds later at
+# most.
+TAG_INDEX = {
+    "CHECK_INTERVAL": 1,  # seconds
+}
+
+# Per-worker prefix indexes behind /store/autocomplete/ and the admin search
+# (store.autocomplete), rebuilt when their tables change in another worker,
+# CHECK_INTERVAL seconds later at most. Admin searches matching more than
+# MAX_ADMIN_IDS rows go to the database instead.
+AUTOCOMPLETE = {
+    "CHECK_INTERVAL": 5,  # seconds
+    "MAX_ADMIN_IDS": 500,
+}
+
+# Like counts are buffered per worker and flushed to likes.LikeCounter
+LIKES = {
+    "FLUSH_INTERVAL": 5,  # seconds
+    "FLUSH_THRESHOLD": 500,  # distinct objects waiting to be flushed
+    # Per-user liked bitsets for heavy likers, 0 turns the cache off
+    "BITSET_CACHE_USERS": 1000,
+    "BITSET_CACHE_BYTES": 16 * 1024 * 1024,
+    "BITSET_MIN_LIKES": 200,
+}
+
+# Per-route request metrics (core.metrics), served to admins at /metrics. Every
+# worker writes its aggregates to DIR so any of them can report for all.
+METRICS = {
+    "DIR": BASE_DIR / "metrics",
+    "FLUSH_INTERVAL": 10,  # seconds
+    # files not written for this many flush intervals are of stopped workers
+    "STALE_INTERVALS": 3,
+    "BUCKETS": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+}
+
+# On-demand request profiling (core.profiling), results in the admin under
+# Profile records. `manage.py profile_token` prints a header to profile one
+# request, SAMPLE_RATES profiles a share of a route, e.g. {"orders-list": 0.01}.
+PROFILING = {
+    "HEADER": "X-Profile",
+    "TOKEN_MAX_AGE": 3600,  # seconds
+    "SAMPLE_RATES": {},
+    "INTERVAL": 0.005,  # seconds between stack samples
+    "TRACEMALLOC": True,
+    "TRACEMALLOC_FRAMES": 10,
+    "TOP_ALLOCATIONS": 20,
+}
+
+# Slow, repeated (N+1) and duplicate queries per request (core.querylog),
+# written to querylog.jsonl. Sum them up with `manage.py querylog_summary`.
+QUERY_LOG = {
+    "SLOW_MS": 100,
+    "N_PLUS_ONE_THRESHOLD": 5,  # runs of the same query shape in a request
+    "FILE": BASE_DIR / "querylog.jsonl",
+}
+
+# A per-worker LRU in front of the cache all the workers share (core.cache).
+# Only "store:" keys are kept in the LRU, the rest (replica pins, like
+# versions) go straight to the shared cache.
+CACHES = {
+    "default": {
+        "BACKEND": "core.cache.TwoTierCache",
+        "LOCATION": "default",
+        "TIMEOUT": 300,
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_TIMEOUT": 30,
+            "MAX_ENTRIES": 1000,
+            "MAX_BYTES": 8 * 1024 * 1024,
+            "MAX_ITEM_BYTES": 64 * 1024,
+            "LOCAL_PREFIXES": ["store:"],
+            "GENERATION_INTERVAL": 1,  # seconds between checks for writes elsewhere
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# Cached querysets (core.querycache), invalidated whenever a write touches one
+# of their tables
+QUERY_CACHE = {
+    "CACHE": "default",
+    "TIMEOUT": 300,
+    "MAX_ROWS": 1000,  # bigger results aren't cached
+    # seconds replica reads reuse the table versions their worker last read
+    "VERSION_TTL": 1,
+}
+
+# Identical concurrent anonymous catalog GETs run the view once
+# (core.middleware.SingleFlightMiddleware). With a CACHE, once across workers.
+SINGLE_FLIGHT = {
+    "PREFIXES": ["/store/products/", "/store/collections/"],
+    "TIMEOUT": 5,  # seconds a duplicate waits before running the view itself
+    "CACHE": None,
+}
+
+# /store/batch/ (store.batch)
+BATCH = {
+    "MAX_REQUESTS": 20,
+    "WORKERS": 4,  # threads per worker process running the GETs of batches
+}
+
+# Pre-rendered catalog responses (store.snapshots), built with
+# `manage.py build_snapshots` and served by store.middleware.SnapshotMiddleware.
+# HOST and SCHEME are the ones the pagination links are rendered for. Workers
+# stop serving them CHECK_INTERVAL seconds at most after a product or collection
+# write, until one of them has rendered them again.
+SNAPSHOTS = {
+    "DIR": BASE_DIR / "snapshots",
+    "PAGES": 3,  # of the product list and of every collection
+    "TOP_PRODUCTS": 200,
+    "HOST": "127.0.0.1:8000",
+    "SCHEME": "http",
+    "SENDFILE": None,  # "X-Accel-Redirect" (nginx) or "X-Sendfile"
+    "SENDFILE_URL": "/snapshots/",  # internal location for X-Accel-Redirect
+    "CHECK_INTERVAL": 1,
+    "REBUILD_TIMEOUT": 600,  # seconds before another worker may try again
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "core.querylog.JSONFormatter"},
+    },
+    "handlers": {
+        "querylog": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": QUERY_LOG["FILE"],
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "formatter": "json",
+            "delay": True,
+        },
+    },
+    "loggers": {
+        "core.querylog": {
+            "handlers": ["querylog"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
     "AUTH_HEADER_TYPES": ("JWT",),
@@ -0,0 +1,47 @@
+"""
+Settings for API-only worker processes.
+
+    DJANGO_SETTINGS_MODULE=storefront.settings_api gunicorn storefront.wsgi
+
+Same as storefront.settings_prod without the admin, messages, sessions,
+static files, the playground and the template engine, which API requests
+never use, so a worker boots with far fewer imports. Route /admin/ to
+workers running storefront.settings_prod. Compare with
+
+    python manage.py profile_startup --settings-module storefront.settings_api
+"""
+
+from .settings_prod import *
+
+SKIPPED_APPS = {
+    "django.contrib.admin",
+    "django.contrib.messages",
+    "django.contrib.sessions",
+    "django.contrib.staticfiles",
+    "playground",
+}
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in SKIPPED_APPS]
+
+MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ProfilingMiddleware",
+    "core.middleware.QueryLogMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "store.middleware.SnapshotMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "core.middleware.ReplicaRoutingMiddleware",
+    "core.middleware.SingleFlightMiddleware",
+]
+
+TEMPLATES = []
+
+# No browsable API without templates
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    "DEFAULT_RENDERER_CLASSES": [
+        renderer
+        for renderer in REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"]
+        if renderer != "rest_framework.renderers.BrowsableAPIRenderer"
+    ],
+}
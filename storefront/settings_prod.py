@@ -0,0 +1,57 @@
+"""
+Production settings.
+
+    DJANGO_SETTINGS_MODULE=storefront.settings_prod gunicorn storefront.wsgi
+
+Secrets and hosts come from the environment: DJANGO_SECRET_KEY,
+DJANGO_ALLOWED_HOSTS (comma separated) and DATABASE_PASSWORD.
+
+The API (/store/, /auth/, /likes/, /metrics) gets a minimal middleware chain through
+core.middleware.PathMiddlewareRouter (PATH_MIDDLEWARE in storefront.settings),
+the admin and everything else keeps the full stack. `manage.py bench_middleware`
+measures the difference.
+"""
+
+import os
+
+from .settings import *
+
+DEBUG = False
+
+SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",")
+
+DATABASES = {
+    **DATABASES,
+    "default": {
+        **DATABASES["default"],
+        "PASSWORD": os.environ.get("DATABASE_PASSWORD", ""),
+    },
+}
+
+# Behind nginx, which terminates TLS and must set (not pass on) both headers:
+#   proxy_set_header X-Forwarded-Proto $scheme;
+#   proxy_set_header X-Forwarded-Host $host;
+# Without them request.scheme is "http", so the snapshots (SCHEME "https") are
+# never served and the pagination links point to http://
+SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
+USE_X_FORWARDED_HOST = True
+
+# nginx also sends the snapshot files itself
+SNAPSHOTS = {
+    **SNAPSHOTS,
+    "HOST": os.environ.get("DJANGO_SNAPSHOTS_HOST", ALLOWED_HOSTS[0]),
+    "SCHEME": "https",
+    "SENDFILE": "X-Accel-Redirect",
+}
+
+SINGLE_FLIGHT = {**SINGLE_FLIGHT, "CACHE": "default"}
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != "debug_toolbar"]
+
+# The chains of PATH_MIDDLEWARE, without the debug toolbar
+MIDDLEWARE = [
+    "django.middleware.security.SecurityMiddleware",
+    "core.middleware.PathMiddlewareRouter",
+]
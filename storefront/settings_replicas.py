@@ -0,0 +1,25 @@
+"""
+Local primary/replica setup on SQLite files, to try out core.routers.
+
+    cp db.sqlite3 db-replica.sqlite3
+    DJANGO_SETTINGS_MODULE=storefront.settings_replicas python manage.py runserver
+
+Nothing replicates between the two files, copy the primary again to refresh
+the replica.
+"""
+
+from .settings import *
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    },
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db-replica.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+READ_REPLICAS = {**READ_REPLICAS, "ALIASES": ["replica"]}
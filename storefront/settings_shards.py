@@ -0,0 +1,27 @@
+"""
+Local sharded setup on SQLite files, to try out store.sharding.
+
+    DJANGO_SETTINGS_MODULE=storefront.settings_shards python manage.py migrate
+    DJANGO_SETTINGS_MODULE=storefront.settings_shards python manage.py migrate --database shard0
+    DJANGO_SETTINGS_MODULE=storefront.settings_shards python manage.py migrate --database shard1
+    DJANGO_SETTINGS_MODULE=storefront.settings_shards python manage.py runserver
+"""
+
+from .settings import *
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    },
+    "shard0": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db-shard0.sqlite3",
+    },
+    "shard1": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db-shard1.sqlite3",
+    },
+}
+
+SHARDING = {**SHARDING, "SHARDS": ["shard0", "shard1"]}
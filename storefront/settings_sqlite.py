@@ -0,0 +1,49 @@
+"""
+Embedded SQLite setup for small single-server storefronts.
+
+    DJANGO_SETTINGS_MODULE=storefront.settings_sqlite python manage.py migrate
+    DJANGO_SETTINGS_MODULE=storefront.settings_sqlite python manage.py runserver
+
+The database runs in WAL mode, so readers don't block behind a writer. Reads of
+the catalog views go through their own read-only connections ("reader") and
+writes are queued one at a time by core.middleware.WriteQueueMiddleware. Writes
+from other worker processes wait on busy_timeout.
+
+`manage.py bench_sqlite` compares this setup with plain SQLite.
+"""
+
+from .settings import *
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Safe in WAL mode, a power loss can only lose the last transactions
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ms
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,  # KiB
+    "temp_store": "MEMORY",
+}
+
+DATABASES = {
+    "default": {
+        "ENGINE": "core.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        "PRAGMAS": SQLITE_PRAGMAS,
+        "TRANSACTION_MODE": "IMMEDIATE",
+        "POOL": {"MAX_SIZE": 4},
+    },
+    "reader": {
+        "ENGINE": "core.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        "PRAGMAS": {**SQLITE_PRAGMAS, "query_only": "ON"},
+        "POOL": {"MAX_SIZE": 16},
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+# Both connections see the same file, so there's no replication lag to wait out
+READ_REPLICAS = {**READ_REPLICAS, "ALIASES": ["reader"], "STICKY_SECONDS": 0}
+
+MIDDLEWARE = [*MIDDLEWARE, "core.middleware.WriteQueueMiddleware"]
+
+WRITE_QUEUE = {"TIMEOUT": 10}
@@ -13,18 +13,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
-import debug_toolbar
-
-admin.site.site_header = "Storefront Admin"
-admin.site.index_title = "Admin"
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
-    path("playground/", include("playground.urls")),
     path("store/", include("store.urls")),
-    path("__debug__/", include(debug_toolbar.urls)),
+    path("likes/", include("likes.urls")),
+    path("", include("core.urls")),
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.jwt")),
 ]
+
+# API-only workers (storefront.settings_api) don't have these, and don't import
+# them either
+if "django.contrib.admin" in settings.INSTALLED_APPS:
+    from django.contrib import admin
+
+    admin.site.site_header = "Storefront Admin"
+    admin.site.index_title = "Admin"
+
+    urlpatterns.append(path("admin/", admin.site.urls))
+
+if "playground" in settings.INSTALLED_APPS:
+    urlpatterns.append(path("playground/", include("playground.urls")))
+
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    import debug_toolbar
+
+    urlpatterns.append(path("__debug__/", include(debug_toolbar.urls)))
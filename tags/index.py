@@ -0,0 +1,159 @@
+from array import array
+from bisect import bisect_left, insort
+from heapq import merge
+from threading import RLock
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+
+from core.querycache import TableWatch
+
+from .models import Tag, TaggedItem
+
+
+# In-memory inverted index: for every content type we keep tag id -> sorted
+# array of object ids. Filtering by tags then becomes an intersection (or union)
+# of a few sorted integer arrays instead of generic-relation joins in SQL.
+# The index is per process, built lazily from TaggedItem. The signal handlers in
+# tags.signals.handlers apply this worker's changes once they commit, and the
+# index is rebuilt when the tag tables changed any other way (another worker,
+# bulk_create(), update()), seen at most TAG_INDEX["CHECK_INTERVAL"] seconds
+# later.
+
+
+def get_setting(name, default=None):
+    return getattr(settings, "TAG_INDEX", {}).get(name, default)
+
+
+def intersect(*postings):
+    if not postings:
+        return []
+    # Start from the shortest list so every other lookup is a bisect into a bigger one
+    postings = sorted(postings, key=len)
+    result = list(postings[0])
+    for posting in postings[1:]:
+        if not result:
+            break
+        result = [
+            object_id for object_id in result if _contains(posting, object_id)
+        ]
+    return result
+
+
+def union(*postings):
+    result = []
+    for object_id in merge(*postings):
+        if not result or result[-1] != object_id:
+            result.append(object_id)
+    return result
+
+
+def _contains(posting, object_id):
+    i = bisect_left(posting, object_id)
+    return i < len(posting) and posting[i] == object_id
+
+
+class TagIndex:
+    def __init__(self):
+        self._lock = RLock()
+        self._postings = None  # {content_type_id: {tag_id: array('q')}}
+        self._labels = None  # {label: {tag_id, ...}}
+        self._watch = TableWatch(
+            [Tag._meta.db_table, TaggedItem._meta.db_table],
+            get_setting("CHECK_INTERVAL", 1),
+        )
+
+    def _build(self):
+        self._watch.start()
+        postings = {}
+        items = TaggedItem.objects.order_by(
+            "content_type_id", "tag_id", "object_id"
+        ).values_list("content_type_id", "tag_id", "object_id")
+        for content_type_id, tag_id, object_id in items.iterator(chunk_size=10000):
+            posting = postings.setdefault(content_type_id, {}).setdefault(
+                tag_id, array("q")
+            )
+            if not posting or posting[-1] != object_id:
+                posting.append(object_id)
+
+        labels = {}
+        for tag_id, label in Tag.objects.values_list("id", "label"):
+            labels.setdefault(label, set()).add(tag_id)
+
+        self._postings = postings
+        self._labels = labels
+
+    def invalidate(self):
+        # The next lookup rebuilds everything from the database. Used when we can't
+        # tell what changed (e.g. a TaggedItem was edited in place).
+        with self._lock:
+            self._postings = None
+            self._labels = None
+
+    def add(self, content_type_id, tag_id, object_id):
+        with self._lock:
+            if self._postings is None:
+                return
+            posting = self._postings.setdefault(content_type_id, {}).setdefault(
+                tag_id, array("q")
+            )
+            if not _contains(posting, object_id):
+                insort(posting, object_id)
+
+    def remove(self, content_type_id, tag_id, object_id):
+        if self._postings is None:
+            return
+        # Another TaggedItem can still link the same object to the same tag.
+        # Asked before taking the lock, lookups don't wait on the database
+        if TaggedItem.objects.filter(
+            content_type_id=content_type_id, tag_id=tag_id, object_id=object_id
+        ).exists():
+            return
+        with self._lock:
+            if self._postings is None:
+                return
+            posting = self._postings.get(content_type_id, {}).get(tag_id)
+            if posting is None:
+                return
+            i = bisect_left(posting, object_id)
+            if i < len(posting) and posting[i] == object_id:
+                del posting[i]
+
+    def set_label(self, tag_id, label):
+        with self._lock:
+            if self._labels is None:
+                return
+            for tag_ids in self._labels.values():
+                tag_ids.discard(tag_id)
+            if label is not None:
+                self._labels.setdefault(label, set()).add(tag_id)
+
+    def object_ids(self, model, labels, match_all=True):
+        """
+        Returns the sorted ids of `model` instances tagged with `labels`.
+        With match_all every label has to be present, otherwise any of them will do.
+        """
+        content_type_id = ContentType.objects.get_for_model(model).id
+        with self._lock:
+            if self._postings is None or self._watch.changed():
+                self._build()
+            by_tag = self._postings.get(content_type_id, {})
+            postings = []
+            for label in labels:
+                # Labels aren't unique so one label can stand for several tags
+                label_postings = [
+                    by_tag[tag_id]
+                    for tag_id in self._labels.get(label, ())
+                    if tag_id in by_tag
+                ]
+                if len(label_postings) == 1:
+                    postings.append(list(label_postings[0]))
+                else:
+                    postings.append(union(*label_postings))
+
+        if match_all:
+            return intersect(*postings)
+        return union(*postings)
+
+
+tag_index = TagIndex()
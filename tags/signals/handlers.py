@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from store.autocomplete import autocomplete
+from tags.index import tag_index
+from tags.models import Tag, TaggedItem
+
+
+# Keep the in-memory tag index in sync with the database, once the change is
+# committed so a rolled back one never shows up
+@receiver(post_save, sender=TaggedItem)
+def index_tagged_item(sender, **kwargs):
+    item = kwargs['instance']
+    if kwargs['created']:
+        args = (item.content_type_id, item.tag_id, item.object_id)
+        transaction.on_commit(lambda: tag_index.add(*args), using=kwargs['using'])
+    else:
+        # We don't know what the item pointed at before the update
+        transaction.on_commit(tag_index.invalidate, using=kwargs['using'])
+
+
+@receiver(post_delete, sender=TaggedItem)
+def unindex_tagged_item(sender, **kwargs):
+    item = kwargs['instance']
+    args = (item.content_type_id, item.tag_id, item.object_id)
+    transaction.on_commit(lambda: tag_index.remove(*args), using=kwargs['using'])
+
+
+@receiver(post_save, sender=Tag)
+def index_tag(sender, **kwargs):
+    tag = kwargs['instance']
+    args = (tag.id, tag.label)
+    transaction.on_commit(lambda: tag_index.set_label(*args), using=kwargs['using'])
+
+
+@receiver(post_delete, sender=Tag)
+def unindex_tag(sender, **kwargs):
+    tag_id = kwargs['instance'].id
+    transaction.on_commit(
+        lambda: tag_index.set_label(tag_id, None), using=kwargs['using']
+    )
+
+
+# The autocomplete source for tags, kept up to date through post_save/post_delete
+autocomplete.register("tags", Tag, get_label=lambda tag: tag.label)
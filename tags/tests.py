@@ -1,3 +1,139 @@
-from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from store.autocomplete import autocomplete
+from store.filters import ProductFilter
+from store.models import Collection, Product
+
+from .index import tag_index
+from .models import Tag, TaggedItem
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+TAGS = {
+    "a": [0, 1, 2, 3],
+    "b": [2, 3, 4],
+    "c": [3, 5],
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TagFilterTests(TestCase):
+    def setUp(self):
+        tag_index.invalidate()
+        self.addCleanup(tag_index.invalidate)
+        collection = Collection.objects.create(title="c")
+        self.products = [
+            Product.objects.create(
+                title=f"p{i}",
+                slug=f"p{i}",
+                unit_price=1,
+                inventory=1,
+                collection=collection,
+            )
+            for i in range(6)
+        ]
+        self.content_type = ContentType.objects.get_for_model(Product)
+        self.tags = {label: Tag.objects.create(label=label) for label in TAGS}
+        for label, indexes in TAGS.items():
+            for i in indexes:
+                self.tag(self.products[i], label)
+
+    def tag(self, product, label):
+        return TaggedItem.objects.create(
+            tag=self.tags[label], content_type=self.content_type, object_id=product.id
+        )
+
+    def filtered(self, tags, match="all"):
+        data = {"tags": tags, "tags_match": match}
+        queryset = ProductFilter(data, queryset=Product.objects.all()).qs
+        return sorted(queryset.values_list("id", flat=True))
+
+    def expected(self, tags, match="all"):
+        sets = [
+            set(
+                TaggedItem.objects.filter(
+                    content_type=self.content_type, tag__label=label
+                ).values_list("object_id", flat=True)
+            )
+            for label in tags.split(",")
+        ]
+        ids = set.intersection(*sets) if match == "all" else set.union(*sets)
+        return sorted(ids)
+
+    def assertMatchesDatabase(self):
+        for tags in ["a", "a,b", "b,c", "a,b,c", "a,missing", "missing"]:
+            for match in ["all", "any"]:
+                self.assertEqual(
+                    self.filtered(tags, match),
+                    self.expected(tags, match),
+                    (tags, match),
+                )
+
+    def test_filter_matches_the_database(self):
+        self.assertMatchesDatabase()
+        self.assertEqual(self.filtered("a,b,c"), [self.products[3].id])
+
+    def test_the_ids_are_one_query_parameter(self):
+        data = {"tags": "a"}
+        queryset = ProductFilter(data, queryset=Product.objects.all()).qs
+        _, params = queryset.query.sql_with_params()
+        self.assertEqual(len(params), 1)
+
+    def test_committed_changes_show_up(self):
+        self.assertMatchesDatabase()
+        with self.captureOnCommitCallbacks(execute=True):
+            item = self.tag(self.products[5], "a")
+        self.assertIn(self.products[5].id, self.filtered("a"))
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertNotIn(self.products[5].id, self.filtered("a"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tags["c"].label = "d"
+            self.tags["c"].save()
+        self.assertEqual(self.filtered("c"), [])
+        self.assertEqual(self.filtered("d"), self.expected("d"))
+
+    def test_rolled_back_changes_dont(self):
+        self.assertMatchesDatabase()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.tag(self.products[5], "a")
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertNotIn(self.products[5].id, self.filtered("a"))
+
+    def test_writes_without_signals_show_up_after_a_check(self):
+        self.assertMatchesDatabase()
+        tag_index._watch.interval = 0
+        self.addCleanup(setattr, tag_index._watch, "interval", 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.bulk_create(
+                [
+                    TaggedItem(
+                        tag=self.tags["c"],
+                        content_type=self.content_type,
+                        object_id=self.products[0].id,
+                    )
+                ]
+            )
+        self.assertMatchesDatabase()
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.filter(tag=self.tags["b"]).delete()
+        self.assertEqual(self.filtered("b"), [])
+
+
+class TagAutocompleteTests(TestCase):
+    def test_tags_are_suggested(self):
+        autocomplete.sources["tags"]._index = None
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(label="summer")
+        response = self.client.get("/store/autocomplete/?type=tags&q=sum")
+        self.assertEqual(
+            [item["label"] for item in response.json()["tags"]], ["summer"]
+        )